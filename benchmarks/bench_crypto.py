@@ -0,0 +1,78 @@
+"""
+Микробенчмарк шифрования токенов (services/crypto.py).
+
+Замеряет на одну операцию:
+    encrypt          — encrypt_token
+    decrypt_cold     — decrypt_token без кэша (каждый раз новый шифртекст)
+    decrypt_cached   — decrypt_token повторно для того же шифртекста
+    decrypt_per_call — как было до KeyRing: base64-декод ключа и новый AESGCM
+                       на каждый вызов (точка отсчёта)
+
+Запуск:
+    python -m benchmarks.bench_crypto
+    python -m benchmarks.bench_crypto --ops 50000 --repeat 5
+"""
+
+import argparse
+import base64
+import os
+
+from benchmarks.harness import measure_time, save_results
+
+os.environ.setdefault('ENCRYPTION_KEY', base64.b64encode(os.urandom(32)).decode())
+
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM  # noqa: E402
+
+from services import crypto  # noqa: E402
+
+# Примерно как токен WB (JWT)
+TOKEN = 'eyJhbGciOiJFUzI1NiIsImtpZCI6IjIwMjUwMTAxdjEiLCJ0eXAiOiJKV1QifQ.' + 'x' * 300
+
+
+def decrypt_per_call(encrypted: str) -> str:
+    """Расшифровка без KeyRing: ключ декодируется и AESGCM создаётся на каждый вызов."""
+    key = base64.b64decode(os.environ['ENCRYPTION_KEY'])
+    data = base64.b64decode(encrypted[len(crypto.current_key_prefix()):])
+    return AESGCM(key).decrypt(data[:12], data[12:], None).decode('utf-8')
+
+
+def bench(ops: int, repeat: int) -> dict:
+    ciphertexts = [crypto.encrypt_token(TOKEN) for _ in range(ops)]
+    cached = ciphertexts[0]
+    crypto.decrypt_token(cached)
+
+    def decrypt_cold():
+        crypto._token_cache.clear()
+        for value in ciphertexts:
+            crypto.get_key_ring().decrypt(value)
+
+    cases = {
+        'encrypt': lambda: [crypto.encrypt_token(TOKEN) for _ in range(ops)],
+        'decrypt_cold': decrypt_cold,
+        'decrypt_cached': lambda: [crypto.decrypt_token(cached) for _ in range(ops)],
+        'decrypt_per_call': lambda: [decrypt_per_call(value) for value in ciphertexts],
+    }
+
+    results = {}
+    for name, fn in cases.items():
+        timing = measure_time(fn, repeat=repeat)
+        per_op = {k: v / ops for k, v in timing.items()}
+        results[name] = {'time': per_op}
+        print(f'  {name:<17} median {per_op["median"] * 1e6:8.2f} us/op   min {per_op["min"] * 1e6:8.2f} us/op')
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Бенчмарк шифрования токенов')
+    parser.add_argument('--ops', type=int, default=10_000, help='Операций в одном замере')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args(argv)
+
+    print(f'{args.ops} операций, {args.repeat} повторов')
+    results = bench(args.ops, args.repeat)
+    path = save_results('crypto', results)
+    print(f'Результаты сохранены: {path}')
+
+
+if __name__ == '__main__':
+    main()
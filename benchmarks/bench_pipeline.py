@@ -0,0 +1,98 @@
+"""
+Бенчмарк обработки отчёта на синтетических данных.
+
+Отдельно замеряет время и пик памяти стадий services/report_generator.py:
+    transform   — transform_sales_records
+    deductions  — classify_deductions
+    merge       — merge_report_frames
+    excel       — write_report_excel
+
+Запуск:
+    python -m benchmarks.bench_pipeline --presets xs s m
+    python -m benchmarks.bench_pipeline --rows 500000 --skus 10000 --repeat 5
+"""
+
+import argparse
+import asyncio
+import os
+import tempfile
+from pathlib import Path
+
+from benchmarks import datasets
+from benchmarks.harness import measure_time, measure_memory, save_results, format_bytes
+
+os.environ.setdefault('DATA_ROOT', tempfile.gettempdir())
+
+from services.report_generator import (  # noqa: E402
+    transform_sales_records, classify_deductions, merge_report_frames, write_report_excel
+)
+
+
+def bench_case(rows: int, skus: int, repeat: int, seed: int = 0, skip_excel: bool = False) -> dict:
+    """Замер всех стадий на одном наборе данных."""
+    df_raw = datasets.generate_sales_frame(rows, skus, seed)
+    cards = datasets.generate_cards_mapping(skus)
+    adv_df = datasets.generate_adv_frame(skus, seed=seed)
+    # Хранение в отчёт приходит из paid_storage (get_storage_report), а не из transform
+    storage_df = datasets.generate_storage_frame(skus, seed=seed)
+
+    sales_df, _ = asyncio.run(transform_sales_records(df_raw))
+    reviews_agg, total_other = classify_deductions(df_raw)
+    final_df = merge_report_frames(sales_df.copy(), storage_df.copy(), adv_df.copy(), reviews_agg, cards, total_other)
+
+    stages = {
+        'transform': lambda: asyncio.run(transform_sales_records(df_raw)),
+        'deductions': lambda: classify_deductions(df_raw),
+        'merge': lambda: merge_report_frames(
+            sales_df.copy(), storage_df.copy(), adv_df.copy(), reviews_agg, cards, total_other
+        ),
+    }
+
+    tmp_dir = tempfile.TemporaryDirectory()
+    if not skip_excel:
+        path = Path(tmp_dir.name) / 'report.xlsx'
+        stages['excel'] = lambda: write_report_excel(final_df, path, 'Benchmark', '2025-01-06', '2025-01-12')
+
+    result = {'rows': rows, 'skus': skus, 'output_rows': len(final_df), 'stages': {}}
+    for name, fn in stages.items():
+        timing = measure_time(fn, repeat=repeat)
+        memory = measure_memory(fn)
+        result['stages'][name] = {'time': timing, 'memory': memory}
+        print(
+            f'  {name:<11} median {timing["median"] * 1000:9.1f} ms   '
+            f'min {timing["min"] * 1000:9.1f} ms   peak {format_bytes(memory["peak_bytes"])}'
+        )
+
+    tmp_dir.cleanup()
+    return result
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Бенчмарк обработки отчёта WB')
+    parser.add_argument('--presets', nargs='*', default=['xs', 's', 'm'], choices=sorted(datasets.PRESETS))
+    parser.add_argument('--rows', type=int, help='Свой размер набора (вместо --presets)')
+    parser.add_argument('--skus', type=int, default=1_000)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--skip-excel', action='store_true', help='Не замерять запись Excel (долго на больших наборах)')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.rows:
+        cases = {f'{args.rows}x{args.skus}': (args.rows, args.skus)}
+    else:
+        cases = {name: datasets.PRESETS[name] for name in args.presets}
+
+    results = {}
+    for name, (rows, skus) in cases.items():
+        print(f'[{name}] {rows} строк, {skus} артикулов')
+        results[name] = bench_case(rows, skus, args.repeat, args.seed, args.skip_excel)
+
+    path = save_results('pipeline', results)
+    print(f'Результаты сохранены: {path}')
+
+
+if __name__ == '__main__':
+    main()
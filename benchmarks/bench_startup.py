@@ -0,0 +1,148 @@
+"""
+Время холодного старта бота: импорт main.py в свежем процессе.
+
+Каждый прогон — отдельный интерпретатор с python -X importtime, поэтому
+кэш модулей не влияет на результат. Замеряет:
+    import_main — суммарное время импорта main (по -X importtime)
+    process     — время жизни процесса целиком (интерпретатор + импорт)
+и выводит модули с наибольшим собственным временем импорта.
+
+Проверки (код выхода 1, если нарушены):
+    - медиана import_main не больше --budget секунд;
+    - после import main не загружены LAZY_MODULES (pandas, openpyxl) —
+      они нужны только генерации отчётов.
+
+Запуск:
+    python -m benchmarks.bench_startup
+    python -m benchmarks.bench_startup --runs 10 --budget 2.5 --top 20
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from pathlib import Path
+
+from benchmarks.harness import save_results
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# Модули, которые не должны загружаться при старте
+LAZY_MODULES = ('pandas', 'openpyxl', 'numpy')
+
+SCRIPT = (
+    'import json, sys\n'
+    'import main\n'
+    f'print(json.dumps([m for m in {LAZY_MODULES!r} if m in sys.modules]))\n'
+)
+
+
+def startup_env() -> dict:
+    """Окружение для импорта main без настоящих токенов и БД."""
+    env = dict(os.environ)
+    env.setdefault('TOKEN', '123456:AAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAA')
+    env.setdefault('DB_URL', 'sqlite+aiosqlite:///:memory:')
+    env.setdefault('MEDIA_ROOT', str(ROOT / 'media'))
+    env.setdefault('DATA_ROOT', tempfile.gettempdir())
+    return env
+
+
+def parse_importtime(stderr: str) -> tuple[dict, dict]:
+    """
+    Разбор вывода -X importtime.
+
+    Returns:
+        (собственное время модулей, накопленное время модулей) в секундах
+    """
+    self_times, cumulative = {}, {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        name = name.strip()
+        self_times[name] = int(self_us) / 1e6
+        cumulative[name] = int(cumulative_us) / 1e6
+    return self_times, cumulative
+
+
+def run_once(env: dict) -> dict:
+    started = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', SCRIPT],
+        cwd=ROOT, env=env, capture_output=True, text=True,
+    )
+    elapsed = time.perf_counter() - started
+    if proc.returncode != 0:
+        raise RuntimeError(f'import main завершился с ошибкой:\n{proc.stderr[-2000:]}')
+    self_times, cumulative = parse_importtime(proc.stderr)
+    return {
+        'process': elapsed,
+        'import_main': cumulative.get('main', 0.0),
+        'self_times': self_times,
+        'lazy_loaded': json.loads(proc.stdout.strip().splitlines()[-1]),
+    }
+
+
+def summary(values: list[float]) -> dict:
+    return {'min': min(values), 'median': statistics.median(values), 'max': max(values)}
+
+
+def bench(runs: int, top: int) -> dict:
+    env = startup_env()
+    # Первый прогон компилирует .pyc — в замер не идёт
+    run_once(env)
+    samples = [run_once(env) for _ in range(runs)]
+
+    results = {
+        'import_main': {'time': summary([s['import_main'] for s in samples])},
+        'process': {'time': summary([s['process'] for s in samples])},
+    }
+    for name, value in results.items():
+        timing = value['time']
+        print(f'  {name:<12} median {timing["median"] * 1000:8.1f} ms   min {timing["min"] * 1000:8.1f} ms')
+
+    self_times = defaultdict(list)
+    for sample in samples:
+        for module, value in sample['self_times'].items():
+            self_times[module].append(value)
+    slowest = sorted(((statistics.median(v), m) for m, v in self_times.items()), reverse=True)[:top]
+    print('\n  Самые медленные модули (собственное время, медиана):')
+    for value, module in slowest:
+        print(f'    {value * 1000:8.1f} ms  {module}')
+    results['slowest_modules'] = {module: value for value, module in slowest}
+
+    lazy_loaded = sorted({m for s in samples for m in s['lazy_loaded']})
+    results['lazy_loaded'] = lazy_loaded
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Бенчмарк холодного старта (import main)')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--budget', type=float, default=3.5, help='Допустимая медиана import main, сек')
+    parser.add_argument('--top', type=int, default=15, help='Сколько медленных модулей показать')
+    args = parser.parse_args(argv)
+
+    print(f'{args.runs} прогонов, бюджет {args.budget:.2f} с')
+    results = bench(args.runs, args.top)
+    path = save_results('startup', results)
+    print(f'\nРезультаты сохранены: {path}')
+
+    problems = []
+    median = results['import_main']['time']['median']
+    if median > args.budget:
+        problems.append(f'import main: медиана {median:.2f} с больше бюджета {args.budget:.2f} с')
+    if results['lazy_loaded']:
+        problems.append(f'при старте загружены модули генерации отчётов: {", ".join(results["lazy_loaded"])}')
+    for problem in problems:
+        print(f'FAIL: {problem}')
+    sys.exit(1 if problems else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+"""
+Сравнение двух прогонов бенчмарка.
+
+Запуск:
+    python -m benchmarks.compare benchmarks/results/pipeline-abc1234-....json benchmarks/results/pipeline-def5678-....json
+
+Сравниваются метрики, которые пишет сам бенчмарк (COMPARED_METRICS):
+    pipeline, crypto, startup — время стадии (time.median, time.min)
+                                и пик памяти (memory.peak_bytes);
+    db_concurrency            — median, p99 и throughput по уровням нагрузки.
+Изменения больше --threshold (по умолчанию 10%) помечаются как регрессия
+или улучшение.
+"""
+
+import argparse
+import json
+import sys
+from pathlib import Path
+
+# Окончания ключей результатов (после flatten), которые сравниваются
+STAGE_METRICS = ('time.median', 'time.min', 'memory.peak_bytes')
+COMPARED_METRICS = {
+    'pipeline': STAGE_METRICS,
+    'crypto': STAGE_METRICS,
+    'startup': STAGE_METRICS,
+    'db_concurrency': ('median', 'p99', 'throughput'),
+}
+HIGHER_IS_BETTER = ('throughput',)
+
+
+def flatten(data, prefix: str = '') -> dict:
+    """{'a': {'b': 1}} -> {'a.b': 1} (только числовые значения)."""
+    flat = {}
+    for key, value in data.items():
+        path = f'{prefix}.{key}' if prefix else str(key)
+        if isinstance(value, dict):
+            flat.update(flatten(value, path))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[path] = value
+    return flat
+
+
+def compare(old: dict, new: dict, threshold: float) -> int:
+    """Печатает таблицу сравнения, возвращает количество регрессий."""
+    if old['benchmark'] != new['benchmark']:
+        raise SystemExit(f'Разные бенчмарки: {old["benchmark"]} и {new["benchmark"]}')
+    metrics = COMPARED_METRICS.get(old['benchmark'], STAGE_METRICS)
+    old_flat = flatten(old['results'])
+    new_flat = flatten(new['results'])
+    keys = sorted(k for k in old_flat.keys() & new_flat.keys() if f'.{k}'.endswith(tuple(f'.{m}' for m in metrics)))
+    if not keys:
+        raise SystemExit(f'Нет общих метрик для сравнения ({", ".join(metrics)})')
+    regressions = 0
+
+    print(f'{old["benchmark"]}: {old["revision"]} -> {new["revision"]}\n')
+    for key in keys:
+        metric = key.rsplit('.', 1)[-1]
+        before, after = old_flat[key], new_flat[key]
+        if not before:
+            continue
+        change = (after - before) / before
+        worse = change < -threshold if metric in HIGHER_IS_BETTER else change > threshold
+        better = change > threshold if metric in HIGHER_IS_BETTER else change < -threshold
+        mark = '  REGRESSION' if worse else ('  improved' if better else '')
+        regressions += worse
+        print(f'{key:<50} {before:>14.4f} {after:>14.4f} {change:>+8.1%}{mark}')
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Сравнение результатов бенчмарков')
+    parser.add_argument('old', type=Path)
+    parser.add_argument('new', type=Path)
+    parser.add_argument('--threshold', type=float, default=0.10)
+    args = parser.parse_args(argv)
+
+    old = json.loads(args.old.read_text())
+    new = json.loads(args.new.read_text())
+    regressions = compare(old, new, args.threshold)
+    if regressions:
+        print(f'\nРегрессий: {regressions}')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
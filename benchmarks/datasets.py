@@ -0,0 +1,237 @@
+"""
+Генераторы синтетических данных WB для стенда и бенчмарков.
+
+Данные повторяют форму ответов API Wildberries (reportDetailByPeriod,
+content/v2/get/cards/list, paid_storage, adv/v1/upd, adv/v2/fullstats)
+в том объёме, в котором их читает services/report_generator.py.
+Распределения типов строк подобраны по реальным отчётам селлеров:
+большая часть строк — продажи и логистика, удержания идут строками
+с nm_id = 0.
+"""
+
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+
+
+# Тип строки отчёта: (supplier_oper_name, doc_type_name, доля строк)
+ROW_TYPES = [
+    ('Продажа', 'Продажа', 0.52),
+    ('Логистика', '', 0.30),
+    ('Возврат', 'Возврат', 0.04),
+    ('Хранение', '', 0.05),
+    ('Платная приемка', '', 0.02),
+    ('Удержание', '', 0.04),
+    ('Штраф', '', 0.015),
+    ('Доплаты', '', 0.015),
+]
+
+# Удержания (bonus_type_name) и их доли среди строк «Удержание»
+DEDUCTION_TYPES = [
+    ('Оказание услуг «ВБ.Продвижение»', 0.45),
+    ('Списание за отзыв на товар {nm_id}', 0.20),
+    ('Оплата по подписке «Джем»', 0.10),
+    ('Акт утилизации товара', 0.05),
+    ('Удержание за нарушение правил маркировки', 0.10),
+    ('Компенсация подмененного товара', 0.10),
+]
+
+FIRST_NM_ID = 100_000_000
+DEFAULT_UPD_NUMS = (232411108, 233498006)
+
+# Размеры наборов данных: (строк отчёта, артикулов)
+PRESETS = {
+    'xs': (1_000, 100),
+    's': (20_000, 1_000),
+    'm': (200_000, 5_000),
+    'l': (1_000_000, 20_000),
+    'xl': (2_000_000, 50_000),
+}
+
+
+def nm_ids(skus: int) -> np.ndarray:
+    """Артикулы WB для набора из skus товаров."""
+    return np.arange(FIRST_NM_ID, FIRST_NM_ID + skus, dtype=np.int64)
+
+
+def generate_sales_frame(rows: int, skus: int, seed: int = 0) -> pd.DataFrame:
+    """
+    Синтетический reportDetailByPeriod в виде DataFrame.
+
+    Args:
+        rows: Количество строк отчёта
+        skus: Количество разных артикулов
+        seed: Seed генератора (одинаковый seed — одинаковые данные)
+    """
+    rng = np.random.default_rng(seed)
+
+    # Популярность товаров по Zipf: несколько хитов и длинный хвост
+    weights = 1.0 / np.arange(1, skus + 1) ** 0.8
+    weights /= weights.sum()
+    nm = rng.choice(nm_ids(skus), size=rows, p=weights)
+
+    probs = np.array([t[2] for t in ROW_TYPES])
+    kind = rng.choice(len(ROW_TYPES), size=rows, p=probs / probs.sum())
+    oper_names = np.array([t[0] for t in ROW_TYPES], dtype=object)[kind]
+    doc_types = np.array([t[1] for t in ROW_TYPES], dtype=object)[kind]
+
+    is_sale = oper_names == 'Продажа'
+    is_return = oper_names == 'Возврат'
+    is_logistics = oper_names == 'Логистика'
+    is_storage = oper_names == 'Хранение'
+    is_acceptance = oper_names == 'Платная приемка'
+    is_deduction = oper_names == 'Удержание'
+    is_penalty = oper_names == 'Штраф'
+    is_additional = oper_names == 'Доплаты'
+
+    price = np.round(rng.lognormal(mean=7.0, sigma=0.6, size=rows), 2)
+    quantity = np.where(is_sale | is_return, 1, 0)
+    retail_amount = np.where(is_sale | is_return, price, 0.0)
+    ppvz_for_pay = np.where(is_sale | is_return, np.round(price * rng.uniform(0.6, 0.85, rows), 2), 0.0)
+    delivery_amount = np.where(is_logistics, 1, 0)
+    delivery_rub = np.where(is_logistics, np.round(rng.uniform(30, 150, rows), 2), 0.0)
+    storage_fee = np.where(is_storage, np.round(rng.uniform(0.5, 40, rows), 2), 0.0)
+    acceptance = np.where(is_acceptance, np.round(rng.uniform(10, 300, rows), 2), 0.0)
+    penalty = np.where(is_penalty, np.round(rng.uniform(100, 3000, rows), 2), 0.0)
+    additional_payment = np.where(is_additional, np.round(rng.uniform(10, 500, rows), 2), 0.0)
+    cashback_amount = np.where(is_sale, np.round(price * rng.choice([0, 0, 0, 0.05], rows), 2), 0.0)
+
+    ded_probs = np.array([t[1] for t in DEDUCTION_TYPES])
+    ded_kind = rng.choice(len(DEDUCTION_TYPES), size=rows, p=ded_probs / ded_probs.sum())
+    ded_templates = np.array([t[0] for t in DEDUCTION_TYPES], dtype=object)[ded_kind]
+    bonus_type_name = np.where(is_deduction, ded_templates, '')
+    review_rows = is_deduction & (ded_kind == 1)
+    if review_rows.any():
+        bonus_type_name[review_rows] = [
+            DEDUCTION_TYPES[1][0].format(nm_id=n) for n in nm[review_rows]
+        ]
+    deduction = np.where(is_deduction, np.round(rng.uniform(50, 5000, rows), 2), 0.0)
+
+    # Удержания и часть штрафов WB пишет без артикула
+    nm = np.where(is_deduction | (is_penalty & (rng.random(rows) < 0.5)), 0, nm)
+
+    return pd.DataFrame({
+        'rrd_id': np.arange(1, rows + 1, dtype=np.int64),
+        'nm_id': nm,
+        'supplier_oper_name': oper_names,
+        'doc_type_name': doc_types,
+        'quantity': quantity,
+        'retail_amount': retail_amount,
+        'ppvz_for_pay': ppvz_for_pay,
+        'delivery_amount': delivery_amount,
+        'delivery_rub': delivery_rub,
+        'penalty': penalty,
+        'additional_payment': additional_payment,
+        'cashback_amount': cashback_amount,
+        'storage_fee': storage_fee,
+        'acceptance': acceptance,
+        'deduction': deduction,
+        'bonus_type_name': bonus_type_name,
+    })
+
+
+def generate_sales_records(rows: int, skus: int, seed: int = 0) -> list[dict]:
+    """Синтетический reportDetailByPeriod в виде JSON-записей (как отдаёт API)."""
+    return generate_sales_frame(rows, skus, seed).to_dict('records')
+
+
+def generate_cards(skus: int) -> list[dict]:
+    """Карточки товаров (content/v2/get/cards/list), отсортированные по nmID."""
+    base = datetime_iso(date(2025, 1, 1))
+    return [
+        {'nmID': int(nm), 'vendorCode': f'ART-{nm - FIRST_NM_ID:06d}', 'updatedAt': base}
+        for nm in nm_ids(skus)
+    ]
+
+
+def generate_cards_mapping(skus: int) -> dict[str, str]:
+    """Маппинг артикул WB -> артикул поставщика (как fetch_product_cards_mapping)."""
+    return {str(card['nmID']): card['vendorCode'] for card in generate_cards(skus)}
+
+
+def generate_adv_frame(skus: int, period: str = '', share: float = 0.3, seed: int = 0) -> pd.DataFrame:
+    """Результат get_ad_expenses_report: расходы на рекламу по части артикулов."""
+    rng = np.random.default_rng(seed)
+    ids = nm_ids(skus)
+    advertised = rng.choice(ids, size=max(1, int(skus * share)), replace=False)
+    return pd.DataFrame({
+        'Артикул WB': advertised.astype(str),
+        'totalAdjustedSum': np.round(rng.uniform(10, 5000, len(advertised)), 2),
+        'Period': period,
+        'Название товара': [f'Товар {nm}' for nm in advertised],
+    })
+
+
+def generate_paid_storage(skus: int, days: int = 7, seed: int = 0) -> list[dict]:
+    """Отчёт о платном хранении: строка на товар за каждый день."""
+    rng = np.random.default_rng(seed)
+    ids = nm_ids(skus)
+    start = date(2025, 1, 1)
+    rows = []
+    for day in range(days):
+        prices = np.round(rng.uniform(0.1, 30, skus), 2)
+        day_str = (start + timedelta(days=day)).isoformat()
+        rows.extend(
+            {'date': day_str, 'nmId': int(nm), 'warehousePrice': float(p)}
+            for nm, p in zip(ids, prices)
+        )
+    return rows
+
+
+def generate_storage_frame(skus: int, days: int = 7, seed: int = 0) -> pd.DataFrame:
+    """
+    Результат get_storage_report: платное хранение (generate_paid_storage),
+    просуммированное по артикулу, колонки nmId (строка) и totalStorageSum.
+    """
+    raw = pd.DataFrame(generate_paid_storage(skus, days, seed))
+    storage_df = (
+        raw.groupby('nmId', as_index=False)['warehousePrice']
+        .sum()
+        .rename(columns={'warehousePrice': 'totalStorageSum'})
+    )
+    storage_df['nmId'] = storage_df['nmId'].astype(str).str.upper()
+    storage_df['totalStorageSum'] = storage_df['totalStorageSum'].round(2)
+    return storage_df[['nmId', 'totalStorageSum']]
+
+
+def generate_adv_documents(campaigns: int, upd_nums=DEFAULT_UPD_NUMS, seed: int = 0) -> list[dict]:
+    """Документы списаний за рекламу (adv/v1/upd)."""
+    rng = np.random.default_rng(seed)
+    return [
+        {
+            'updNum': int(upd_nums[i % len(upd_nums)]),
+            'advertId': 20_000_000 + i,
+            'updSum': float(np.round(rng.uniform(500, 50_000), 2)),
+            'campName': f'Кампания {i + 1}',
+        }
+        for i in range(campaigns)
+    ]
+
+
+def generate_fullstats(advert_ids: list[int], dates: list[str], skus: int, nm_per_campaign: int = 20,
+                       seed: int = 0) -> list[dict]:
+    """Детальная статистика кампаний (adv/v2/fullstats)."""
+    rng = np.random.default_rng(seed)
+    ids = nm_ids(skus)
+    result = []
+    for advert_id in advert_ids:
+        campaign_nms = rng.choice(ids, size=min(nm_per_campaign, skus), replace=False)
+        days = []
+        for day in dates:
+            days.append({
+                'date': f'{day}T00:00:00Z',
+                'apps': [{
+                    'appType': 1,
+                    'nm': [
+                        {'nmId': int(nm), 'name': f'Товар {nm}', 'sum': float(np.round(rng.uniform(0, 500), 2))}
+                        for nm in campaign_nms
+                    ],
+                }],
+            })
+        result.append({'advertId': int(advert_id), 'days': days})
+    return result
+
+
+def datetime_iso(day: date) -> str:
+    return f'{day.isoformat()}T00:00:00Z'
@@ -0,0 +1,99 @@
+"""
+Общие утилиты бенчмарков: замер времени и памяти, сохранение результатов.
+
+Результаты пишутся в benchmarks/results/<имя>-<коммит>-<время>.json,
+сравнить два прогона: python -m benchmarks.compare old.json new.json
+"""
+
+import gc
+import json
+import platform
+import statistics
+import subprocess
+import time
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict
+
+RESULTS_DIR = Path(__file__).resolve().parent / 'results'
+
+
+def measure_time(fn: Callable[[], Any], repeat: int = 3) -> Dict[str, float]:
+    """Время выполнения fn в секундах: min/median/max по repeat запускам."""
+    timings = []
+    for _ in range(repeat):
+        gc.collect()
+        started = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - started)
+    return {
+        'min': min(timings),
+        'median': statistics.median(timings),
+        'max': max(timings),
+    }
+
+
+def measure_memory(fn: Callable[[], Any]) -> Dict[str, int]:
+    """Пиковое потребление памяти fn в байтах (по tracemalloc, отдельный прогон)."""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        fn()
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {'peak_bytes': peak, 'retained_bytes': current}
+
+
+def git_revision() -> str:
+    """Короткий хеш текущего коммита (или 'unknown' вне git)."""
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=Path(__file__).resolve().parent,
+            stderr=subprocess.DEVNULL,
+            text=True,
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def environment() -> Dict[str, str]:
+    """Версии окружения, влияющие на результаты."""
+    info = {
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'processor': platform.processor() or platform.machine(),
+    }
+    for module in ('pandas', 'numpy', 'openpyxl', 'sqlalchemy', 'cryptography'):
+        try:
+            info[module] = __import__(module).__version__
+        except ImportError:
+            pass
+    return info
+
+
+def save_results(name: str, results: Dict[str, Any]) -> Path:
+    """Сохранение результатов бенчмарка в JSON."""
+    RESULTS_DIR.mkdir(parents=True, exist_ok=True)
+    revision = git_revision()
+    stamp = datetime.now().strftime('%Y%m%d-%H%M%S')
+    path = RESULTS_DIR / f'{name}-{revision}-{stamp}.json'
+    payload = {
+        'benchmark': name,
+        'revision': revision,
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'environment': environment(),
+        'results': results,
+    }
+    path.write_text(json.dumps(payload, ensure_ascii=False, indent=2))
+    return path
+
+
+def format_bytes(value: float) -> str:
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if abs(value) < 1024:
+            return f'{value:.1f} {unit}'
+        value /= 1024
+    return f'{value:.1f} TB'
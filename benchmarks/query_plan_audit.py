@@ -0,0 +1,285 @@
+"""
+Аудит планов запросов: ни один ORM-запрос из services/ не должен читать
+большую таблицу целиком.
+
+Скрипт поднимает временную SQLite-БД по моделям (со всеми индексами),
+заполняет её синтетическими пользователями, магазинами, отчётами,
+платежами и рефералами, вызывает orm_* функции из services/ и
+перехватывает их SQL (событие before_cursor_execute). Для каждого
+запроса выполняется EXPLAIN QUERY PLAN; строка плана «SCAN <таблица>»
+без индекса считается полным сканированием. Осознанные исключения
+перечислены в ALLOWED_SCANS с причиной.
+
+Список orm_* функций собирается из модулей services/ (orm_functions): у
+каждой должен быть вызов в audit_calls, иначе аудит считает это ошибкой.
+
+Код возврата 1, если найдены полные сканирования или функции без вызова, —
+можно запускать в CI.
+
+Запуск (нужен aiosqlite: pip install aiosqlite):
+    python -m benchmarks.query_plan_audit
+    python -m benchmarks.query_plan_audit --users 100000 -v
+"""
+
+import argparse
+import asyncio
+import base64
+import importlib
+import inspect
+import os
+import pkgutil
+import random
+import sys
+import tempfile
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from typing import Callable
+
+from sqlalchemy import event, insert
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+
+# orm_add_store и orm_edit_store шифруют токен
+os.environ.setdefault('ENCRYPTION_KEY', base64.b64encode(os.urandom(32)).decode())
+
+from database.models import Base, User, Store, Report, Payment, Ref  # noqa: E402
+import services  # noqa: E402
+from services import (  # noqa: E402
+    admin, auth_service, broadcast, manage_stores, membership, payment, payment_inbox, refs, report_history
+)
+from services.user_cache import user_cache  # noqa: E402
+
+
+# Запросы, которым полное сканирование допустимо: функция -> причина
+ALLOWED_SCANS = {
+    'orm_get_admin_list': 'фильтр по role, вызывается вручную командой upd_adm',
+    'orm_get_generations_top': 'отчёт админки по всей таблице пользователей',
+    'orm_get_last_payments': 'обратный обход по первичному ключу с LIMIT читает только N строк',
+    'orm_get_last_registrations': 'обратный обход по первичному ключу с LIMIT читает только N строк',
+    'orm_get_last_broadcast': 'обратный обход по первичному ключу с LIMIT читает только 1 строку',
+    'orm_count_recipients': 'число получателей рассылки — это подсчёт всех пользователей; вызывается вручную из админки',
+    'orm_create_broadcast': 'считает получателей через orm_count_recipients при запуске рассылки админом',
+    'orm_check_payment_exists': 'legacy-проверка YooKassa по yoo_id, в коде бота не вызывается',
+}
+
+FIRST_TG_ID = 100_000_000
+
+
+async def seed(session_pool: async_sessionmaker, users: int, seed_value: int = 0):
+    """Заполнение БД: на пользователя ~1.5 магазина, 5 отчётов, 2 платежа."""
+    rng = random.Random(seed_value)
+    today = date.today()
+    now = datetime.now()
+
+    user_rows, store_rows, report_rows, payment_rows, ref_rows = [], [], [], [], []
+    store_id = 0
+    for i in range(users):
+        tg_id = FIRST_TG_ID + i
+        user_rows.append({
+            'tg_id': tg_id,
+            'phone': 79_000_000_000 + i,
+            'first_name': f'User {i}',
+            'role': 'admin' if i < 3 else 'user',
+            'generations_made': rng.randint(0, 50),
+            'generations_left': rng.randint(0, 10),
+        })
+        user_stores = []
+        for _ in range(rng.choice((1, 1, 2))):
+            store_id += 1
+            user_stores.append(store_id)
+            store_rows.append({'id': store_id, 'tg_id': tg_id, 'name': f'Store {store_id}', 'token': 'token'})
+        for week in range(5):
+            report_rows.append({
+                'tg_id': tg_id,
+                'store_id': rng.choice(user_stores),
+                'date_of_week': today - timedelta(weeks=week),
+                'report_path': f'/data/reports/{tg_id}/{week}.xlsx',
+            })
+        for n in range(2):
+            payment_rows.append({
+                'tg_id': tg_id,
+                'amount': 990,
+                'generations_num': 5,
+                'source': rng.choice(('bot', 'bot', 'Club', 'bonus')),
+                'modulbank_transaction_id': f'tx-{tg_id}-{n}',
+                'created': now - timedelta(days=rng.randint(0, 365)),
+            })
+        if i and rng.random() < 0.3:
+            ref_rows.append({'referral_id': tg_id, 'referrer_id': FIRST_TG_ID + rng.randrange(i)})
+
+    async with session_pool() as session:
+        for model, rows in ((User, user_rows), (Store, store_rows), (Report, report_rows),
+                            (Payment, payment_rows), (Ref, ref_rows)):
+            await session.execute(insert(model), rows)
+        await session.commit()
+
+    return {'user': len(user_rows), 'store': len(store_rows), 'report': len(report_rows),
+            'payment': len(payment_rows), 'ref': len(ref_rows)}
+
+
+def _call(func: Callable, *args, **kwargs) -> tuple[Callable, Callable]:
+    """Вызов для аудита: (функция, вызов с сессией)."""
+    return func, lambda session: func(session, *args, **kwargs)
+
+
+def audit_calls(users: int) -> list[tuple[Callable, Callable]]:
+    """Вызовы orm_* функций: (функция, вызов(session)). Порядок важен: часть вызовов меняет данные."""
+    tg_id = FIRST_TG_ID + users // 2
+    other_tg_id = FIRST_TG_ID + users // 3
+    new_tg_id = FIRST_TG_ID + users + 2
+    return [
+        _call(admin.orm_get_admin_list),
+        _call(admin.orm_get_user_via_phone, 79_000_000_000 + users // 2),
+        _call(admin.orm_get_last_payments, 10),
+        _call(admin.orm_get_generations_top, 10),
+        _call(admin.orm_get_last_registrations, 10),
+        _call(auth_service.orm_get_user, tg_id),
+        _call(auth_service.orm_check_user_reg, tg_id),
+        _call(auth_service.orm_add_user, {'tg_id': new_tg_id, 'phone': '+79990000000', 'first_name': 'New'}),
+        _call(manage_stores.orm_get_user_stores, tg_id),
+        _call(manage_stores.orm_get_store, 1),
+        _call(manage_stores.orm_get_owned_store, 1, FIRST_TG_ID),
+        _call(manage_stores.orm_add_store, {'tg_id': new_tg_id, 'name': 'New store', 'token': 'token'}),
+        _call(manage_stores.orm_edit_store, {'store_id': 1, 'name': 'Edited', 'token': 'token'}),
+        _call(manage_stores.orm_edit_store_name, 1, 'Renamed'),
+        _call(manage_stores.orm_edit_store_token, 1, 'new-token'),
+        _call(manage_stores.orm_set_store, FIRST_TG_ID, 1),
+        _call(manage_stores.orm_delete_store, 1, FIRST_TG_ID),
+        _call(payment.orm_reserve_generation, tg_id),
+        _call(payment.orm_commit_generation, tg_id),
+        _call(payment.orm_release_generation, tg_id),
+        _call(payment.orm_get_email, tg_id),
+        _call(payment.orm_set_email, tg_id, 'user@example.com'),
+        _call(payment.orm_check_payment_exists, 'yoo-1'),
+        _call(payment.orm_check_modulbank_payment_exists, f'tx-{tg_id}-0'),
+        _call(payment.orm_add_generations, tg_id, 5),
+        _call(payment.orm_add_payment, tg_id, 990, 5, 'bot', modulbank_transaction_id=f'tx-{tg_id}-new'),
+        _call(payment.orm_this_month_bonus_exists, tg_id),
+        _call(membership.orm_get_club_bonus_users),
+        _call(refs.orm_save_ref, other_tg_id, FIRST_TG_ID + users + 1),
+        _call(refs.orm_get_refs, other_tg_id),
+        _call(refs.orm_get_referrer, tg_id),
+        _call(refs.orm_add_bonus, tg_id, 1000),
+        _call(refs.orm_get_gens_for_bonus, tg_id, 100, 1),
+        _call(report_history.orm_get_report_history, tg_id, 1),
+        _call(report_history.orm_get_report_history, tg_id, 1, before=(date.today(), 10 ** 9)),
+        _call(report_history.orm_get_user_report, 1, tg_id),
+        _call(report_history.orm_set_report_file_id, 1, 'file-id'),
+        _call(report_history.orm_add_report, tg_id, date.today(), '/data/reports/new.xlsx', 2, file_id='file-id'),
+        _call(broadcast.orm_count_recipients),
+        _call(broadcast.orm_create_broadcast, FIRST_TG_ID, FIRST_TG_ID, 1),
+        _call(broadcast.orm_set_progress_message, 1, FIRST_TG_ID, 2),
+        _call(broadcast.orm_get_active_broadcast),
+        _call(broadcast.orm_get_last_broadcast),
+        _call(broadcast.orm_cancel_broadcast),
+        _call(broadcast.orm_unblock_user, tg_id),
+        _call(payment_inbox.orm_add_payment_notification, 'tx-inbox-1', {'transaction_id': 'tx-inbox-1'}),
+        _call(payment_inbox.orm_get_due_notifications),
+        _call(payment_inbox.orm_claim_notification, 1),
+        _call(payment_inbox.orm_fail_notification, 1, 'error', 5),
+        _call(payment_inbox.orm_finish_notification, 1),
+        _call(payment_inbox.orm_count_pending_notifications),
+    ]
+
+
+def orm_functions() -> dict[str, Callable]:
+    """Все orm_* функции модулей services/: имя -> функция."""
+    functions = {}
+    for module_info in pkgutil.iter_modules(services.__path__):
+        module = importlib.import_module(f'{services.__name__}.{module_info.name}')
+        for name, func in inspect.getmembers(module, inspect.iscoroutinefunction):
+            if name.startswith('orm_') and func.__module__ == module.__name__:
+                functions[name] = func
+    return functions
+
+
+def full_scans(plan_rows) -> list[str]:
+    """Строки плана с полным сканированием таблицы."""
+    scans = []
+    for row in plan_rows:
+        detail = row[-1]
+        if detail.startswith('SCAN ') and 'USING' not in detail and 'CONSTANT ROW' not in detail:
+            scans.append(detail)
+    return scans
+
+
+async def run_audit(users: int, verbose: bool = False) -> int:
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        engine = create_async_engine(f'sqlite+aiosqlite:///{Path(tmp_dir) / "audit.db"}')
+        try:
+            session_pool = async_sessionmaker(bind=engine, class_=AsyncSession, expire_on_commit=False)
+
+            async with engine.begin() as conn:
+                await conn.run_sync(Base.metadata.create_all)
+            counts = await seed(session_pool, users)
+            async with engine.begin() as conn:
+                await conn.exec_driver_sql('ANALYZE')
+            print('Данные: ' + ', '.join(f'{table} {count}' for table, count in counts.items()))
+
+            captured = []
+            current = {'name': None}
+
+            @event.listens_for(engine.sync_engine, 'before_cursor_execute')
+            def capture(conn, cursor, statement, parameters, context, executemany):
+                if current['name'] and not executemany:
+                    captured.append((current['name'], statement, parameters))
+
+            calls = audit_calls(users)
+            for func, call in calls:
+                current['name'] = func.__name__
+                # Иначе orm_get_user отвечает из кэша и до БД не доходит
+                user_cache.clear()
+                async with session_pool() as session:
+                    await call(session)
+            current['name'] = None
+
+            problems = 0
+            async with engine.connect() as conn:
+                for name, statement, parameters in captured:
+                    if not statement.lstrip().upper().startswith(('SELECT', 'UPDATE', 'DELETE')):
+                        continue
+                    result = await conn.exec_driver_sql(f'EXPLAIN QUERY PLAN {statement}', parameters)
+                    plan = result.fetchall()
+                    scans = full_scans(plan)
+
+                    if scans and name in ALLOWED_SCANS:
+                        status = f'allowed ({ALLOWED_SCANS[name]})'
+                    elif scans:
+                        status = 'FULL SCAN'
+                        problems += 1
+                    else:
+                        status = 'ok'
+
+                    if verbose or status == 'FULL SCAN':
+                        print(f'\n[{status}] {name}\n  {" ".join(statement.split())}')
+                        for row in plan:
+                            print(f'    {row[-1]}')
+                    else:
+                        print(f'[{status}] {name}')
+        finally:
+            await engine.dispose()
+
+    # Новая orm_* функция без вызова в audit_calls — тоже ошибка аудита
+    uncalled = sorted(orm_functions().keys() - {func.__name__ for func, _ in calls})
+    for name in uncalled:
+        print(f'[NO CALL] {name}: нет вызова в audit_calls')
+    problems += len(uncalled)
+
+    if problems:
+        print(f'\nЗапросов с полным сканированием таблицы или без аудита: {problems}')
+    else:
+        print('\nПолных сканирований не найдено')
+    return problems
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='EXPLAIN-аудит ORM-запросов из services/')
+    parser.add_argument('--users', type=int, default=20_000, help='Сколько пользователей сгенерировать')
+    parser.add_argument('-v', '--verbose', action='store_true', help='Печатать планы всех запросов')
+    args = parser.parse_args(argv)
+
+    problems = asyncio.run(run_audit(args.users, args.verbose))
+    sys.exit(1 if problems else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,237 @@
+"""
+Локальный стенд API Wildberries для нагрузочного тестирования.
+
+Отдаёт синтетические данные (benchmarks/datasets.py) по тем же путям,
+что и WB: reportDetailByPeriod с пагинацией по rrdid, карточки товаров,
+задачи paid_storage и рекламу (adv/v1/upd + adv/v2/fullstats).
+Умеет эмулировать задержку ответа, 429 с X-Ratelimit-Retry и 5xx.
+
+Запуск:
+    python -m benchmarks.wb_stub_server --rows 200000 --skus 5000 --latency 0.05
+
+После запуска направьте бота/бенчмарк на стенд:
+    WB_API_BASE_URL=http://127.0.0.1:8081
+"""
+
+import argparse
+import asyncio
+import itertools
+import random
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+
+from aiohttp import web
+
+from benchmarks import datasets
+from services.logging import logger
+
+
+@dataclass
+class StubConfig:
+    rows: int = 100_000
+    skus: int = 2_000
+    campaigns: int = 10
+    seed: int = 0
+    latency: float = 0.0           # базовая задержка ответа, сек
+    jitter: float = 0.0            # случайная добавка к задержке, сек
+    rate_limit_every: int = 0      # каждый N-й запрос получает 429 (0 — выключено)
+    retry_after: int = 1           # значение X-Ratelimit-Retry
+    error_rate: float = 0.0        # доля ответов 500
+    page_wait: int = 0             # X-Ratelimit-Retry на успешных страницах продаж
+    storage_polls: int = 1         # сколько опросов статуса до "done"
+
+
+CONFIG_KEY = web.AppKey('config', StubConfig)
+STATE_KEY = web.AppKey('state', dict)
+
+
+@web.middleware
+async def emulation_middleware(request: web.Request, handler):
+    """Задержка, 429 и 5xx для всех эндпоинтов."""
+    config = request.app[CONFIG_KEY]
+    state = request.app[STATE_KEY]
+
+    delay = config.latency + (random.uniform(0, config.jitter) if config.jitter else 0)
+    if delay:
+        await asyncio.sleep(delay)
+
+    n = next(state['counter'])
+    if config.rate_limit_every and n % config.rate_limit_every == 0:
+        state['throttled'] += 1
+        return web.json_response(
+            {'title': 'too many requests'},
+            status=429,
+            headers={'X-Ratelimit-Retry': str(config.retry_after)},
+        )
+    if config.error_rate and random.random() < config.error_rate:
+        state['errors'] += 1
+        return web.json_response({'title': 'internal error'}, status=500)
+
+    return await handler(request)
+
+
+async def report_detail_by_period(request: web.Request) -> web.Response:
+    records = request.app[STATE_KEY]['sales']
+    config = request.app[CONFIG_KEY]
+    rrdid = int(request.query.get('rrdid', 0))
+    limit = int(request.query.get('limit', 100_000))
+
+    # rrd_id идут подряд с 1, поэтому позиция в списке = rrdid
+    chunk = records[rrdid:rrdid + limit]
+    if not chunk:
+        return web.Response(status=204)
+    return web.json_response(chunk, headers={'X-Ratelimit-Retry': str(config.page_wait)})
+
+
+async def cards_list(request: web.Request) -> web.Response:
+    cards = request.app[STATE_KEY]['cards']
+    body = await request.json()
+    cursor = body.get('settings', {}).get('cursor', {})
+    limit = int(cursor.get('limit', 100))
+    after_nm = cursor.get('nmID')
+
+    start = 0
+    if after_nm:
+        start = int(after_nm) - datasets.FIRST_NM_ID + 1
+    page = cards[start:start + limit]
+    last = page[-1] if page else {}
+    return web.json_response({
+        'cards': page,
+        'cursor': {'updatedAt': last.get('updatedAt'), 'nmID': last.get('nmID'), 'total': len(page)},
+    })
+
+
+async def paid_storage_create(request: web.Request) -> web.Response:
+    state = request.app[STATE_KEY]
+    task_id = f'stub-{next(state["task_ids"])}'
+    state['tasks'][task_id] = 0
+    return web.json_response({'data': {'taskId': task_id}})
+
+
+async def paid_storage_status(request: web.Request) -> web.Response:
+    state = request.app[STATE_KEY]
+    task_id = request.match_info['task_id']
+    if task_id not in state['tasks']:
+        return web.json_response({'title': 'task not found'}, status=404)
+    state['tasks'][task_id] += 1
+    done = state['tasks'][task_id] >= request.app[CONFIG_KEY].storage_polls
+    return web.json_response({'data': {'id': task_id, 'status': 'done' if done else 'processing'}})
+
+
+async def paid_storage_download(request: web.Request) -> web.Response:
+    state = request.app[STATE_KEY]
+    if request.match_info['task_id'] not in state['tasks']:
+        return web.json_response({'title': 'task not found'}, status=404)
+    return web.json_response(state['storage'])
+
+
+async def adv_upd(request: web.Request) -> web.Response:
+    return web.json_response(request.app[STATE_KEY]['adv_documents'])
+
+
+async def adv_fullstats(request: web.Request) -> web.Response:
+    config = request.app[CONFIG_KEY]
+    payload = await request.json()
+    advert_ids = sorted({item['id'] for item in payload})
+    dates = payload[0]['dates'] if payload else []
+    return web.json_response(
+        datasets.generate_fullstats(advert_ids, dates, config.skus, seed=config.seed)
+    )
+
+
+async def stub_stats(request: web.Request) -> web.Response:
+    """Счётчики стенда: сколько запросов, 429 и ошибок отдано."""
+    state = request.app[STATE_KEY]
+    return web.json_response({
+        'throttled': state['throttled'],
+        'errors': state['errors'],
+        'storage_tasks': len(state['tasks']),
+    })
+
+
+def create_stub_app(config: StubConfig) -> web.Application:
+    """Создание aiohttp приложения стенда с заранее сгенерированными данными."""
+    logger.info("Генерирую данные стенда: %d строк, %d артикулов", config.rows, config.skus)
+    app = web.Application(middlewares=[emulation_middleware])
+    app[CONFIG_KEY] = config
+    app[STATE_KEY] = {
+        'sales': datasets.generate_sales_records(config.rows, config.skus, config.seed),
+        'cards': datasets.generate_cards(config.skus),
+        'storage': datasets.generate_paid_storage(config.skus, seed=config.seed),
+        'adv_documents': datasets.generate_adv_documents(config.campaigns, seed=config.seed),
+        'tasks': {},
+        'task_ids': itertools.count(1),
+        'counter': itertools.count(1),
+        'throttled': 0,
+        'errors': 0,
+    }
+
+    app.router.add_get('/api/v5/supplier/reportDetailByPeriod', report_detail_by_period)
+    app.router.add_post('/content/v2/get/cards/list', cards_list)
+    app.router.add_get('/api/v1/paid_storage', paid_storage_create)
+    app.router.add_get('/api/v1/paid_storage/tasks/{task_id}/status', paid_storage_status)
+    app.router.add_get('/api/v1/paid_storage/tasks/{task_id}/download', paid_storage_download)
+    app.router.add_get('/adv/v1/upd', adv_upd)
+    app.router.add_post('/adv/v2/fullstats', adv_fullstats)
+    app.router.add_get('/_stub/stats', stub_stats)
+    return app
+
+
+async def start_stub_server(config: StubConfig, host: str = '127.0.0.1', port: int = 8081) -> web.AppRunner:
+    """Запуск стенда в текущем event loop (для бенчмарков)."""
+    runner = web.AppRunner(create_stub_app(config))
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    logger.info("WB stub запущен на http://%s:%d", host, port)
+    return runner
+
+
+def last_week() -> str:
+    """Прошлая неделя в формате бота: DD.MM.YYYY-DD.MM.YYYY."""
+    today = datetime.now().date()
+    monday = today - timedelta(days=today.weekday() + 7)
+    sunday = monday + timedelta(days=6)
+    return f'{monday.strftime("%d.%m.%Y")}-{sunday.strftime("%d.%m.%Y")}'
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Локальный стенд API Wildberries')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--rows', type=int, default=StubConfig.rows)
+    parser.add_argument('--skus', type=int, default=StubConfig.skus)
+    parser.add_argument('--campaigns', type=int, default=StubConfig.campaigns)
+    parser.add_argument('--seed', type=int, default=StubConfig.seed)
+    parser.add_argument('--latency', type=float, default=StubConfig.latency)
+    parser.add_argument('--jitter', type=float, default=StubConfig.jitter)
+    parser.add_argument('--rate-limit-every', type=int, default=StubConfig.rate_limit_every)
+    parser.add_argument('--retry-after', type=int, default=StubConfig.retry_after)
+    parser.add_argument('--error-rate', type=float, default=StubConfig.error_rate)
+    parser.add_argument('--page-wait', type=int, default=StubConfig.page_wait)
+    parser.add_argument('--storage-polls', type=int, default=StubConfig.storage_polls)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    config = StubConfig(
+        rows=args.rows,
+        skus=args.skus,
+        campaigns=args.campaigns,
+        seed=args.seed,
+        latency=args.latency,
+        jitter=args.jitter,
+        rate_limit_every=args.rate_limit_every,
+        retry_after=args.retry_after,
+        error_rate=args.error_rate,
+        page_wait=args.page_wait,
+        storage_polls=args.storage_polls,
+    )
+    print(f'export WB_API_BASE_URL=http://{args.host}:{args.port}')
+    print(f'Период для генерации: {last_week()}, номер документа: {datasets.DEFAULT_UPD_NUMS[0]}')
+    web.run_app(create_stub_app(config), host=args.host, port=args.port)
+
+
+if __name__ == '__main__':
+    main()
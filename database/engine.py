@@ -1,23 +1,79 @@
 import os
-from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy import event, text
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
 from database.models import Base
 
 from services.logging import logger
 
 
+def normalize_db_url(url: str) -> str:
+    """
+    Convert postgresql:// to postgresql+asyncpg:// for async driver.
+    Railway provides DB_URL with postgresql://, but we need asyncpg driver.
+    """
+    if url.startswith('postgresql://'):
+        return url.replace('postgresql://', 'postgresql+asyncpg://', 1)
+    if url.startswith('postgres://'):
+        return url.replace('postgres://', 'postgresql+asyncpg://', 1)
+    return url
+
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    """
+    Pragmas for every new SQLite connection.
+
+    WAL lets readers work while a writer commits, synchronous=NORMAL is safe
+    with WAL and avoids fsync on every commit, busy_timeout makes a writer
+    wait for the lock instead of failing with "database is locked".
+    foreign_keys is left off: the schema relies on SQLite not enforcing them.
+    """
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA busy_timeout={int(os.getenv('SQLITE_BUSY_TIMEOUT_MS') or '5000')}")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.close()
+
+
+def make_engine(url: str, echo: bool = False) -> AsyncEngine:
+    """
+    Async engine with pooling tuned per backend.
+
+    PostgreSQL (asyncpg): bounded pool with pre-ping and recycling, prepared
+    statement cache (set DB_STATEMENT_CACHE_SIZE=0 behind pgbouncer in
+    transaction mode). SQLite: WAL and busy_timeout pragmas on connect.
+    """
+    url = normalize_db_url(url)
+
+    if url.startswith('postgresql+asyncpg'):
+        cache_size = int(os.getenv('DB_STATEMENT_CACHE_SIZE') or '500')
+        return create_async_engine(
+            url,
+            echo=echo,
+            pool_size=int(os.getenv('DB_POOL_SIZE') or '10'),
+            max_overflow=int(os.getenv('DB_MAX_OVERFLOW') or '10'),
+            pool_timeout=float(os.getenv('DB_POOL_TIMEOUT') or '30'),
+            pool_recycle=int(os.getenv('DB_POOL_RECYCLE') or '1800'),
+            pool_pre_ping=True,
+            connect_args={
+                # Кэш подготовленных выражений SQLAlchemy-диалекта и самого asyncpg
+                'prepared_statement_cache_size': cache_size,
+                'statement_cache_size': cache_size,
+            },
+        )
+
+    new_engine = create_async_engine(url, echo=echo)
+    if new_engine.dialect.name == 'sqlite':
+        event.listen(new_engine.sync_engine, 'connect', _set_sqlite_pragmas)
+    return new_engine
+
+
 # Don't log full DB_URL as it may contain credentials
 db_url = os.getenv('DB_URL', '')
 db_host = db_url.split('@')[-1].split('/')[0] if '@' in db_url else 'configured'
 logger.info(f'Database host: {db_host}')
 
-# Convert postgresql:// to postgresql+asyncpg:// for async driver
-# Railway provides DB_URL with postgresql://, but we need asyncpg driver
-if db_url.startswith('postgresql://'):
-    db_url = db_url.replace('postgresql://', 'postgresql+asyncpg://', 1)
-elif db_url.startswith('postgres://'):
-    db_url = db_url.replace('postgres://', 'postgresql+asyncpg://', 1)
-
-engine = create_async_engine(
+engine = make_engine(
     db_url,
     echo=os.getenv('DB_ECHO', 'false').lower() == 'true'
 )
@@ -31,3 +87,4 @@ async def create_db():
 async def drop_db():
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.drop_all)
+        await conn.execute(text("DROP TABLE IF EXISTS schema_version"))
\ No newline at end of file
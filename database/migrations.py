@@ -0,0 +1,362 @@
+"""
+Версионные миграции схемы БД.
+
+Текущая версия схемы хранится в таблице schema_version (одна строка).
+При старте бота run_migrations():
+
+    версия == LATEST_VERSION    — ничего не делает (одна проверка версии);
+    пустая БД                   — create_all по моделям и сразу LATEST_VERSION;
+    старая БД или версия ниже   — create_all (новые таблицы), затем по порядку
+                                  миграции с номером больше текущего. Версия
+                                  записывается после каждой миграции, поэтому
+                                  упавший запуск продолжится с того же места.
+
+Миграции идемпотентны: на БД, где часть изменений уже была применена
+старыми стартовыми скриптами, они ничего не ломают.
+
+PostgreSQL: весь запуск идёт под pg_advisory_lock, поэтому экземпляры бота,
+стартующие одновременно, мигрируют по очереди — второй дождётся первого и
+увидит актуальную версию. Индексы создаются CONCURRENTLY (без блокировки
+записи в большие таблицы). Индекс, который не удалось создать (например,
+уникальный на данных с дубликатами), роняет миграцию: версия не повышается,
+и миграция повторится при следующем запуске после исправления данных.
+
+Новое изменение схемы = новая функция и запись в MIGRATIONS.
+"""
+
+import os
+import re
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable, Optional
+
+from sqlalchemy import inspect, select, update, bindparam, text, func, and_
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.schema import CreateIndex
+
+from database.models import Base, Store, FSMState, Broadcast, PaymentNotification
+from services.crypto import encrypt_token, decrypt_token, current_key_prefix, is_token_encrypted, needs_reencryption
+from services.logging import logger
+
+
+# Сколько токенов шифровать за одну транзакцию
+TOKEN_BATCH_SIZE = int(os.getenv('TOKEN_BATCH_SIZE') or '500')
+
+# Ключ pg_advisory_lock миграций
+MIGRATION_LOCK_KEY = 0x70616761
+
+
+class MigrationError(Exception):
+    """Миграция не выполнена целиком: версия схемы не повышается."""
+
+
+async def _get_version(engine: AsyncEngine) -> Optional[int]:
+    async with engine.begin() as conn:
+        await conn.execute(text("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)"))
+        return await conn.scalar(text("SELECT max(version) FROM schema_version"))
+
+
+async def _set_version(engine: AsyncEngine, version: int):
+    async with engine.begin() as conn:
+        await conn.execute(text("DELETE FROM schema_version"))
+        await conn.execute(text("INSERT INTO schema_version (version) VALUES (:version)"), {'version': version})
+
+
+async def _has_tables(engine: AsyncEngine) -> bool:
+    async with engine.connect() as conn:
+        return await conn.run_sync(lambda sync_conn: inspect(sync_conn).has_table('user'))
+
+
+@asynccontextmanager
+async def _migration_lock(engine: AsyncEngine):
+    """PostgreSQL: advisory lock на время миграций (в SQLite не нужен)."""
+    if engine.dialect.name != 'postgresql':
+        yield
+        return
+
+    async with engine.connect() as conn:
+        # Без открытой транзакции: CREATE INDEX CONCURRENTLY ждёт завершения всех транзакций
+        conn = await conn.execution_options(isolation_level='AUTOCOMMIT')
+        params = {'key': MIGRATION_LOCK_KEY}
+        if not await conn.scalar(text("SELECT pg_try_advisory_lock(:key)"), params):
+            logger.info("Миграции выполняет другой экземпляр бота, жду")
+            await conn.execute(text("SELECT pg_advisory_lock(:key)"), params)
+        try:
+            yield
+        finally:
+            await conn.execute(text("SELECT pg_advisory_unlock(:key)"), params)
+
+
+async def _create_index(engine: AsyncEngine, index):
+    if engine.dialect.name != 'postgresql':
+        async with engine.begin() as conn:
+            await conn.execute(CreateIndex(index, if_not_exists=True))
+        return
+
+    name = engine.dialect.identifier_preparer.quote(index.name)
+    ddl = str(CreateIndex(index, if_not_exists=True).compile(dialect=engine.dialect))
+    ddl = re.sub(r'^CREATE (UNIQUE )?INDEX ', r'CREATE \1INDEX CONCURRENTLY ', ddl)
+    async with engine.connect() as conn:
+        conn = await conn.execution_options(isolation_level='AUTOCOMMIT')
+        # Упавший CONCURRENTLY оставляет невалидный индекс, а IF NOT EXISTS его пропустил бы
+        invalid = await conn.scalar(text(
+            "SELECT NOT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+            "WHERE c.relname = :name"
+        ), {'name': index.name})
+        if invalid:
+            await conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+        try:
+            await conn.execute(text(ddl))
+        except Exception:
+            await conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+            raise
+
+
+# ------------------ Миграции ------------------
+
+async def _v1_modulbank_columns(engine: AsyncEngine):
+    """Колонки Модуль Банка в payment, yoo_id становится nullable."""
+    def get_columns(sync_conn):
+        return {c['name']: c for c in inspect(sync_conn).get_columns('payment')}
+
+    async with engine.begin() as conn:
+        columns = await conn.run_sync(get_columns)
+
+        for name in ('modulbank_bill_id', 'modulbank_transaction_id'):
+            if name not in columns:
+                logger.info(f"Миграция: добавляю колонку payment.{name}")
+                await conn.execute(text(f"ALTER TABLE payment ADD COLUMN {name} VARCHAR(64)"))
+
+        # SQLite не умеет ALTER COLUMN, там колонка остаётся как есть
+        if engine.dialect.name == 'postgresql' and not columns['yoo_id']['nullable']:
+            await conn.execute(text("ALTER TABLE payment ALTER COLUMN yoo_id DROP NOT NULL"))
+
+
+async def _v2_indexes(engine: AsyncEngine):
+    """
+    Индексы из моделей для уже существующих таблиц.
+
+    create_all создаёт индексы только вместе с новыми таблицами. Каждый индекс
+    создаётся отдельно: если уникальный индекс не создаётся из-за дубликатов в
+    данных, остальные всё равно будут созданы, а миграция затем падает с
+    MigrationError — без индекса версия не повышается.
+    """
+    failed = []
+    for table in Base.metadata.tables.values():
+        for index in table.indexes:
+            try:
+                await _create_index(engine, index)
+            except Exception as e:
+                logger.error(f"Миграция: не удалось создать индекс {index.name}: {e}")
+                failed.append(index.name)
+    if failed:
+        raise MigrationError(f"не созданы индексы: {', '.join(failed)}")
+
+
+async def _encrypt_batch(engine: AsyncEngine, rows) -> int:
+    """
+    Перешифровать пачку (id, token) текущим ключом одним executemany.
+
+    UPDATE условный (token = старое значение): если пользователь сменил токен,
+    пока шла миграция, его новое значение не перезаписывается. Токены, уже
+    зашифрованные текущим ключом (needs_reencryption), пропускаются.
+    """
+    store = Store.__table__
+    params = []
+    for row in rows:
+        if not needs_reencryption(row.token):
+            continue
+        plaintext = decrypt_token(row.token) if is_token_encrypted(row.token) else row.token
+        if not plaintext:
+            logger.error(f"Токен магазина #{row.id} не расшифровывается ни одним ключом — пропускаю")
+            continue
+        params.append({'store_id': row.id, 'old_token': row.token, 'new_token': encrypt_token(plaintext)})
+
+    if params:
+        query = (
+            update(store)
+            .where(and_(store.c.id == bindparam('store_id'), store.c.token == bindparam('old_token')))
+            .values(token=bindparam('new_token'))
+        )
+        async with engine.begin() as conn:
+            await conn.execute(query, params)
+    return len(params)
+
+
+async def reencrypt_tokens(engine: AsyncEngine, batch_size: int = TOKEN_BATCH_SIZE) -> int:
+    """
+    Шифрование токенов текущим ключом: plaintext, старый формат enc:<...>
+    и значения под старыми ключами (ротация ENCRYPTION_KEY).
+
+    Читает магазины пачками по batch_size и коммитит каждую пачку отдельно,
+    поэтому прерванный запуск продолжается с оставшихся строк, а бот в это
+    время работает: старые ключи остаются в ENCRYPTION_PREVIOUS_KEYS.
+
+    PostgreSQL: строки читаются серверным курсором (stream + yield_per) в
+    отдельном соединении. SQLite не даст писать, пока открыт читающий
+    курсор, поэтому там пачки выбираются по id (keyset).
+
+    Returns:
+        Сколько токенов перешифровано
+    """
+    store = Store.__table__
+    stale = ~store.c.token.startswith(current_key_prefix())
+
+    async with engine.connect() as conn:
+        total = await conn.scalar(select(func.count()).select_from(store).where(stale))
+    if not total:
+        return 0
+
+    logger.info(f"Шифрование токенов: {total} магазинов требуют перешифрования")
+    query = select(store.c.id, store.c.token).where(stale).order_by(store.c.id)
+    done = 0
+
+    if engine.dialect.name == 'postgresql':
+        async with engine.connect() as conn:
+            result = await conn.stream(query.execution_options(yield_per=batch_size))
+            async for rows in result.partitions(batch_size):
+                done += await _encrypt_batch(engine, rows)
+                logger.info(f"Шифрование токенов: {done}/{total}")
+    else:
+        last_id = 0
+        while True:
+            async with engine.connect() as conn:
+                rows = (await conn.execute(query.where(store.c.id > last_id).limit(batch_size))).all()
+            if not rows:
+                break
+            last_id = rows[-1].id
+            done += await _encrypt_batch(engine, rows)
+            logger.info(f"Шифрование токенов: {done}/{total}")
+
+    logger.info(f"Шифрование токенов завершено: перешифровано {done}")
+    return done
+
+
+async def _v3_encrypt_tokens(engine: AsyncEngine):
+    """
+    Шифрование plaintext токенов WB пачками по TOKEN_BATCH_SIZE.
+
+    Без ENCRYPTION_KEY миграция только предупреждает: схема идёт дальше,
+    а токены зашифрует фоновый reencrypt_tokens при запуске с ключом.
+    """
+    if not os.getenv('ENCRYPTION_KEY'):
+        logger.warning("ENCRYPTION_KEY не установлен — токены зашифруются при запуске с ключом")
+        return
+
+    await reencrypt_tokens(engine)
+
+
+async def _v4_report_history(engine: AsyncEngine):
+    """
+    report.file_id и индекс истории отчётов.
+
+    idx_report_history (tg_id, store_id, date_of_week, id) заменяет
+    idx_report_user_store_week — тот был его префиксом.
+    """
+    def get_columns(sync_conn):
+        return {c['name'] for c in inspect(sync_conn).get_columns('report')}
+
+    async with engine.begin() as conn:
+        if 'file_id' not in await conn.run_sync(get_columns):
+            logger.info("Миграция: добавляю колонку report.file_id")
+            await conn.execute(text("ALTER TABLE report ADD COLUMN file_id VARCHAR(256)"))
+
+    await _v2_indexes(engine)
+    async with engine.begin() as conn:
+        await conn.execute(text("DROP INDEX IF EXISTS idx_report_user_store_week"))
+
+
+async def _v5_fsm_state(engine: AsyncEngine):
+    """Таблица fsm_state для SQL FSM storage (services/fsm_storage.py)."""
+    async with engine.begin() as conn:
+        await conn.run_sync(FSMState.__table__.create, checkfirst=True)
+
+
+async def _v6_broadcast(engine: AsyncEngine):
+    """user.is_blocked и таблица broadcast для рассылок (services/broadcast.py)."""
+    def get_columns(sync_conn):
+        return {c['name'] for c in inspect(sync_conn).get_columns('user')}
+
+    default = 'false' if engine.dialect.name == 'postgresql' else '0'
+    async with engine.begin() as conn:
+        if 'is_blocked' not in await conn.run_sync(get_columns):
+            logger.info("Миграция: добавляю колонку user.is_blocked")
+            await conn.execute(text(f'ALTER TABLE "user" ADD COLUMN is_blocked BOOLEAN NOT NULL DEFAULT {default}'))
+        await conn.run_sync(Broadcast.__table__.create, checkfirst=True)
+
+
+async def _v7_payment_inbox(engine: AsyncEngine):
+    """Таблица payment_inbox для уведомлений Модуль Банка (services/payment_inbox.py)."""
+    async with engine.begin() as conn:
+        await conn.run_sync(PaymentNotification.__table__.create, checkfirst=True)
+
+
+async def _v8_payment_source_index(engine: AsyncEngine):
+    """Индекс idx_payment_source_created для выборки получателей клубного бонуса."""
+    await _v2_indexes(engine)
+
+
+async def _v9_broadcast_running_index(engine: AsyncEngine):
+    """
+    Уникальный частичный индекс idx_broadcast_running: одна running-рассылка.
+    Лишние running-рассылки (кроме самой ранней) перед этим отменяются.
+    """
+    async with engine.begin() as conn:
+        await conn.execute(text(
+            "UPDATE broadcast SET status = 'cancelled' WHERE status = 'running' "
+            "AND id > (SELECT MIN(id) FROM broadcast WHERE status = 'running')"
+        ))
+    await _v2_indexes(engine)
+
+
+# (версия, описание, функция). Миграция не должна откладываться: версия
+# повышается после каждой, иначе следующие изменения схемы не применятся.
+# Данные, которые нельзя обработать сейчас, дорабатываются фоновой задачей.
+MIGRATIONS: list[tuple[int, str, Callable[[AsyncEngine], Awaitable[None]]]] = [
+    (1, 'modulbank columns in payment', _v1_modulbank_columns),
+    (2, 'indexes for hot lookups', _v2_indexes),
+    (3, 'encrypt plaintext WB tokens', _v3_encrypt_tokens),
+    (4, 'report file_id and history index', _v4_report_history),
+    (5, 'fsm_state table', _v5_fsm_state),
+    (6, 'user.is_blocked and broadcast table', _v6_broadcast),
+    (7, 'payment_inbox table', _v7_payment_inbox),
+    (8, 'payment (source, created) index', _v8_payment_source_index),
+    (9, 'one running broadcast', _v9_broadcast_running_index),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+async def run_migrations(engine: AsyncEngine):
+    """Привести схему БД к LATEST_VERSION."""
+    async with _migration_lock(engine):
+        await _migrate(engine)
+
+
+async def _migrate(engine: AsyncEngine):
+    version = await _get_version(engine)
+    if version == LATEST_VERSION:
+        logger.info(f"Схема БД актуальна (v{version})")
+        return
+
+    if version is None and not await _has_tables(engine):
+        logger.info("Пустая БД: создаю таблицы")
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        await _set_version(engine, LATEST_VERSION)
+        logger.info(f"Схема БД создана (v{LATEST_VERSION})")
+        return
+
+    current = version or 0
+    logger.info(f"Схема БД v{current}, последняя v{LATEST_VERSION}: применяю миграции")
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+
+    for number, description, migration in MIGRATIONS:
+        if number <= current:
+            continue
+        logger.info(f"Миграция v{number}: {description}")
+        await migration(engine)
+        await _set_version(engine, number)
+        current = number
+
+    logger.info(f"Миграции завершены, схема БД v{current}")
@@ -1,6 +1,6 @@
 from typing import Optional
 
-from sqlalchemy import DateTime, Date, String, Text, Integer, BigInteger, Boolean, func, ForeignKey, Index
+from sqlalchemy import DateTime, Date, String, Text, Integer, BigInteger, Boolean, func, false, ForeignKey, Index, text
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
 
 
@@ -23,6 +23,8 @@ class User(Base):
     bonus_total: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
     bonus_left: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
     selected_store_id: Mapped[Optional[int]] = mapped_column(ForeignKey("store.id", ondelete="SET NULL"), nullable=True)
+    # Пользователь заблокировал бота (403 при рассылке); сбрасывается по /start
+    is_blocked: Mapped[bool] = mapped_column(Boolean, default=False, server_default=false(), nullable=False)
 
     stores: Mapped[list["Store"]] = relationship(
         "Store",
@@ -37,6 +39,10 @@ class User(Base):
     payments: Mapped[list["Payment"]] = relationship("Payment")
     referrals: Mapped[list["Ref"]] = relationship("Ref", foreign_keys="[Ref.referrer_id]")
 
+    __table_args__ = (
+        Index('idx_user_phone', 'phone'),  # поиск пользователя по телефону в админке
+    )
+
 
 class Store(Base):
     __tablename__ = 'store'
@@ -49,6 +55,10 @@ class Store(Base):
     reports: Mapped[list["Report"]] = relationship("Report")
     user: Mapped["User"] = relationship("User", back_populates="stores", foreign_keys=[tg_id])
 
+    __table_args__ = (
+        Index('idx_store_tg_id', 'tg_id'),
+    )
+
 
 class Report(Base):
     __tablename__ = 'report'
@@ -58,6 +68,13 @@ class Report(Base):
     date_of_week: Mapped[Date] = mapped_column(Date, nullable=False)
     report_path: Mapped[str] = mapped_column(String, nullable=False)
     store_id: Mapped[int] = mapped_column(ForeignKey("store.id"), nullable=False)
+    # file_id отправленного документа в Telegram: повторная отправка без загрузки файла
+    file_id: Mapped[Optional[str]] = mapped_column(String(256), nullable=True)
+
+    __table_args__ = (
+        # История отчётов магазина: keyset-пагинация по (date_of_week, id)
+        Index('idx_report_history', 'tg_id', 'store_id', 'date_of_week', 'id'),
+    )
 
 
 class Ref(Base):
@@ -69,6 +86,7 @@ class Ref(Base):
 
     __table_args__ = (
         Index('idx_referral_unique', 'referral_id', unique=True),  # явное указание индекса
+        Index('idx_ref_referrer_id', 'referrer_id'),  # список рефералов партнёра
     )
 
 
@@ -85,3 +103,77 @@ class Payment(Base):
     # Поля для Модуль Банка
     modulbank_bill_id: Mapped[Optional[str]] = mapped_column(String(64), nullable=True)
     modulbank_transaction_id: Mapped[Optional[str]] = mapped_column(String(64), nullable=True)
+
+    __table_args__ = (
+        # Проверка дубликатов на каждом webhook Модуль Банка
+        Index('idx_payment_modulbank_transaction', 'modulbank_transaction_id', unique=True),
+        # Проверка клубного бонуса за месяц
+        Index('idx_payment_user_source_created', 'tg_id', 'source', 'created'),
+        # Получатели клубного бонуса за два месяца (club_refresh_loop), покрывающий
+        Index('idx_payment_source_created', 'source', 'created', 'tg_id'),
+    )
+
+
+class FSMState(Base):
+    __tablename__ = 'fsm_state'
+
+    # Ключ aiogram: fsm:<bot_id>:<chat_id>:<user_id>
+    key: Mapped[str] = mapped_column(String(128), primary_key=True)
+    state: Mapped[Optional[str]] = mapped_column(String(128), nullable=True)
+    # JSON данных диалога, зашифрованный KeyRing
+    data: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
+    expires_at: Mapped[DateTime] = mapped_column(DateTime, nullable=False)
+
+    __table_args__ = (
+        Index('idx_fsm_state_expires', 'expires_at'),  # очистка просроченных состояний
+    )
+
+
+class Broadcast(Base):
+    __tablename__ = 'broadcast'
+
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    admin_id: Mapped[int] = mapped_column(BigInteger, nullable=False)
+    # Рассылается копия сообщения админа (copyMessage)
+    from_chat_id: Mapped[int] = mapped_column(BigInteger, nullable=False)
+    message_id: Mapped[int] = mapped_column(Integer, nullable=False)
+    status: Mapped[str] = mapped_column(String(16), default='running', nullable=False)  # running | done | cancelled
+    # Чекпоинт: пользователи с tg_id <= last_tg_id уже обработаны
+    last_tg_id: Mapped[int] = mapped_column(BigInteger, default=0, nullable=False)
+    total: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    sent: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    failed: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    blocked: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    # Сообщение админу с прогрессом
+    progress_chat_id: Mapped[Optional[int]] = mapped_column(BigInteger, nullable=True)
+    progress_message_id: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
+    # Экземпляр бота, который ведёт рассылку, обновляет heartbeat_at;
+    # устаревший heartbeat — рассылку можно подхватить
+    heartbeat_at: Mapped[Optional[DateTime]] = mapped_column(DateTime, nullable=True)
+
+    __table_args__ = (
+        Index('idx_broadcast_status', 'status'),
+        # Одновременно идёт не больше одной рассылки
+        Index('idx_broadcast_running', 'status', unique=True,
+              postgresql_where=text("status = 'running'"), sqlite_where=text("status = 'running'")),
+    )
+
+
+class PaymentNotification(Base):
+    """Входящее уведомление Модуль Банка (inbox, services/payment_inbox.py)."""
+    __tablename__ = 'payment_inbox'
+
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    # Повторная доставка того же уведомления не создаёт вторую запись
+    transaction_id: Mapped[str] = mapped_column(String(64), nullable=False, unique=True)
+    # Поля POST-запроса Модуль Банка как есть (JSON)
+    payload: Mapped[str] = mapped_column(Text, nullable=False)
+    status: Mapped[str] = mapped_column(String(16), default='pending', nullable=False)  # pending | done | failed
+    attempts: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    # Когда обрабатывать (UTC); взятое в работу уведомление сдвигается на время аренды
+    next_attempt_at: Mapped[DateTime] = mapped_column(DateTime, nullable=False)
+    last_error: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
+
+    __table_args__ = (
+        Index('idx_payment_inbox_due', 'status', 'next_attempt_at'),  # выборка готовых к обработке
+    )
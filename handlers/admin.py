@@ -1,14 +1,19 @@
 from aiogram import Bot, Router, types, F
-from aiogram.filters import Command
+from aiogram.filters import Command, CommandObject, StateFilter, or_f
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import StatesGroup, State
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from filters.chat_types import ChatTypeFilter, IsAdmin
-from keyboards.admin_keyboards import get_admin_reply_kb
+from keyboards.admin_keyboards import get_admin_reply_kb, get_broadcast_confirm_kb, get_cancel_kb
 from services.admin import orm_get_admin_list, orm_get_user_via_phone, orm_get_last_payments, orm_get_generations_top, \
     orm_get_last_registrations
 from services.auth_service import orm_get_user
+from services.broadcast import broadcasts, format_progress, orm_count_recipients, orm_create_broadcast, \
+    orm_set_progress_message, orm_get_active_broadcast, orm_get_last_broadcast, orm_cancel_broadcast
+from services.circuit_breaker import get_breakers_snapshot
+from services.loop_monitor import loop_monitor
+from services.profiling import request_profile, cancel_profile, get_pending_profiles
 from services.payment import orm_add_payment, orm_add_generations, orm_this_month_bonus_exists
 from services.logging import logger
 
@@ -27,6 +32,16 @@ class AddGenerations(StatesGroup):
     amount = State()
     generations_number = State()
 
+class BroadcastMessage(StatesGroup):
+    message = State()
+    confirm = State()
+
+
+# Ввод сообщения рассылки. Роутер подключается первым: иначе текст объявления
+# со словами «меню», «отчет», «магазин» и т.п. заберут хендлеры по ключевым словам
+broadcast_router = Router(name='broadcast_router')
+broadcast_router.message.filter(StateFilter(BroadcastMessage), ChatTypeFilter(['private']), IsAdmin())
+
 
 @admin_router.message(F.text.lower() == 'upd_adm')
 async def cmd_upd_admin(msg: types.Message, bot: Bot, session: AsyncSession) -> None:
@@ -40,7 +55,7 @@ async def cmd_upd_admin(msg: types.Message, bot: Bot, session: AsyncSession) ->
     )
 
 
-@admin_router.message(F.text.lower().contains('adm'))
+@admin_router.message(StateFilter(None), F.text.lower().contains('adm'))
 async def cmd_admin(msg: types.Message) -> None:
     """Command admin"""
     reply_text = f'Приветствую - {msg.from_user.first_name}!\n'
@@ -291,3 +306,166 @@ async def cmd_add_gens(msg: types.Message, session: AsyncSession) -> None:
         f'Стало: {user.generations_left + amount}',
         reply_markup=get_admin_reply_kb()
     )
+
+
+@admin_router.message(or_f(Command('wb_status'), F.text == 'Статус WB'))
+async def cmd_wb_status(msg: types.Message) -> None:
+    """Состояние circuit breaker-ов API Wildberries"""
+    breakers = get_breakers_snapshot()
+    if not breakers:
+        await msg.answer('Запросов к API WB ещё не было.', reply_markup=get_admin_reply_kb())
+        return
+
+    states = {'closed': '✅ работает', 'half_open': '🟡 проверка', 'open': '❌ недоступно'}
+    reply_text = 'Статус API WB:\n'
+    for b in breakers:
+        reply_text += f'\n{b["host"]}: {states.get(b["state"], b["state"])}\n'
+        reply_text += f'Ошибок подряд: {b["failures"]}, отключений: {b["trips"]}\n'
+        if b['state'] == 'open':
+            reply_text += f'Повторная проверка через: {b["retry_in"]:.0f} сек\n'
+        if b['last_error']:
+            reply_text += f'Последняя ошибка: {b["last_error"]}\n'
+    await msg.answer(text=reply_text, reply_markup=get_admin_reply_kb())
+
+
+@admin_router.message(Command('loop_monitor'))
+async def cmd_loop_monitor(msg: types.Message, command: CommandObject) -> None:
+    """Включение/выключение мониторинга event loop: /loop_monitor on|off"""
+    arg = (command.args or '').strip().lower()
+    if arg in ('on', 'off'):
+        loop_monitor.set_enabled(arg == 'on')
+    elif arg:
+        await msg.answer('Использование: /loop_monitor on|off', reply_markup=get_admin_reply_kb())
+        return
+    await cmd_loop_status(msg)
+
+
+@admin_router.message(F.text == 'Event loop')
+async def cmd_loop_status(msg: types.Message) -> None:
+    """Задержка event loop и зафиксированные блокировки"""
+    s = loop_monitor.snapshot()
+    reply_text = f'Мониторинг event loop: {"✅ включён" if s["enabled"] else "❌ выключен"}\n\n'
+    reply_text += f'Лаг p50: {s["p50"] * 1000:.1f} мс\n'
+    reply_text += f'Лаг p99: {s["p99"] * 1000:.1f} мс\n'
+    reply_text += f'Замеров: {s["samples"]}\n'
+    reply_text += f'Блокировок дольше {s["threshold"]:.2f} сек: {s["stalls"]}\n'
+    if s['stalls']:
+        reply_text += f'Самая долгая: {s["max_stall"]:.2f} сек (стеки — в логе)\n'
+    reply_text += f'\n/loop_monitor {"off" if s["enabled"] else "on"} — {"выключить" if s["enabled"] else "включить"}'
+    await msg.answer(text=reply_text, reply_markup=get_admin_reply_kb())
+
+
+@admin_router.message(Command('profile_report'))
+async def cmd_profile_report(msg: types.Message, command: CommandObject) -> None:
+    """
+    Профилирование следующей генерации пользователя:
+    /profile_report <tg_id> [store_id] — пометить, /profile_report cancel <tg_id> — отменить,
+    /profile_report — список ожидающих
+    """
+    args = (command.args or '').split()
+
+    if not args:
+        pending = get_pending_profiles()
+        if not pending:
+            reply_text = 'Нет генераций, ожидающих профилирования.\n\n'
+        else:
+            reply_text = 'Ожидают профилирования:\n'
+            for r in pending:
+                reply_text += f'TG ID {r.tg_id}, магазин: {r.store_id or "любой"}\n'
+            reply_text += '\n'
+        reply_text += 'Использование: /profile_report <tg_id> [store_id], /profile_report cancel <tg_id>'
+        await msg.answer(text=reply_text, reply_markup=get_admin_reply_kb())
+        return
+
+    if args[0] == 'cancel' and len(args) == 2 and args[1].isdigit():
+        cancelled = cancel_profile(int(args[1]))
+        reply_text = 'Профилирование отменено' if cancelled else 'Для этого пользователя профилирование не запрошено'
+        await msg.answer(text=reply_text, reply_markup=get_admin_reply_kb())
+        return
+
+    if len(args) > 2 or not all(a.isdigit() for a in args):
+        await msg.answer('Использование: /profile_report <tg_id> [store_id]', reply_markup=get_admin_reply_kb())
+        return
+
+    tg_id = int(args[0])
+    store_id = int(args[1]) if len(args) == 2 else None
+    request_profile(msg.from_user.id, tg_id, store_id)
+    logger.info(f"Admin {msg.from_user.id} requested profiling for tg_id={tg_id}, store_id={store_id}")
+    reply_text = f'Следующая генерация пользователя {tg_id}'
+    reply_text += f' по магазину {store_id}' if store_id else ''
+    reply_text += ' будет выполнена под профайлером. Результаты придут сюда документами.'
+    await msg.answer(text=reply_text, reply_markup=get_admin_reply_kb())
+
+
+@admin_router.message(F.text == 'Рассылка')
+async def cmd_broadcast(msg: types.Message, state: FSMContext, session: AsyncSession) -> None:
+    """Ask for broadcast message"""
+    active = await orm_get_active_broadcast(session)
+    if active is not None:
+        reply_text = format_progress(active, broadcasts.get_rate(active.id))
+        reply_text += '\n\n/broadcast_cancel — отменить'
+        await msg.answer(text=reply_text, reply_markup=get_admin_reply_kb())
+        return
+
+    recipients = await orm_count_recipients(session)
+    reply_text = f'Отправьте сообщение для рассылки (текст, фото или документ).\n'
+    reply_text += f'Получателей: {recipients}'
+    await state.set_state(BroadcastMessage.message)
+    await msg.answer(text=reply_text, reply_markup=get_cancel_kb())
+
+
+@broadcast_router.message(F.text == 'Отмена')
+async def cancel_broadcast_input(msg: types.Message, state: FSMContext) -> None:
+    await state.clear()
+    await msg.answer(text='Рассылка отменена', reply_markup=get_admin_reply_kb())
+
+
+@broadcast_router.message(BroadcastMessage.message)
+async def get_broadcast_message(msg: types.Message, state: FSMContext) -> None:
+    """Preview broadcast message"""
+    await state.update_data(from_chat_id=msg.chat.id, message_id=msg.message_id)
+    await state.set_state(BroadcastMessage.confirm)
+    await msg.answer(text='Так сообщение увидят пользователи:')
+    await msg.bot.copy_message(chat_id=msg.chat.id, from_chat_id=msg.chat.id, message_id=msg.message_id)
+    await msg.answer(text='Запустить рассылку?', reply_markup=get_broadcast_confirm_kb())
+
+
+@broadcast_router.message(BroadcastMessage.confirm, F.text == 'Запустить рассылку')
+async def start_broadcast(msg: types.Message, state: FSMContext, session: AsyncSession) -> None:
+    data = await state.get_data()
+    await state.clear()
+
+    broadcast = await orm_create_broadcast(session, msg.from_user.id, data['from_chat_id'], data['message_id'])
+    if broadcast is None:
+        await msg.answer(text='❌ Уже идёт другая рассылка', reply_markup=get_admin_reply_kb())
+        return
+    await msg.answer(text=f'Рассылка #{broadcast.id} запущена', reply_markup=get_admin_reply_kb())
+    progress = await msg.answer(text=format_progress(broadcast))
+    await orm_set_progress_message(session, broadcast.id, progress.chat.id, progress.message_id)
+    await broadcasts.start(broadcast.id)
+    logger.info(f"Admin {msg.from_user.id} started broadcast #{broadcast.id} to {broadcast.total} users")
+
+
+@admin_router.message(Command('broadcast_status'))
+async def cmd_broadcast_status(msg: types.Message, session: AsyncSession) -> None:
+    """Прогресс текущей или последней рассылки"""
+    broadcast = await orm_get_last_broadcast(session)
+    if broadcast is None:
+        await msg.answer('Рассылок ещё не было.', reply_markup=get_admin_reply_kb())
+        return
+    reply_text = format_progress(broadcast, broadcasts.get_rate(broadcast.id))
+    if broadcast.status == 'running':
+        reply_text += '\n\n/broadcast_cancel — отменить'
+    await msg.answer(text=reply_text, reply_markup=get_admin_reply_kb())
+
+
+@admin_router.message(Command('broadcast_cancel'))
+async def cmd_broadcast_cancel(msg: types.Message, session: AsyncSession) -> None:
+    """Отмена идущей рассылки (останавливается после текущей пачки)"""
+    broadcast_id = await orm_cancel_broadcast(session)
+    if broadcast_id is None:
+        reply_text = 'Сейчас нет активной рассылки.'
+    else:
+        logger.info(f"Admin {msg.from_user.id} cancelled broadcast #{broadcast_id}")
+        reply_text = f'Рассылка #{broadcast_id} отменена, отправка остановится после текущей пачки.'
+    await msg.answer(text=reply_text, reply_markup=get_admin_reply_kb())
@@ -9,6 +9,8 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from keyboards.user_keyboards import get_menu_kb, get_subscribe_kb, get_contact_reply_kb, get_main_kb, get_onboarding_kb
 from services import auth_service
 from services.refs import orm_save_ref
+from services.broadcast import orm_unblock_user
+from services.membership import is_chat_member
 from services.logging import logger
 
 common_router = Router(name="common_router")
@@ -44,6 +46,8 @@ async def cmd_start(msg: types.Message, state: FSMContext, session: AsyncSession
 
     # Registered user - show menu
     if is_registered:
+        # Снова получает рассылки, если раньше блокировал бота
+        await orm_unblock_user(session, user_id)
         reply_text = (
             f'🎻 <b>Paganini</b> — расшифровка финансовых отчётов WB\n\n'
             f'Приветствую, {msg.from_user.first_name}!\n\n'
@@ -59,8 +63,7 @@ async def cmd_start(msg: types.Message, state: FSMContext, session: AsyncSession
     # New user - check channel subscription first
     is_subscribed = True  # Default to True if check fails
     try:
-        member = await msg.bot.get_chat_member(CHANNEL_USERNAME, user_id)
-        is_subscribed = member.status in ["member", "administrator", "creator"]
+        is_subscribed = await is_chat_member(msg.bot, CHANNEL_USERNAME, user_id)
     except Exception as e:
         logger.warning(f"Cannot check subscription for {user_id}: {e}")
 
@@ -98,8 +101,8 @@ async def cmd_start(msg: types.Message, state: FSMContext, session: AsyncSession
 @common_router.callback_query(F.data == 'check_subscription')
 async def check_subscription(callback: types.CallbackQuery, state: FSMContext):
     try:
-        member = await callback.bot.get_chat_member(CHANNEL_USERNAME, callback.from_user.id)
-        is_subscribed = member.status in ["member", "administrator", "creator"]
+        # Пользователь мог подписаться только что — «не подписан» из кэша не берём
+        is_subscribed = await is_chat_member(callback.bot, CHANNEL_USERNAME, callback.from_user.id, recheck_negative=True)
     except Exception as e:
         logger.warning(f"Cannot check subscription for {callback.from_user.id}: {e}")
         is_subscribed = True  # Allow if check fails
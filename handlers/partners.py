@@ -48,16 +48,16 @@ async def cb_pay_for(callback: CallbackQuery, session: AsyncSession):
     data = callback.data.split('_', 2)
     generations_num = int(data[1])
     amount = int(data[2])
-    user = await orm_get_user(session, callback.from_user.id)
-    bonus_left = user.bonus_left
+    # Остаток проверяется в самом UPDATE, а не по кэшированному пользователю
+    bonus_left = await orm_get_gens_for_bonus(session, callback.from_user.id, amount, generations_num)
 
-    if bonus_left >= amount:
-        await orm_get_gens_for_bonus(session, user.tg_id, amount, generations_num)
+    if bonus_left is not None:
         reply_text = f'✅ Вам добавлено генераций: {generations_num}\n'
-        reply_text += f'Осталось бонусов: {bonus_left - amount}'
+        reply_text += f'Осталось бонусов: {bonus_left}'
     else:
+        user = await orm_get_user(session, callback.from_user.id)
         reply_text = '❌ У вас недостаточно бонусов:\n'
-        reply_text += f'Осталось бонусов: {bonus_left}\n'
+        reply_text += f'Осталось бонусов: {user.bonus_left}\n'
         reply_text += f'Необходимо для добавления генераций: {amount}'
 
     await callback.message.answer(
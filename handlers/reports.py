@@ -1,23 +1,28 @@
 import os
 from datetime import datetime
+from functools import cache
 from aiogram import Router, types, F
 from aiogram.filters import Command, or_f
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import StatesGroup, State
+from aiogram.exceptions import TelegramBadRequest
 from aiogram.types import CallbackQuery, FSInputFile, InputMediaPhoto
 from sqlalchemy.ext.asyncio import AsyncSession
 from pathlib import Path
 
+from database.engine import session_maker
 from services.auth_service import orm_get_user
 from services.logging import logger
 from keyboards.user_keyboards import get_period_kb, get_main_kb, get_manage_kb, get_menu_kb, get_after_report_kb, \
     get_quarters_kb, get_quarter_period_kb, get_no_generations_kb, get_error_kb, get_onboarding_kb, get_confirm_report_kb, \
-    get_store_edit_kb, get_delete_confirm_kb, get_after_store_edit_kb
-from services.manage_stores import orm_add_store, orm_set_store, orm_edit_store, orm_check_store_owner, get_decrypted_token, \
-    orm_edit_store_name, orm_edit_store_token, orm_delete_store, orm_get_store
-from services.payment import orm_reduce_generations
-from services.report_generator import generate_report_with_params, run_with_progress, orm_add_report, \
-    InvalidTokenError, WBTimeoutError, NoDataError
+    get_store_edit_kb, get_delete_confirm_kb, get_after_store_edit_kb, get_reports_history_kb
+from services.manage_stores import orm_add_store, orm_set_store, orm_edit_store, orm_get_owned_store, get_decrypted_token, \
+    orm_edit_store_name, orm_edit_store_token, orm_delete_store
+from services.payment import orm_reserve_generation, orm_commit_generation, orm_release_generation
+from services.profiling import profiled_generation
+from services.report_tasks import report_tasks
+from services.report_history import orm_get_report_history, orm_get_user_report, orm_set_report_file_id, orm_add_report
+from services.wb_api import ensure_wb_available, InvalidTokenError, WBTimeoutError, NoDataError, WBUnavailableError
 
 reports_router = Router(name="reports_router")
 
@@ -29,13 +34,18 @@ class AddStore(StatesGroup):
     Token = State()
 
 media_folder = Path(os.getenv('MEDIA_ROOT')) / 'token'
-media = [
-    InputMediaPhoto(media=FSInputFile(media_folder / '1.jpg'), caption='Введите токен магазина, для этого в личном кабинете Wildberries следуйте по шагам на скриншотах'),
-    InputMediaPhoto(media=FSInputFile(media_folder / '2.jpg')),
-    InputMediaPhoto(media=FSInputFile(media_folder / '3.jpg')),
-    InputMediaPhoto(media=FSInputFile(media_folder / '4.jpg')),
-    InputMediaPhoto(media=FSInputFile(media_folder / '5.jpg'))
-]
+
+
+@cache
+def get_token_media() -> list[InputMediaPhoto]:
+    """Скриншоты с инструкцией по токену: собираются при первом показе, а не при импорте."""
+    return [
+        InputMediaPhoto(media=FSInputFile(media_folder / '1.jpg'), caption='Введите токен магазина, для этого в личном кабинете Wildberries следуйте по шагам на скриншотах'),
+        InputMediaPhoto(media=FSInputFile(media_folder / '2.jpg')),
+        InputMediaPhoto(media=FSInputFile(media_folder / '3.jpg')),
+        InputMediaPhoto(media=FSInputFile(media_folder / '4.jpg')),
+        InputMediaPhoto(media=FSInputFile(media_folder / '5.jpg'))
+    ]
 
 doc_number_instruction = Path(os.getenv('MEDIA_ROOT')) / 'doc_number' / 'instruction.jpg'
 
@@ -88,7 +98,7 @@ async def add_store_name(msg: types.Message, state: FSMContext):
     await state.update_data(tg_id=msg.from_user.id, name=msg.text)
     reply_text = 'Введите токен магазина Wildberries. При его создании необходимо выбрать доступ к следующим разделам:\n\n'
     reply_text += 'Контент, Статистика, Аналитика, Продвижение, Доступ чтение'
-    await msg.answer_media_group(caption=reply_text, media=media)
+    await msg.answer_media_group(caption=reply_text, media=get_token_media())
     await state.set_state(AddStore.Token)
 
 
@@ -130,7 +140,7 @@ async def cb_set_store(callback: types.CallbackQuery, session: AsyncSession, sta
         return
 
     # Validate store ownership
-    if not await orm_check_store_owner(session, store_id, callback.from_user.id):
+    if await orm_get_owned_store(session, store_id, callback.from_user.id) is None:
         await callback.answer("❌ Магазин не найден или не принадлежит вам", show_alert=True)
         return
 
@@ -157,11 +167,11 @@ async def cb_edit_store(callback: types.CallbackQuery, state: FSMContext, sessio
         return
 
     # Validate store ownership
-    if not await orm_check_store_owner(session, store_id, callback.from_user.id):
+    store = await orm_get_owned_store(session, store_id, callback.from_user.id)
+    if store is None:
         await callback.answer("❌ Магазин не найден или не принадлежит вам", show_alert=True)
         return
 
-    store = await orm_get_store(session, store_id)
     await state.clear()
 
     reply_text = f'✏️ <b>Редактирование магазина "{store.name}"</b>\n\nВыберите действие:'
@@ -182,11 +192,11 @@ async def cb_edit_store_name_start(callback: types.CallbackQuery, state: FSMCont
         await callback.answer("❌ Некорректный ID магазина", show_alert=True)
         return
 
-    if not await orm_check_store_owner(session, store_id, callback.from_user.id):
+    store = await orm_get_owned_store(session, store_id, callback.from_user.id)
+    if store is None:
         await callback.answer("❌ Магазин не найден", show_alert=True)
         return
 
-    store = await orm_get_store(session, store_id)
     await state.update_data(store_id=store_id)
     await state.set_state(EditStore.Name)
 
@@ -217,7 +227,7 @@ async def cb_edit_store_token_start(callback: types.CallbackQuery, state: FSMCon
         await callback.answer("❌ Некорректный ID магазина", show_alert=True)
         return
 
-    if not await orm_check_store_owner(session, store_id, callback.from_user.id):
+    if await orm_get_owned_store(session, store_id, callback.from_user.id) is None:
         await callback.answer("❌ Магазин не найден", show_alert=True)
         return
 
@@ -230,7 +240,7 @@ async def cb_edit_store_token_start(callback: types.CallbackQuery, state: FSMCon
         'При создании токена выберите доступ к разделам:\n'
         '• Контент\n• Статистика\n• Аналитика\n• Продвижение'
     )
-    await callback.message.answer_media_group(media=media)
+    await callback.message.answer_media_group(media=get_token_media())
     await callback.message.answer(text=reply_text, parse_mode='HTML')
     await callback.answer()
 
@@ -257,12 +267,11 @@ async def cb_delete_store_confirm(callback: types.CallbackQuery, session: AsyncS
         await callback.answer("❌ Некорректный ID магазина", show_alert=True)
         return
 
-    if not await orm_check_store_owner(session, store_id, callback.from_user.id):
+    store = await orm_get_owned_store(session, store_id, callback.from_user.id)
+    if store is None:
         await callback.answer("❌ Магазин не найден", show_alert=True)
         return
 
-    store = await orm_get_store(session, store_id)
-
     reply_text = (
         f'🗑 <b>Удаление магазина "{store.name}"</b>\n\n'
         '⚠️ Это действие нельзя отменить.\n'
@@ -286,11 +295,11 @@ async def cb_delete_store_execute(callback: types.CallbackQuery, session: AsyncS
         await callback.answer("❌ Некорректный ID магазина", show_alert=True)
         return
 
-    if not await orm_check_store_owner(session, store_id, callback.from_user.id):
+    store = await orm_get_owned_store(session, store_id, callback.from_user.id)
+    if store is None:
         await callback.answer("❌ Магазин не найден", show_alert=True)
         return
 
-    store = await orm_get_store(session, store_id)
     store_name = store.name
 
     await orm_delete_store(session, store_id, callback.from_user.id)
@@ -438,30 +447,68 @@ async def cmd_set_doc_num(msg: types.Message, state: FSMContext):
 
 @reports_router.callback_query(Report.Confirm, F.data == 'confirm_generate')
 async def cb_confirm_generate(callback: CallbackQuery, state: FSMContext, session: AsyncSession):
-    """Confirmed - start report generation"""
+    """Confirmed - reserve a generation and start the report in background"""
     data = await state.get_data()
     await state.clear()
 
-    dates = data['period']
-    doc_num = data['doc_num']
-    store_name = data['name']
-    store_token = data['token']
     tg_id = data['user_id']
-    store_id = data['store_id']
-    date = datetime.strptime(dates.split('-')[0], "%d.%m.%Y").date()
-
     msg = callback.message
     await callback.answer()
 
+    if report_tasks.is_running(tg_id):
+        await msg.answer('⏳ Предыдущий отчёт ещё формируется. Дождитесь его и запустите генерацию снова.')
+        return
+
     try:
-        progress_state = {}
-        file_path = await run_with_progress(
-            msg,
-            "⏳ Формируется отчет, пожалуйста, подождите",
-            generate_report_with_params,
-            progress_state,
-            dates, doc_num, store_token, store_name, tg_id, store_id
+        # Если WB лежит, не заставляем пользователя ждать ретраи
+        ensure_wb_available()
+    except WBUnavailableError as e:
+        await answer_generation_error(msg, tg_id, data['period'], e)
+        return
+
+    # Списываем генерацию до работы с WB: без баланса отчёт не запускается
+    if not await orm_reserve_generation(session, tg_id):
+        await msg.answer(
+            text=(
+                '📊 <b>Генерации закончились</b>\n\n'
+                'Пополните баланс или пригласите друзей для получения бонусов.'
+            ),
+            reply_markup=get_no_generations_kb(),
+            parse_mode='HTML'
         )
+        return
+
+    if report_tasks.full:
+        await msg.answer('⏳ Сейчас формируется много отчётов, ваш запустится в порядке очереди.')
+
+    # Генерация идёт минутами: апдейт завершается сразу, чтобы не держать
+    # очередь апдейтов пользователя и общий слот обработки
+    report_tasks.start(tg_id, generate_report(
+        msg, tg_id, data['store_id'], data['name'], data['token'], data['period'], data['doc_num']
+    ))
+
+
+async def generate_report(msg: types.Message, tg_id: int, store_id: int, store_name: str, store_token: str,
+                          dates: str, doc_num: str):
+    """Фоновая генерация отчёта по зарезервированной генерации (services/report_tasks.py)."""
+    # pandas и openpyxl загружаются при первой генерации, а не при старте бота
+    from services.report_generator import generate_report_with_params, run_with_progress
+
+    date = datetime.strptime(dates.split('-')[0], "%d.%m.%Y").date()
+    # Генерация зарезервирована (списана), а отчёт ещё не доставлен
+    reserved = True
+    try:
+        async with report_tasks.slot():
+            progress_state = {}
+            # Если админ запросил профиль этой генерации — выполняем под профайлером
+            async with profiled_generation(msg.bot, tg_id, store_id):
+                file_path = await run_with_progress(
+                    msg,
+                    "⏳ Формируется отчет, пожалуйста, подождите",
+                    generate_report_with_params,
+                    progress_state,
+                    dates, doc_num, store_token, store_name, tg_id, store_id
+                )
         await msg.answer(
             text=(
                 f'✅ <b>Отчет готов!</b>\n\n'
@@ -470,23 +517,47 @@ async def cb_confirm_generate(callback: CallbackQuery, state: FSMContext, sessio
             ),
             parse_mode='HTML'
         )
-        await msg.answer_document(
+        sent = await msg.answer_document(
             FSInputFile(file_path),
             reply_markup=get_after_report_kb()
         )
-        # Check if this is the first report for tip
-        user = await orm_get_user(session, tg_id)
-        is_first_report = user.generations_made == 0
-
-        await orm_add_report(session, tg_id, date, file_path, store_id)
-        await orm_reduce_generations(session, tg_id)
-
-        if is_first_report:
-            await msg.answer(
-                text='💡 <i>Поздравляем с первым отчетом! Все ваши отчеты сохраняются и доступны для повторного скачивания.</i>',
-                parse_mode='HTML'
-            )
-    except InvalidTokenError:
+        # Отчёт доставлен: дальше генерация не возвращается, ошибки учёта только логируются
+        reserved = False
+    except Exception as e:
+        await answer_generation_error(msg, tg_id, dates, e)
+        return
+    finally:
+        if reserved:
+            try:
+                async with session_maker() as session:
+                    await orm_release_generation(session, tg_id)
+            except Exception as e:
+                logger.error(f"Failed to release reserved generation for user {tg_id}: {e}", exc_info=True)
+
+    try:
+        async with session_maker() as session:
+            generations_made = await orm_commit_generation(session, tg_id)
+    except Exception as e:
+        logger.error(f"Report delivered, but generation commit failed for user {tg_id}: {e}", exc_info=True)
+        generations_made = None
+
+    try:
+        async with session_maker() as session:
+            # file_id — для повторной отправки из истории без загрузки файла
+            await orm_add_report(session, tg_id, date, file_path, store_id, file_id=sent.document.file_id)
+    except Exception as e:
+        logger.error(f"Report delivered, but not saved to history for user {tg_id}: {e}", exc_info=True)
+
+    if generations_made == 1:
+        await msg.answer(
+            text='💡 <i>Поздравляем с первым отчетом! Все ваши отчеты сохраняются и доступны для повторного скачивания.</i>',
+            parse_mode='HTML'
+        )
+
+
+async def answer_generation_error(msg: types.Message, tg_id: int, dates: str, error: Exception):
+    """Сообщение пользователю об ошибке генерации."""
+    if isinstance(error, InvalidTokenError):
         logger.error(f"Invalid token for user {tg_id}")
         await msg.answer(
             text=(
@@ -501,7 +572,7 @@ async def cb_confirm_generate(callback: CallbackQuery, state: FSMContext, sessio
             reply_markup=get_error_kb('invalid_token'),
             parse_mode='HTML'
         )
-    except WBTimeoutError:
+    elif isinstance(error, WBTimeoutError):
         logger.error(f"WB API timeout for user {tg_id}")
         await msg.answer(
             text=(
@@ -514,7 +585,21 @@ async def cb_confirm_generate(callback: CallbackQuery, state: FSMContext, sessio
             reply_markup=get_error_kb('timeout'),
             parse_mode='HTML'
         )
-    except NoDataError:
+    elif isinstance(error, WBUnavailableError):
+        logger.error(f"WB API unavailable for user {tg_id}: {error}")
+        retry_minutes = max(1, round(error.retry_in / 60)) if error.retry_in else 5
+        await msg.answer(
+            text=(
+                '❌ <b>API Wildberries временно недоступно</b>\n\n'
+                'Сервера WB сейчас не отвечают, поэтому генерация не запускалась.\n\n'
+                '<b>Что делать:</b>\n'
+                f'Попробуйте повторить генерацию через {retry_minutes} мин.\n\n'
+                '💡 Количество генераций осталось неизменным'
+            ),
+            reply_markup=get_error_kb('timeout'),
+            parse_mode='HTML'
+        )
+    elif isinstance(error, NoDataError):
         logger.error(f"No data for user {tg_id}, period {dates}")
         await msg.answer(
             text=(
@@ -528,8 +613,8 @@ async def cb_confirm_generate(callback: CallbackQuery, state: FSMContext, sessio
             reply_markup=get_error_kb('no_data'),
             parse_mode='HTML'
         )
-    except Exception as e:
-        logger.error(f"Report generation failed for user {tg_id}: {e}", exc_info=True)
+    else:
+        logger.error(f"Report generation failed for user {tg_id}: {error}", exc_info=error)
         await msg.answer(
             text=(
                 '❌ <b>Ошибка при формировании отчета</b>\n\n'
@@ -539,3 +624,96 @@ async def cb_confirm_generate(callback: CallbackQuery, state: FSMContext, sessio
             reply_markup=get_error_kb('timeout'),
             parse_mode='HTML'
         )
+
+
+# ------------------ Report history ------------------
+
+@reports_router.callback_query(F.data == 'cb_btn_reports_history')
+async def cb_reports_history(callback: CallbackQuery, session: AsyncSession):
+    """История отчётов выбранного магазина"""
+    user = await orm_get_user(session, callback.from_user.id)
+    await callback.answer()
+    if user is None or user.selected_store is None:
+        await callback.message.answer('У вас не выбран магазин — выберите его, чтобы посмотреть отчеты')
+        await handle_manage_stores(callback.message, callback.from_user.id, session)
+        return
+
+    text, markup = await build_reports_history(session, user.tg_id, user.selected_store.id, user.selected_store.name)
+    await callback.message.answer(text=text, reply_markup=markup, parse_mode='HTML')
+
+
+@reports_router.callback_query(F.data.startswith('rhist_'))
+async def cb_reports_history_page(callback: CallbackQuery, session: AsyncSession):
+    """Страница истории: rhist_<store_id> или rhist_<store_id>_<YYYYMMDD>_<report_id>"""
+    try:
+        parts = callback.data.split('_')
+        store_id = int(parts[1])
+        before = (datetime.strptime(parts[2], '%Y%m%d').date(), int(parts[3])) if len(parts) == 4 else None
+    except (ValueError, IndexError):
+        await callback.answer('❌ Некорректная страница', show_alert=True)
+        return
+
+    store = await orm_get_owned_store(session, store_id, callback.from_user.id)
+    if store is None:
+        await callback.answer('❌ Магазин не найден', show_alert=True)
+        return
+
+    text, markup = await build_reports_history(session, store.tg_id, store.id, store.name, before)
+    await callback.answer()
+    try:
+        await callback.message.edit_text(text=text, reply_markup=markup, parse_mode='HTML')
+    except TelegramBadRequest:
+        # Сообщение слишком старое или не изменилось
+        await callback.message.answer(text=text, reply_markup=markup, parse_mode='HTML')
+
+
+async def build_reports_history(session: AsyncSession, tg_id: int, store_id: int, store_name: str, before=None):
+    reports, has_more = await orm_get_report_history(session, tg_id, store_id, before)
+    if reports:
+        text = (
+            f'🗂 <b>Отчеты магазина "{store_name}"</b>\n\n'
+            'Нажмите на период, чтобы получить файл повторно — генерация не списывается.'
+        )
+    elif before is None:
+        text = f'🗂 По магазину "<b>{store_name}</b>" пока нет отчетов'
+    else:
+        text = f'🗂 Более ранних отчетов по магазину "<b>{store_name}</b>" нет'
+    return text, get_reports_history_kb(reports, has_more, store_id, first_page=before is None)
+
+
+@reports_router.callback_query(F.data.startswith('resend_'))
+async def cb_resend_report(callback: CallbackQuery, session: AsyncSession):
+    """Повторная отправка отчёта: по file_id, иначе файлом с диска"""
+    try:
+        report_id = int(callback.data.split('_', 1)[1])
+    except ValueError:
+        await callback.answer('❌ Некорректный ID отчета', show_alert=True)
+        return
+
+    report = await orm_get_user_report(session, report_id, callback.from_user.id)
+    if report is None:
+        await callback.answer('❌ Отчет не найден', show_alert=True)
+        return
+    await callback.answer()
+
+    if report.file_id:
+        try:
+            await callback.message.answer_document(report.file_id, reply_markup=get_after_report_kb())
+            return
+        except TelegramBadRequest as e:
+            logger.warning(f"Report {report.id}: file_id rejected by Telegram ({e}), sending from disk")
+
+    report_path = Path(report.report_path)
+    if not report_path.exists():
+        await callback.message.answer(
+            text=(
+                '❌ <b>Файл отчета больше недоступен</b>\n\n'
+                'Сформируйте отчет за этот период заново.'
+            ),
+            reply_markup=get_after_report_kb(),
+            parse_mode='HTML'
+        )
+        return
+
+    sent = await callback.message.answer_document(FSInputFile(report_path), reply_markup=get_after_report_kb())
+    await orm_set_report_file_id(session, report.id, sent.document.file_id)
@@ -16,10 +16,38 @@ def get_admin_reply_kb() -> ReplyKeyboardMarkup:
             [
                 KeyboardButton(text='Топ по генерациям'),
                 KeyboardButton(text='Последние реги'),
+            ],
+            [
+                KeyboardButton(text='Статус WB'),
+                KeyboardButton(text='Event loop'),
+            ],
+            [
+                KeyboardButton(text='Рассылка'),
             ]
         ],
         resize_keyboard=True,
         input_field_placeholder='Введите команду'
     )
 
-    return rkb
\ No newline at end of file
+    return rkb
+
+
+def get_broadcast_confirm_kb() -> ReplyKeyboardMarkup:
+    """Confirm broadcast kb"""
+    return ReplyKeyboardMarkup(
+        keyboard=[
+            [
+                KeyboardButton(text='Запустить рассылку'),
+                KeyboardButton(text='Отмена'),
+            ]
+        ],
+        resize_keyboard=True,
+    )
+
+
+def get_cancel_kb() -> ReplyKeyboardMarkup:
+    """Cancel kb"""
+    return ReplyKeyboardMarkup(
+        keyboard=[[KeyboardButton(text='Отмена')]],
+        resize_keyboard=True,
+    )
\ No newline at end of file
@@ -1,10 +1,23 @@
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, ReplyKeyboardMarkup, KeyboardButton
 from aiogram.utils.keyboard import InlineKeyboardBuilder
+from datetime import timedelta
+from functools import wraps
 
 from services.manage_stores import orm_get_user_stores
-from services.report_generator import get_weeks_range, get_quarters_range, get_quarters_weeks
+from services.periods import get_weeks_range, get_quarters_range, get_quarters_weeks, daily_cache
 
 
+def _static(builder):
+    """Клавиатура без параметров: строится один раз при импорте, дальше возвращается готовая."""
+    markup = builder()
+
+    @wraps(builder)
+    def get():
+        return markup
+    return get
+
+
+@_static
 def get_main_kb() -> InlineKeyboardMarkup:
     """Get main kb"""
     ikb = InlineKeyboardMarkup(inline_keyboard=[
@@ -14,10 +27,12 @@ def get_main_kb() -> InlineKeyboardMarkup:
     return ikb
 
 
+@_static
 def get_menu_kb() -> InlineKeyboardMarkup:
     """Get menu kb - simplified and clean"""
     ikb = InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text='📊 Создать отчёт', callback_data='cb_btn_generate_report')],
+        [InlineKeyboardButton(text='🗂 Мои отчёты', callback_data='cb_btn_reports_history')],
         [InlineKeyboardButton(text='🏪 Мои магазины', callback_data='cb_btn_manage_stores')],
         [InlineKeyboardButton(text='💳 Пополнить баланс', callback_data='cb_btn_payment')],
         [InlineKeyboardButton(text='💎 Получить бонусы', callback_data='cb_btn_bonus')],
@@ -27,6 +42,7 @@ def get_menu_kb() -> InlineKeyboardMarkup:
 
     return ikb
 
+@_static
 def get_subscribe_kb() -> InlineKeyboardMarkup:
     """Get subscribe kb"""
     ikb = InlineKeyboardMarkup(inline_keyboard=[
@@ -37,6 +53,7 @@ def get_subscribe_kb() -> InlineKeyboardMarkup:
     return ikb
 
 
+@_static
 def get_contact_reply_kb() -> ReplyKeyboardMarkup:
     """Get contact reply kb"""
     rkb = ReplyKeyboardMarkup(
@@ -88,6 +105,7 @@ def get_delete_confirm_kb(store_id: int) -> InlineKeyboardMarkup:
     return ikb
 
 
+@_static
 def get_after_store_edit_kb() -> InlineKeyboardMarkup:
     """Get kb shown after editing store (name/token)"""
     ikb = InlineKeyboardMarkup(inline_keyboard=[
@@ -98,6 +116,8 @@ def get_after_store_edit_kb() -> InlineKeyboardMarkup:
     return ikb
 
 
+# Недели считаются от сегодняшней даты: клавиатура пересобирается раз в день
+@daily_cache()
 def get_period_kb() -> InlineKeyboardMarkup:
     """Get select period kb"""
     ikb = InlineKeyboardBuilder()
@@ -115,6 +135,7 @@ def get_period_kb() -> InlineKeyboardMarkup:
     return ikb.as_markup()
 
 
+@daily_cache()
 def get_quarters_kb() -> InlineKeyboardMarkup:
     """Get select quarter kb"""
     ikb = InlineKeyboardBuilder()
@@ -131,6 +152,7 @@ def get_quarters_kb() -> InlineKeyboardMarkup:
     return ikb.as_markup()
 
 
+@daily_cache()
 def get_quarter_period_kb(quarter_data: str) -> InlineKeyboardMarkup:
     """Get select from quarter period kb"""
     ikb = InlineKeyboardBuilder()
@@ -151,10 +173,12 @@ def get_quarter_period_kb(quarter_data: str) -> InlineKeyboardMarkup:
     return ikb.as_markup()
 
 
+@_static
 def get_after_report_kb() -> InlineKeyboardMarkup:
     """Get kb shown after generating report"""
     ikb = InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text='📊 Другой период', callback_data='cb_btn_generate_report')],
+        [InlineKeyboardButton(text='🗂 Мои отчёты', callback_data='cb_btn_reports_history')],
         [InlineKeyboardButton(text='🏪 Сменить магазин', callback_data='cb_btn_manage_stores')],
         [InlineKeyboardButton(text='☰ Меню', callback_data='cb_btn_menu')]
     ])
@@ -162,6 +186,37 @@ def get_after_report_kb() -> InlineKeyboardMarkup:
     return ikb
 
 
+def get_reports_history_kb(reports, has_more: bool, store_id: int, first_page: bool) -> InlineKeyboardMarkup:
+    """Get report history page kb: one button per report, keyset paging by (date_of_week, id)"""
+    ikb = InlineKeyboardBuilder()
+    for report in reports:
+        week_end = report.date_of_week + timedelta(days=6)
+        ikb.add(
+            InlineKeyboardButton(
+                text=f'📄 {report.date_of_week:%d.%m.%Y}-{week_end:%d.%m.%Y}',
+                callback_data=f'resend_{report.id}'
+            )
+        )
+    ikb.adjust(1)
+
+    nav = []
+    if not first_page:
+        nav.append(InlineKeyboardButton(text='⏮ Новые', callback_data=f'rhist_{store_id}'))
+    if has_more:
+        last = reports[-1]
+        nav.append(InlineKeyboardButton(
+            text='Старше →',
+            callback_data=f'rhist_{store_id}_{last.date_of_week:%Y%m%d}_{last.id}'
+        ))
+    if nav:
+        ikb.row(*nav)
+    ikb.row(InlineKeyboardButton(text='🏪 Сменить магазин', callback_data='cb_btn_manage_stores'))
+    ikb.row(InlineKeyboardButton(text='☰ Меню', callback_data='cb_btn_menu'))
+
+    return ikb.as_markup()
+
+
+@_static
 def get_payment_kb() -> InlineKeyboardMarkup:
     """Get payment kb with Year plan highlighted"""
     ikb = InlineKeyboardBuilder()
@@ -236,6 +291,7 @@ def get_error_kb(error_type: str) -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(inline_keyboard=buttons)
 
 
+@_static
 def get_no_generations_kb() -> InlineKeyboardMarkup:
     """Get kb when user has no generations left"""
     ikb = InlineKeyboardMarkup(inline_keyboard=[
@@ -247,6 +303,7 @@ def get_no_generations_kb() -> InlineKeyboardMarkup:
     return ikb
 
 
+@_static
 def get_confirm_report_kb() -> InlineKeyboardMarkup:
     """Get kb for confirming report generation"""
     ikb = InlineKeyboardMarkup(inline_keyboard=[
@@ -258,6 +315,7 @@ def get_confirm_report_kb() -> InlineKeyboardMarkup:
     return ikb
 
 
+@_static
 def get_bonus_kb() -> InlineKeyboardMarkup:
     """Get bonus kb"""
     ikb = InlineKeyboardBuilder()
@@ -1,6 +1,9 @@
 import asyncio
+import hashlib
+import importlib
 import os
 import logging
+import signal
 
 from aiogram import Bot, Dispatcher, types
 
@@ -12,21 +15,32 @@ from services.logging import logger
 load_dotenv(find_dotenv())
 
 from middlewares.db import DataBaseSession
+from middlewares.ordering import UserSerialMiddleware
 
-from database.engine import create_db, drop_db, session_maker, engine
-from sqlalchemy import text
+from database.engine import drop_db, session_maker, engine
+from database.migrations import run_migrations, reencrypt_tokens
 
 from handlers.user import user_router
 from handlers.reports import reports_router
-from handlers.admin import admin_router
+from handlers.admin import admin_router, broadcast_router
 from handlers.partners import partners_router
 from handlers.common import common_router
 
 from common.bot_commands_list import user_commands
-from services.report_generator import close_http_clients
-from services.webhook_server import start_webhook_server, stop_webhook_server, set_payment_callback
+from services.wb_api import close_http_clients
+from services.webhook_server import start_webhook_server, stop_webhook_server, set_payment_callback, \
+    set_telegram_dispatcher, TELEGRAM_WEBHOOK_PATH
+from services.update_dispatcher import UpdateDispatcher
+from services.telegram_limiter import TelegramRateLimiter
 from services.payment import process_modulbank_payment
-from services.crypto import encrypt_token, is_token_encrypted
+from services.payment_inbox import PaymentInbox
+from services.crypto import get_key_ring, has_previous_keys
+from services.loop_monitor import loop_monitor, ENABLED as LOOP_MONITOR_ENABLED
+from services.user_cache import start_cache_invalidation
+from services.fsm_storage import create_fsm_storage, cleanup_loop as fsm_cleanup_loop, SQLStorage
+from services.broadcast import broadcasts
+from services.membership import club_refresh_loop, CLUB_REFRESH_INTERVAL
+from services.report_tasks import report_tasks
 
 # logging settings
 logging.basicConfig(
@@ -36,113 +50,89 @@ logging.basicConfig(
 
 # Init bot and Dispatcher
 bot = Bot(token=os.getenv('TOKEN'))
+# Лимиты Telegram на исходящие сообщения, приоритеты и повтор на 429
+bot.session.middleware(TelegramRateLimiter())
 
 # Load admin IDs from environment (comma-separated)
 admin_ids_str = os.getenv('ADMIN_IDS', '')
 bot.admins_list = [int(x.strip()) for x in admin_ids_str.split(',') if x.strip().isdigit()]
 
-dp = Dispatcher()
+# Состояния диалогов в общей БД (FSM_STORAGE=memory — в памяти процесса)
+dp = Dispatcher(storage=create_fsm_storage(engine))
 
 # Register routers
+dp.include_router(broadcast_router)
 dp.include_router(common_router)
 dp.include_router(user_router)
 dp.include_router(reports_router)
 dp.include_router(admin_router)
 dp.include_router(partners_router)
 
+# Webhook-режим Telegram: публичный адрес сервера (например https://bot.example.com).
+# Если не задан — polling
+TELEGRAM_WEBHOOK_URL = (os.getenv('TELEGRAM_WEBHOOK_URL') or '').rstrip('/')
+# Одинаковый для всех реплик: каждая при старте заново вызывает setWebhook
+TELEGRAM_WEBHOOK_SECRET = (
+    os.getenv('TELEGRAM_WEBHOOK_SECRET')
+    or hashlib.sha256(f"paganini-webhook:{os.getenv('TOKEN')}".encode()).hexdigest()
+)
+
+# Загрузить модуль генерации отчётов (pandas, openpyxl) в фоне после старта;
+# 0 — при первой генерации
+REPORT_PRELOAD = (os.getenv('REPORT_PRELOAD') or '1').lower() in ('1', 'true', 'yes', 'on')
+
 # Глобальная переменная для webhook runner
 webhook_runner = None
+# Очередь апдейтов Telegram в webhook-режиме
+update_dispatcher = None
+# Межпроцессная инвалидация кэша пользователей (USER_CACHE_INVALIDATION=pg_notify)
+cache_invalidation = None
+# Фоновые задачи (держим ссылки, чтобы задачи не собрал GC)
+background_tasks = set()
 
 
-async def run_modulbank_migration():
-    """Миграция для добавления колонок Модуль Банка (выполняется автоматически)."""
-    async with engine.begin() as conn:
-        # Проверяем тип БД и добавляем колонки если их нет
-        if 'postgresql' in str(engine.url):
-            # PostgreSQL
-            check_query = text("""
-                SELECT column_name FROM information_schema.columns
-                WHERE table_name = 'payment'
-                AND column_name IN ('modulbank_bill_id', 'modulbank_transaction_id')
-            """)
-            result = await conn.execute(check_query)
-            existing = [row[0] for row in result.fetchall()]
-
-            if 'modulbank_bill_id' not in existing:
-                logger.info("Миграция: добавляю колонку modulbank_bill_id...")
-                await conn.execute(text("ALTER TABLE payment ADD COLUMN modulbank_bill_id VARCHAR(64)"))
-
-            if 'modulbank_transaction_id' not in existing:
-                logger.info("Миграция: добавляю колонку modulbank_transaction_id...")
-                await conn.execute(text("ALTER TABLE payment ADD COLUMN modulbank_transaction_id VARCHAR(64)"))
-
-            # Делаем yoo_id nullable
-            try:
-                await conn.execute(text("ALTER TABLE payment ALTER COLUMN yoo_id DROP NOT NULL"))
-            except Exception:
-                pass  # Уже nullable
-        else:
-            # SQLite
-            try:
-                await conn.execute(text("ALTER TABLE payment ADD COLUMN modulbank_bill_id VARCHAR(64)"))
-                logger.info("Миграция: добавлена колонка modulbank_bill_id")
-            except Exception:
-                pass
-            try:
-                await conn.execute(text("ALTER TABLE payment ADD COLUMN modulbank_transaction_id VARCHAR(64)"))
-                logger.info("Миграция: добавлена колонка modulbank_transaction_id")
-            except Exception:
-                pass
-
-
-async def run_token_encryption_migration():
-    """Миграция: шифрование plaintext токенов WB."""
-    if not os.getenv('ENCRYPTION_KEY'):
-        logger.warning("ENCRYPTION_KEY не установлен — токены не будут зашифрованы!")
-        return
-
-    from sqlalchemy import select, update
-    from database.models import Store
-
-    async with session_maker() as session:
-        result = await session.execute(select(Store))
-        stores = result.scalars().all()
-
-        migrated = 0
-        for store in stores:
-            if not is_token_encrypted(store.token):
-                encrypted = encrypt_token(store.token)
-                await session.execute(
-                    update(Store).where(Store.id == store.id).values(token=encrypted)
-                )
-                migrated += 1
-                logger.info(f"Токен магазина #{store.id} зашифрован")
-
-        if migrated > 0:
-            await session.commit()
-            logger.info(f"Миграция токенов завершена: зашифровано {migrated} токенов")
+def start_background_task(coro):
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
 
 
 async def on_startup(bot):
-    global webhook_runner
+    global webhook_runner, cache_invalidation, update_dispatcher
 
     run_param = False
     if run_param:
         await drop_db()
 
-    logger.info("Creating database tables...")
-    await create_db()
-    logger.info("Database tables created")
+    # Ключи шифрования токенов декодируются один раз
+    get_key_ring()
+
+    # Создание таблиц и миграции (при актуальной схеме — одна проверка версии)
+    logger.info("Проверяю схему БД...")
+    await run_migrations(engine)
 
-    # Автоматическая миграция для Модуль Банка
-    logger.info("Проверяю миграции...")
-    await run_modulbank_migration()
+    # Ротация ключа шифрования: перешифровываем токены в фоне, бот уже работает
+    if has_previous_keys():
+        logger.info("Заданы ENCRYPTION_PREVIOUS_KEYS: запускаю фоновое перешифрование токенов")
+        start_background_task(reencrypt_tokens(engine))
+    elif get_key_ring().configured:
+        # Токены, сохранённые без ключа (миграция v3 без ENCRYPTION_KEY): без них — один COUNT
+        start_background_task(reencrypt_tokens(engine))
 
-    # Шифрование plaintext токенов
-    logger.info("Проверяю шифрование токенов...")
-    await run_token_encryption_migration()
+    cache_invalidation = await start_cache_invalidation(engine)
 
-    logger.info("Миграции завершены")
+    if isinstance(dp.storage, SQLStorage):
+        start_background_task(fsm_cleanup_loop(engine))
+
+    # Рассылки админа: продолжаем прерванные перезапуском
+    broadcasts.setup(bot, engine)
+    start_background_task(broadcasts.watch())
+
+    # Статус участников клуба держим в кэше для ежемесячного бонуса
+    club_chat_id = os.getenv('CLUB_CHAT_ID')
+    if CLUB_REFRESH_INTERVAL > 0 and club_chat_id:
+        start_background_task(club_refresh_loop(bot, engine, int(club_chat_id)))
 
     # Запускаем webhook сервер для Модуль Банка
     # Railway использует переменную PORT, локально — WEBHOOK_PORT
@@ -152,12 +142,28 @@ async def on_startup(bot):
 
     logger.info(f"Starting webhook server on {webhook_host}:{webhook_port}...")
 
-    # Устанавливаем callback для обработки платежей
-    set_payment_callback(lambda data: process_modulbank_payment(data, bot, session_maker))
+    # Уведомления об оплате сохраняются в очередь, платежи обрабатываются в фоне
+    payment_inbox = PaymentInbox(session_maker, lambda data: process_modulbank_payment(data, bot, session_maker))
+    set_payment_callback(payment_inbox.enqueue)
+    start_background_task(payment_inbox.run())
+
+    # Апдейты Telegram принимаются тем же сервером
+    if TELEGRAM_WEBHOOK_URL:
+        update_dispatcher = UpdateDispatcher(dp, bot)
+        update_dispatcher.start()
+        set_telegram_dispatcher(update_dispatcher, TELEGRAM_WEBHOOK_SECRET)
 
     webhook_runner = await start_webhook_server(webhook_host, webhook_port)
     logger.info("Webhook server started successfully")
 
+    # Мониторинг задержки event loop (/metrics, стеки блокировок в логе)
+    if LOOP_MONITOR_ENABLED:
+        loop_monitor.start()
+
+    # Бот уже принимает апдейты, тяжёлые импорты — в потоке, чтобы первая генерация не ждала
+    if REPORT_PRELOAD:
+        start_background_task(asyncio.to_thread(importlib.import_module, 'services.report_generator'))
+
 
 async def on_shutdown(bot):
     global webhook_runner
@@ -167,6 +173,25 @@ async def on_shutdown(bot):
     if webhook_runner:
         await stop_webhook_server(webhook_runner)
 
+    # Новые апдейты уже не принимаются — дорабатываем принятые
+    if update_dispatcher is not None:
+        set_telegram_dispatcher(None)
+        await update_dispatcher.stop()
+
+    loop_monitor.stop()
+
+    # Генерации отчётов отменяются, зарезервированные генерации возвращаются
+    await report_tasks.stop()
+
+    # Сохраняем чекпоинт рассылки: после запуска она продолжится
+    await broadcasts.stop()
+
+    if cache_invalidation is not None:
+        await cache_invalidation.stop()
+
+    for task in list(background_tasks):
+        task.cancel()
+
     await close_http_clients()
 
 
@@ -178,19 +203,27 @@ async def main() -> None:
         dp.startup.register(on_startup)
         dp.shutdown.register(on_shutdown)
 
+        # Первым: апдейты одного пользователя по очереди, сессия БД открывается уже после ожидания.
+        # В webhook-режиме это делают воркеры UpdateDispatcher
+        if not TELEGRAM_WEBHOOK_URL:
+            dp.update.outer_middleware(UserSerialMiddleware())
         dp.update.middleware(DataBaseSession(session_pool=session_maker))
         dp.message.middleware(AllowPrivateMessagesOnly())
 
-        logger.info("Deleting webhook...")
-        await bot.delete_webhook(drop_pending_updates=True)
-        logger.info("Webhook deleted")
+        if not TELEGRAM_WEBHOOK_URL:
+            logger.info("Deleting webhook...")
+            await bot.delete_webhook(drop_pending_updates=True)
+            logger.info("Webhook deleted")
 
         logger.info("Setting bot commands...")
         await bot.set_my_commands(commands=user_commands, scope=types.BotCommandScopeAllPrivateChats())
         logger.info("Bot commands set")
 
-        logger.info("Starting polling...")
-        await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
+        if TELEGRAM_WEBHOOK_URL:
+            await run_webhook()
+        else:
+            logger.info("Starting polling...")
+            await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
     except Exception as ex:
         import traceback
         logger.error(f"Bot stopped with error: {ex}")
@@ -200,5 +233,26 @@ async def main() -> None:
         logger.info("Bot session closed")
 
 
+async def run_webhook() -> None:
+    """Webhook-режим: апдейты приходят на webhook сервер, работаем до SIGINT/SIGTERM."""
+    await dp.emit_startup(bot=bot)
+    try:
+        logger.info(f"Setting webhook {TELEGRAM_WEBHOOK_URL}{TELEGRAM_WEBHOOK_PATH}...")
+        await bot.set_webhook(
+            url=f'{TELEGRAM_WEBHOOK_URL}{TELEGRAM_WEBHOOK_PATH}',
+            secret_token=TELEGRAM_WEBHOOK_SECRET,
+            allowed_updates=dp.resolve_used_update_types(),
+        )
+        logger.info("Webhook set, waiting for updates")
+
+        stop_event = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop_event.set)
+        await stop_event.wait()
+    finally:
+        await dp.emit_shutdown(bot=bot)
+
+
 if __name__ == "__main__":
     asyncio.run(main())
\ No newline at end of file
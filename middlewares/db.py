@@ -1,9 +1,65 @@
-from typing import Any, Awaitable, Callable, Dict, List
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
 
 from aiogram import BaseMiddleware
 from aiogram.types import TelegramObject
 
-from sqlalchemy.ext.asyncio import async_sessionmaker
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from services.metrics import UPDATE_DB_QUERIES, UPDATE_DB_SECONDS, UPDATES_BY_DB_USAGE
+
+
+class LazySession:
+    """
+    Ленивая обёртка над AsyncSession для одного апдейта.
+
+    Сессия создаётся при первом обращении, поэтому апдейты без работы с БД
+    (кнопки меню, /about, отфильтрованные сообщения) её не открывают вовсе.
+    Соединение из пула AsyncSession берёт на первом запросе и возвращает
+    на commit/rollback. Считает запросы и время в БД для метрик.
+    """
+
+    # Асинхронные методы, время которых учитывается как время в БД
+    _TIMED = {'execute', 'scalar', 'scalars', 'get', 'stream', 'stream_scalars',
+              'commit', 'flush', 'rollback', 'refresh', 'merge', 'delete'}
+    # Из них — запросы
+    _QUERIES = {'execute', 'scalar', 'scalars', 'get', 'stream', 'stream_scalars'}
+
+    def __init__(self, session_pool: async_sessionmaker):
+        self._session_pool = session_pool
+        self._session: Optional[AsyncSession] = None
+        self.queries = 0
+        self.db_time = 0.0
+
+    @property
+    def opened(self) -> bool:
+        return self._session is not None
+
+    def _get_session(self) -> AsyncSession:
+        if self._session is None:
+            self._session = self._session_pool()
+        return self._session
+
+    def __getattr__(self, name: str) -> Any:
+        attr = getattr(self._get_session(), name)
+        if name in self._TIMED:
+            return self._timed(attr, name in self._QUERIES)
+        return attr
+
+    def _timed(self, method: Callable[..., Awaitable[Any]], is_query: bool):
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await method(*args, **kwargs)
+            finally:
+                self.db_time += time.perf_counter() - started
+                if is_query:
+                    self.queries += 1
+        return wrapper
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
 
 
 class DataBaseSession(BaseMiddleware):
@@ -17,6 +73,13 @@ class DataBaseSession(BaseMiddleware):
         event: TelegramObject,
         data: Dict[str, Any],
     ) -> Any:
-        async with self.session_pool() as session:
-            data['session'] = session
-            return await handler(event, data)
\ No newline at end of file
+        session = LazySession(self.session_pool)
+        data['session'] = session
+        try:
+            return await handler(event, data)
+        finally:
+            await session.close()
+            if session.opened:
+                UPDATE_DB_QUERIES.observe(session.queries)
+                UPDATE_DB_SECONDS.observe(session.db_time)
+            UPDATES_BY_DB_USAGE.inc(db='used' if session.opened else 'unused')
@@ -0,0 +1,79 @@
+import asyncio
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, Update
+
+from services.metrics import ACTIVE_UPDATES, QUEUE_DEPTH, UPDATE_QUEUE_WAIT_SECONDS
+from services.update_dispatcher import update_key
+
+
+# Сколько апдейтов обрабатывается одновременно (по всем пользователям)
+UPDATE_CONCURRENCY = int(os.getenv('UPDATE_CONCURRENCY') or '64')
+
+
+class UserSerialMiddleware(BaseMiddleware):
+    """
+    Апдейты одного пользователя — строго по очереди, разных — параллельно.
+
+    aiogram в polling-режиме запускает каждый апдейт отдельной задачей,
+    поэтому два быстрых нажатия одного пользователя могут выполняться
+    одновременно и гонять переходы FSM. Middleware держит на каждого
+    пользователя asyncio.Lock (FIFO: порядок захвата = порядок апдейтов),
+    а общий семафор ограничивает число одновременно обрабатываемых
+    апдейтов UPDATE_CONCURRENCY. Слот занимается только после своей
+    очереди пользователя: апдейты, ждущие предыдущих апдейтов того же
+    пользователя, не отнимают слоты у других.
+
+    Лок и слот держатся всё время хендлера, поэтому хендлеры не должны
+    ждать долгой работы: генерация отчёта запускается фоновой задачей
+    (services/report_tasks.py) и апдейт завершается сразу.
+
+    Регистрируется первым outer-middleware на dp.update, чтобы ожидание
+    не держало открытой сессию БД. Только в polling-режиме: в
+    webhook-режиме порядок и параллелизм обеспечивает UpdateDispatcher.
+    """
+
+    def __init__(self, concurrency: int = UPDATE_CONCURRENCY):
+        self.concurrency = concurrency
+        self._slots = asyncio.Semaphore(concurrency)
+        # key -> [lock, сколько апдейтов держат или ждут lock]
+        self._locks: Dict[Any, list] = {}
+        self._waiting = 0
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        received_at = time.monotonic()
+        key = update_key(event) if isinstance(event, Update) else None
+
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        waiting = True
+        self._add_waiting(1)
+        try:
+            async with entry[0]:
+                async with self._slots:
+                    waiting = False
+                    self._add_waiting(-1)
+                    UPDATE_QUEUE_WAIT_SECONDS.observe(time.monotonic() - received_at)
+                    with ACTIVE_UPDATES.track_inprogress():
+                        return await handler(event, data)
+        finally:
+            if waiting:
+                # Отменён, не дождавшись очереди
+                self._add_waiting(-1)
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[key]
+
+    def _add_waiting(self, delta: int):
+        self._waiting += delta
+        QUEUE_DEPTH.set(self._waiting, queue='updates_waiting')
@@ -4,12 +4,20 @@ from sqlalchemy.orm import selectinload
 
 from database.models import User
 from services.logging import logger
+from services.user_cache import user_cache
 
 
 async def orm_get_user(session: AsyncSession, tg_id: int):
+    """Пользователь с выбранным магазином (снимок CachedUser, см. services/user_cache.py)."""
+    cached = user_cache.get(tg_id)
+    if cached is not None:
+        return cached
+
+    epoch = user_cache.epoch
     query = select(User).options(selectinload(User.selected_store)).where(User.tg_id == tg_id)
     result = await session.execute(query)
-    return result.scalar_one_or_none()
+    user = result.scalar_one_or_none()
+    return user_cache.put(user, epoch) if user is not None else None
 
 async def orm_check_user_reg(session: AsyncSession, tg_id: int):
     user = await orm_get_user(session, tg_id)
@@ -28,4 +36,5 @@ async def orm_add_user(session: AsyncSession, user_data: dict):
         user_name=user_data.get('user_name'),
     )
     session.add(obj)
-    await session.commit()
\ No newline at end of file
+    await session.commit()
+    user_cache.invalidate(obj.tg_id)
\ No newline at end of file
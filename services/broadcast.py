@@ -0,0 +1,414 @@
+"""
+Рассылка сообщения админа всем пользователям.
+
+Рассылается копия сообщения (copyMessage), поэтому подходит любой тип:
+текст, фото с подписью, документ. Отправка идёт с приоритетом BULK через
+TelegramRateLimiter: рассылка занимает только свободную часть лимита
+Telegram (TG_GLOBAL_RATE сообщений/сек), ответы пользователям её обгоняют.
+
+    - tg_id пользователей читаются по возрастанию пачками по
+      BROADCAST_BATCH_SIZE: в PostgreSQL серверным курсором
+      (stream + yield_per), в SQLite — keyset-выборкой по tg_id;
+    - после каждой пачки в строку broadcast записывается чекпоинт
+      last_tg_id и счётчики: после перезапуска рассылка продолжается с
+      места остановки (сообщения последней незавершённой пачки могут
+      уйти повторно);
+    - 403 (бот заблокирован) помечает пользователя user.is_blocked, такие
+      пользователи в следующие рассылки не попадают до нового /start;
+    - сообщение админу с прогрессом, скоростью и ETA обновляется раз в
+      BROADCAST_PROGRESS_INTERVAL секунд.
+
+Ведущий экземпляр бота обновляет broadcast.heartbeat_at. Рассылку без
+свежего heartbeat (процесс упал или был перезапущен) подхватывает
+BroadcastManager.watch() любого экземпляра.
+
+Настройки (переменные окружения):
+    BROADCAST_BATCH_SIZE         — пользователей в пачке между чекпоинтами (200)
+    BROADCAST_CONCURRENCY        — одновременных отправок (10)
+    BROADCAST_PROGRESS_INTERVAL  — период обновления прогресса, сек (5)
+    BROADCAST_STALE_AFTER        — через сколько секунд без heartbeat рассылку можно подхватить (60)
+"""
+
+import asyncio
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Optional
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError
+from sqlalchemy import select, update, func, or_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession
+
+from database.models import Broadcast, User
+from services.logging import logger
+from services.metrics import counter
+from services.telegram_limiter import BULK, send_priority
+
+
+BROADCAST_BATCH_SIZE = int(os.getenv('BROADCAST_BATCH_SIZE') or '200')
+BROADCAST_CONCURRENCY = int(os.getenv('BROADCAST_CONCURRENCY') or '10')
+BROADCAST_PROGRESS_INTERVAL = float(os.getenv('BROADCAST_PROGRESS_INTERVAL') or '5')
+BROADCAST_STALE_AFTER = int(os.getenv('BROADCAST_STALE_AFTER') or '60')
+
+BROADCAST_MESSAGES = counter(
+    'paganini_broadcast_messages_total',
+    'Broadcast messages by result (sent, failed, blocked)',
+    ['result'],
+)
+
+
+def _utcnow() -> datetime:
+    # Колонки DateTime без часового пояса: храним UTC
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+# ------------------ Запросы ------------------
+
+async def orm_count_recipients(session: AsyncSession) -> int:
+    query = select(func.count()).select_from(User).where(User.is_blocked.is_(False))
+    return await session.scalar(query)
+
+
+async def orm_create_broadcast(session: AsyncSession, admin_id: int, from_chat_id: int,
+                               message_id: int) -> Optional[Broadcast]:
+    """
+    Создать рассылку. None — уже идёт другая: одну running-рассылку
+    гарантирует уникальный индекс idx_broadcast_running, а не проверка перед вставкой.
+    """
+    broadcast = Broadcast(
+        admin_id=admin_id,
+        from_chat_id=from_chat_id,
+        message_id=message_id,
+        status='running',
+        total=await orm_count_recipients(session),
+    )
+    session.add(broadcast)
+    try:
+        await session.commit()
+    except IntegrityError:
+        await session.rollback()
+        return None
+    return broadcast
+
+
+async def orm_set_progress_message(session: AsyncSession, broadcast_id: int, chat_id: int, message_id: int):
+    query = (
+        update(Broadcast)
+        .where(Broadcast.id == broadcast_id)
+        .values(progress_chat_id=chat_id, progress_message_id=message_id)
+    )
+    await session.execute(query)
+    await session.commit()
+
+
+async def orm_get_active_broadcast(session: AsyncSession) -> Optional[Broadcast]:
+    query = select(Broadcast).where(Broadcast.status == 'running').order_by(Broadcast.id).limit(1)
+    result = await session.execute(query)
+    return result.scalar_one_or_none()
+
+
+async def orm_get_last_broadcast(session: AsyncSession) -> Optional[Broadcast]:
+    query = select(Broadcast).order_by(Broadcast.id.desc()).limit(1)
+    result = await session.execute(query)
+    return result.scalar_one_or_none()
+
+
+async def orm_cancel_broadcast(session: AsyncSession) -> Optional[int]:
+    """Отменить идущую рассылку. Ведущий экземпляр остановится на следующем чекпоинте."""
+    query = (
+        update(Broadcast)
+        .where(Broadcast.status == 'running')
+        .values(status='cancelled')
+        .returning(Broadcast.id)
+    )
+    result = await session.execute(query)
+    await session.commit()
+    return result.scalars().first()
+
+
+async def orm_unblock_user(session: AsyncSession, tg_id: int):
+    """Пользователь снова написал боту — он опять получает рассылки."""
+    query = update(User).where(User.tg_id == tg_id, User.is_blocked.is_(True)).values(is_blocked=False)
+    result = await session.execute(query)
+    if result.rowcount:
+        await session.commit()
+
+
+# ------------------ Выполнение ------------------
+
+def format_progress(broadcast, rate: Optional[float] = None) -> str:
+    """Текст прогресса рассылки для админа."""
+    titles = {'running': '📨 Рассылка идёт', 'done': '✅ Рассылка завершена', 'cancelled': '⛔ Рассылка отменена'}
+    processed = broadcast.sent + broadcast.failed + broadcast.blocked
+    total = max(broadcast.total, processed)
+    percent = processed * 100 // total if total else 100
+
+    text = f'{titles.get(broadcast.status, broadcast.status)} #{broadcast.id}\n\n'
+    text += f'Обработано: {processed} из {total} ({percent}%)\n'
+    text += f'Доставлено: {broadcast.sent}\n'
+    text += f'Заблокировали бота: {broadcast.blocked}\n'
+    text += f'Ошибок: {broadcast.failed}\n'
+    if broadcast.status == 'running' and rate:
+        eta = (total - processed) / rate
+        text += f'\nСкорость: {rate:.1f} сообщ./сек\n'
+        text += f'Осталось: ~{int(eta // 60)} мин {int(eta % 60)} сек'
+    return text
+
+
+class _Run:
+    """Одна рассылка на этом экземпляре бота."""
+
+    def __init__(self, bot: Bot, engine: AsyncEngine, broadcast: Broadcast,
+                 batch_size: int = BROADCAST_BATCH_SIZE, concurrency: int = BROADCAST_CONCURRENCY):
+        self.bot = bot
+        self.engine = engine
+        self.broadcast = broadcast
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.started = time.monotonic()
+        self.processed_here = 0
+        self.cancelled = False
+
+    @property
+    def rate(self) -> Optional[float]:
+        elapsed = time.monotonic() - self.started
+        return self.processed_here / elapsed if self.processed_here and elapsed > 0 else None
+
+    async def run(self):
+        b = self.broadcast
+        logger.info(f"Рассылка #{b.id}: старт с tg_id > {b.last_tg_id}, получателей ~{b.total}")
+        progress = asyncio.create_task(self._progress_loop())
+        try:
+            await self._stream()
+            if not self.cancelled:
+                await self._finish('done')
+            logger.info(f"Рассылка #{b.id}: {'отменена' if self.cancelled else 'завершена'}, "
+                        f"доставлено {b.sent}, заблокировали {b.blocked}, ошибок {b.failed}")
+        finally:
+            progress.cancel()
+        await self._edit_progress()
+
+    async def _stream(self):
+        table = User.__table__
+        query = (
+            select(table.c.tg_id)
+            .where(table.c.tg_id > self.broadcast.last_tg_id, table.c.is_blocked.is_(False))
+            .order_by(table.c.tg_id)
+        )
+
+        if self.engine.dialect.name == 'postgresql':
+            async with self.engine.connect() as conn:
+                result = await conn.stream(query.execution_options(yield_per=self.batch_size))
+                async for rows in result.partitions(self.batch_size):
+                    if not await self._send_batch([row.tg_id for row in rows]):
+                        return
+        else:
+            # SQLite не даст писать чекпоинты, пока открыт читающий курсор
+            last_tg_id = self.broadcast.last_tg_id
+            while True:
+                async with self.engine.connect() as conn:
+                    rows = (await conn.execute(query.where(table.c.tg_id > last_tg_id).limit(self.batch_size))).all()
+                if not rows:
+                    return
+                last_tg_id = rows[-1].tg_id
+                if not await self._send_batch([row.tg_id for row in rows]):
+                    return
+
+    async def _send_batch(self, tg_ids: list[int]) -> bool:
+        """Отправить пачку и записать чекпоинт. False — рассылку отменили."""
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def send(tg_id: int) -> str:
+            async with semaphore:
+                return await self._send_one(tg_id)
+
+        results = await asyncio.gather(*(send(tg_id) for tg_id in tg_ids))
+        blocked = [tg_id for tg_id, result in zip(tg_ids, results) if result == 'blocked']
+        counts = {name: results.count(name) for name in ('sent', 'failed', 'blocked')}
+
+        b = Broadcast.__table__
+        users = User.__table__
+        async with self.engine.begin() as conn:
+            if blocked:
+                await conn.execute(update(users).where(users.c.tg_id.in_(blocked)).values(is_blocked=True))
+            row = (await conn.execute(
+                update(b)
+                .where(b.c.id == self.broadcast.id, b.c.status == 'running')
+                .values(
+                    last_tg_id=tg_ids[-1],
+                    sent=b.c.sent + counts['sent'],
+                    failed=b.c.failed + counts['failed'],
+                    blocked=b.c.blocked + counts['blocked'],
+                    heartbeat_at=_utcnow(),
+                )
+                .returning(b.c.sent, b.c.failed, b.c.blocked)
+            )).first()
+
+        self.processed_here += len(tg_ids)
+        if row is None:
+            # Отменили через /broadcast_cancel (возможно, на другом экземпляре)
+            self.cancelled = True
+            self.broadcast.status = 'cancelled'
+            return False
+        self.broadcast.last_tg_id = tg_ids[-1]
+        self.broadcast.sent, self.broadcast.failed, self.broadcast.blocked = row
+        return True
+
+    async def _send_one(self, tg_id: int) -> str:
+        b = self.broadcast
+        try:
+            with send_priority(BULK):
+                await self.bot.copy_message(chat_id=tg_id, from_chat_id=b.from_chat_id, message_id=b.message_id)
+            result = 'sent'
+        except TelegramForbiddenError:
+            result = 'blocked'
+        except TelegramBadRequest as e:
+            logger.warning(f"Рассылка #{b.id}: не отправлено {tg_id}: {e.message}")
+            result = 'failed'
+        except Exception as e:
+            logger.error(f"Рассылка #{b.id}: ошибка отправки {tg_id}: {e}")
+            result = 'failed'
+        BROADCAST_MESSAGES.inc(result=result)
+        return result
+
+    async def _finish(self, status: str):
+        query = (
+            update(Broadcast)
+            .where(Broadcast.id == self.broadcast.id, Broadcast.status == 'running')
+            .values(status=status, heartbeat_at=None)
+        )
+        async with self.engine.begin() as conn:
+            result = await conn.execute(query)
+        self.broadcast.status = status if result.rowcount else 'cancelled'
+
+    async def release(self):
+        """Отдать рассылку: её подхватит watch() после перезапуска или другой экземпляр."""
+        query = (
+            update(Broadcast)
+            .where(Broadcast.id == self.broadcast.id, Broadcast.status == 'running')
+            .values(heartbeat_at=None)
+        )
+        async with self.engine.begin() as conn:
+            await conn.execute(query)
+
+    async def _progress_loop(self):
+        while True:
+            await asyncio.sleep(BROADCAST_PROGRESS_INTERVAL)
+            try:
+                # Heartbeat и между чекпоинтами: пачка может идти дольше из-за 429
+                async with self.engine.begin() as conn:
+                    await conn.execute(
+                        update(Broadcast)
+                        .where(Broadcast.id == self.broadcast.id, Broadcast.status == 'running')
+                        .values(heartbeat_at=_utcnow())
+                    )
+            except Exception as e:
+                logger.warning(f"Рассылка #{self.broadcast.id}: не удалось обновить heartbeat: {e}")
+            await self._edit_progress()
+
+    async def _edit_progress(self):
+        b = self.broadcast
+        if not b.progress_chat_id or not b.progress_message_id:
+            return
+        try:
+            await self.bot.edit_message_text(
+                text=format_progress(b, self.rate),
+                chat_id=b.progress_chat_id,
+                message_id=b.progress_message_id,
+            )
+        except TelegramBadRequest:
+            # message is not modified / сообщение удалено
+            pass
+        except Exception as e:
+            logger.warning(f"Рассылка #{b.id}: не удалось обновить прогресс: {e}")
+
+
+class BroadcastManager:
+    """Рассылки этого экземпляра бота: запуск, подхват после перезапуска, остановка."""
+
+    def __init__(self):
+        self.bot: Optional[Bot] = None
+        self.engine: Optional[AsyncEngine] = None
+        self._runs: Dict[int, tuple[_Run, asyncio.Task]] = {}
+
+    def setup(self, bot: Bot, engine: AsyncEngine):
+        self.bot = bot
+        self.engine = engine
+
+    def get_rate(self, broadcast_id: int) -> Optional[float]:
+        entry = self._runs.get(broadcast_id)
+        return entry[0].rate if entry is not None else None
+
+    async def start(self, broadcast_id: int) -> bool:
+        """Взять рассылку, если её никто не ведёт, и запустить. False — уже ведётся."""
+        if broadcast_id in self._runs:
+            return False
+        b = Broadcast.__table__
+        stale = _utcnow() - timedelta(seconds=BROADCAST_STALE_AFTER)
+        async with self.engine.begin() as conn:
+            # Условный UPDATE: из нескольких экземпляров рассылку получит один
+            claimed = (await conn.execute(
+                update(b)
+                .where(b.c.id == broadcast_id, b.c.status == 'running',
+                       or_(b.c.heartbeat_at.is_(None), b.c.heartbeat_at < stale))
+                .values(heartbeat_at=_utcnow())
+                .returning(*b.c)
+            )).first()
+        if claimed is None:
+            return False
+
+        run = _Run(self.bot, self.engine, Broadcast(**claimed._asdict()))
+        task = asyncio.create_task(self._run(run), name=f'broadcast-{broadcast_id}')
+        self._runs[broadcast_id] = (run, task)
+        return True
+
+    async def _run(self, run: _Run):
+        try:
+            await run.run()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Рассылка #{run.broadcast.id} прервана: {e}", exc_info=True)
+            await run.release()
+        finally:
+            self._runs.pop(run.broadcast.id, None)
+
+    async def resume(self):
+        """Подхватить рассылки без свежего heartbeat."""
+        b = Broadcast.__table__
+        stale = _utcnow() - timedelta(seconds=BROADCAST_STALE_AFTER)
+        query = select(b.c.id).where(
+            b.c.status == 'running', or_(b.c.heartbeat_at.is_(None), b.c.heartbeat_at < stale)
+        )
+        async with self.engine.connect() as conn:
+            ids = (await conn.execute(query)).scalars().all()
+        for broadcast_id in ids:
+            if await self.start(broadcast_id):
+                logger.info(f"Рассылка #{broadcast_id} продолжена после перезапуска")
+
+    async def watch(self, interval: float = BROADCAST_STALE_AFTER):
+        """Фоновая задача: периодически подхватывать брошенные рассылки."""
+        while True:
+            try:
+                await self.resume()
+            except Exception as e:
+                logger.error(f"Рассылки: ошибка проверки брошенных рассылок: {e}")
+            await asyncio.sleep(interval)
+
+    async def stop(self):
+        """Остановить рассылки при завершении бота, сохранив чекпоинт."""
+        runs = list(self._runs.values())
+        for _, task in runs:
+            task.cancel()
+        await asyncio.gather(*(task for _, task in runs), return_exceptions=True)
+        for run, _ in runs:
+            try:
+                await run.release()
+                logger.info(f"Рассылка #{run.broadcast.id} приостановлена на tg_id {run.broadcast.last_tg_id}")
+            except Exception as e:
+                logger.error(f"Рассылка #{run.broadcast.id}: не удалось освободить: {e}")
+
+
+broadcasts = BroadcastManager()
@@ -0,0 +1,197 @@
+"""
+Circuit breaker для запросов к API Wildberries.
+
+На каждый хост WB заводится отдельный breaker. Если хост подряд отвечает
+ошибками (таймауты, сетевые ошибки, 5xx) или слишком медленно, breaker
+размыкается: новые генерации сразу получают понятную ошибку, вместо того
+чтобы минутами висеть в ретраях. После паузы breaker пропускает один
+пробный запрос (half-open) — успешный ответ замыкает его обратно.
+
+Настройки (переменные окружения):
+    WB_BREAKER_FAILURES      — сколько ошибок подряд размыкают breaker (5)
+    WB_BREAKER_SLOW_SECONDS  — ответ дольше этого считается ошибкой (60)
+    WB_BREAKER_OPEN_SECONDS  — сколько секунд breaker остаётся разомкнутым (120)
+"""
+
+import os
+import threading
+import time
+from typing import Dict, Optional
+
+import httpx
+
+from services.logging import logger
+from services.metrics import gauge
+
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+FAILURE_THRESHOLD = int(os.getenv('WB_BREAKER_FAILURES') or '5')
+SLOW_CALL_SECONDS = float(os.getenv('WB_BREAKER_SLOW_SECONDS') or '60')
+OPEN_SECONDS = float(os.getenv('WB_BREAKER_OPEN_SECONDS') or '120')
+
+
+class CircuitOpenError(Exception):
+    """Breaker разомкнут — запрос к хосту не выполняется"""
+
+    def __init__(self, host: str, retry_in: float):
+        self.host = host
+        self.retry_in = retry_in
+        super().__init__(f'{host} is unavailable, retry in {retry_in:.0f}s')
+
+
+class CircuitBreaker:
+    """
+    Breaker для одного хоста.
+
+    Потокобезопасен: отчёт по рекламе ходит в WB из отдельного потока
+    (asyncio.to_thread), остальные запросы — из event loop.
+    """
+
+    def __init__(
+        self,
+        host: str,
+        failure_threshold: int = FAILURE_THRESHOLD,
+        slow_call_seconds: float = SLOW_CALL_SECONDS,
+        open_seconds: float = OPEN_SECONDS,
+    ):
+        self.host = host
+        self.failure_threshold = failure_threshold
+        self.slow_call_seconds = slow_call_seconds
+        self.open_seconds = open_seconds
+
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._last_error: Optional[str] = None
+        self._trips = 0
+
+    def _current_state(self) -> str:
+        """Состояние с учётом истёкшей паузы (вызывать под lock)."""
+        if self._state == OPEN and time.monotonic() - self._opened_at >= self.open_seconds:
+            self._state = HALF_OPEN
+            self._probe_in_flight = False
+            logger.info("Circuit breaker %s: half-open, пропускаю пробный запрос", self.host)
+        return self._state
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._current_state()
+
+    def retry_in(self) -> float:
+        """Сколько секунд осталось до пробного запроса."""
+        with self._lock:
+            if self._current_state() != OPEN:
+                return 0.0
+            return max(0.0, self.open_seconds - (time.monotonic() - self._opened_at))
+
+    def is_open(self) -> bool:
+        return self.state == OPEN
+
+    def before_request(self):
+        """
+        Проверка перед запросом.
+
+        Raises:
+            CircuitOpenError: breaker разомкнут или пробный запрос уже выполняется
+        """
+        with self._lock:
+            state = self._current_state()
+            if state == CLOSED:
+                return
+            if state == HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return
+            retry_in = max(0.0, self.open_seconds - (time.monotonic() - self._opened_at))
+        raise CircuitOpenError(self.host, retry_in)
+
+    def record_success(self, elapsed: float):
+        """Успешный ответ. Слишком медленный ответ считается ошибкой."""
+        if elapsed > self.slow_call_seconds:
+            self.record_failure(f'slow response {elapsed:.1f}s')
+            return
+
+        with self._lock:
+            if self._state != CLOSED:
+                logger.info("Circuit breaker %s: замкнут, API снова отвечает", self.host)
+            self._state = CLOSED
+            self._failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self, reason: str):
+        """Ошибка запроса: таймаут, сетевая ошибка, 5xx или медленный ответ."""
+        with self._lock:
+            self._failures += 1
+            self._last_error = reason
+            probe_failed = self._state == HALF_OPEN
+            if probe_failed or (self._state == CLOSED and self._failures >= self.failure_threshold):
+                self._state = OPEN
+                self._opened_at = time.monotonic()
+                self._probe_in_flight = False
+                self._trips += 1
+                logger.warning(
+                    "Circuit breaker %s: разомкнут на %.0f сек (ошибок подряд: %d, последняя: %s)",
+                    self.host, self.open_seconds, self._failures, reason
+                )
+
+    def release_probe(self):
+        """Запрос прерван без результата (например, отмена задачи)."""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def snapshot(self) -> dict:
+        """Текущее состояние для админки и метрик."""
+        with self._lock:
+            state = self._current_state()
+            retry_in = 0.0
+            if state == OPEN:
+                retry_in = max(0.0, self.open_seconds - (time.monotonic() - self._opened_at))
+            return {
+                'host': self.host,
+                'state': state,
+                'failures': self._failures,
+                'trips': self._trips,
+                'retry_in': retry_in,
+                'last_error': self._last_error,
+            }
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(url: str) -> CircuitBreaker:
+    """Breaker для хоста из URL (создаётся при первом обращении)."""
+    host = httpx.URL(url).host
+    with _breakers_lock:
+        breaker = _breakers.get(host)
+        if breaker is None:
+            breaker = _breakers[host] = CircuitBreaker(host)
+        return breaker
+
+
+def get_breakers_snapshot() -> list[dict]:
+    """Состояние всех breaker-ов, отсортированное по хосту."""
+    with _breakers_lock:
+        breakers = list(_breakers.values())
+    return sorted((b.snapshot() for b in breakers), key=lambda s: s['host'])
+
+
+_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+def _collect_breaker_states() -> dict:
+    return {(s['host'],): _STATE_VALUES[s['state']] for s in get_breakers_snapshot()}
+
+
+WB_CIRCUIT_STATE = gauge(
+    'paganini_wb_circuit_state',
+    'Wildberries API circuit breaker state by host (0 closed, 1 half-open, 2 open)',
+    ['host'],
+    collect=_collect_breaker_states,
+)
@@ -1,58 +1,226 @@
 """
 Token encryption/decryption using AES-256-GCM.
 Provides secure storage for sensitive data like WB API tokens.
+
+Stored format: enc:k<key_id>:<base64(nonce + ciphertext + tag)>.
+Legacy values without key id (enc:<base64>) are still decrypted.
+
+Keys are decoded and AESGCM objects are built once (KeyRing). Decrypted
+tokens are kept in a small in-memory cache keyed by ciphertext, so repeated
+"generate" taps don't decrypt the same token again.
+
+Key rotation without downtime:
+    1. Move the current key to ENCRYPTION_PREVIOUS_KEYS as "<old_id>:<old_key>"
+    2. Set the new ENCRYPTION_KEY and a new ENCRYPTION_KEY_ID
+    3. Restart: old tokens stay readable, a background job re-encrypts them
+       (database.migrations.reencrypt_tokens)
+    4. Once the job reports no tokens left, drop ENCRYPTION_PREVIOUS_KEYS
 """
 import os
 import base64
+import re
 import secrets
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
 from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 from services.logging import logger
 
 
-# Get encryption key from environment (must be 32 bytes for AES-256)
-_ENCRYPTION_KEY = os.getenv('ENCRYPTION_KEY', '')
+# Id of the current key, written into every encrypted value
+ENCRYPTION_KEY_ID = os.getenv('ENCRYPTION_KEY_ID') or '1'
 
+# Decrypted tokens cache: max entries and lifetime in seconds (0 disables the cache)
+TOKEN_CACHE_SIZE = int(os.getenv('TOKEN_CACHE_SIZE') or '1024')
+TOKEN_CACHE_TTL = float(os.getenv('TOKEN_CACHE_TTL') or '600')
+
+_KEY_ID_RE = re.compile(r'^enc:k([A-Za-z0-9_-]+):')
 
-def _get_key() -> bytes:
-    """Get the encryption key, validating it's properly configured."""
-    if not _ENCRYPTION_KEY:
-        logger.warning("ENCRYPTION_KEY not set! Tokens will be stored in plaintext.")
-        return b''
 
+def _decode_key(value: str, name: str) -> bytes:
     try:
-        key = base64.b64decode(_ENCRYPTION_KEY)
+        key = base64.b64decode(value)
         if len(key) != 32:
-            logger.error(f"ENCRYPTION_KEY must be 32 bytes (256 bits), got {len(key)} bytes")
+            logger.error(f"{name} must be 32 bytes (256 bits), got {len(key)} bytes")
             return b''
         return key
     except Exception as e:
-        logger.error(f"Invalid ENCRYPTION_KEY format: {e}")
+        logger.error(f"Invalid {name} format: {e}")
         return b''
 
 
+class KeyRing:
+    """
+    Current key plus old keys accepted for decryption, by key id.
+
+    Raw encrypt/decrypt without caching: used for tokens (through
+    encrypt_token/decrypt_token) and for any other data stored encrypted.
+    """
+
+    def __init__(self, current_id: str, current_key: bytes, previous: Optional[Dict[str, bytes]] = None):
+        self.current_id = current_id
+        self.prefix = f'enc:k{current_id}:'
+        self._current = AESGCM(current_key) if current_key else None
+        self._previous = {key_id: AESGCM(key) for key_id, key in (previous or {}).items()}
+
+    @classmethod
+    def from_env(cls) -> 'KeyRing':
+        """ENCRYPTION_KEY, ENCRYPTION_KEY_ID and ENCRYPTION_PREVIOUS_KEYS ("id:key,id:key")."""
+        env_key = os.getenv('ENCRYPTION_KEY', '')
+        if not env_key:
+            logger.warning("ENCRYPTION_KEY not set! Tokens will be stored in plaintext.")
+        current_key = _decode_key(env_key, 'ENCRYPTION_KEY') if env_key else b''
+
+        previous = {}
+        for item in os.getenv('ENCRYPTION_PREVIOUS_KEYS', '').split(','):
+            if not item.strip():
+                continue
+            key_id, _, value = item.strip().partition(':')
+            key = _decode_key(value, f'ENCRYPTION_PREVIOUS_KEYS[{key_id}]')
+            if key:
+                previous[key_id] = key
+
+        return cls(ENCRYPTION_KEY_ID, current_key, previous)
+
+    @property
+    def configured(self) -> bool:
+        return self._current is not None
+
+    @property
+    def has_previous(self) -> bool:
+        return bool(self._previous)
+
+    def encrypt(self, plaintext: str) -> str:
+        if self._current is None:
+            raise ValueError("ENCRYPTION_KEY not configured - cannot store tokens securely")
+
+        try:
+            nonce = secrets.token_bytes(12)  # 96-bit nonce for GCM
+            ciphertext = self._current.encrypt(nonce, plaintext.encode('utf-8'), None)
+            # Combine nonce + ciphertext and encode as base64
+            return self.prefix + base64.b64encode(nonce + ciphertext).decode('utf-8')
+        except Exception as e:
+            logger.error(f"Encryption failed: {e}")
+            raise ValueError(f"Token encryption failed: {e}")
+
+    def decrypt(self, encrypted: str) -> str:
+        """Returns '' if the value can't be decrypted with any configured key."""
+        key_id = get_key_id(encrypted)
+        if key_id is None:
+            # Legacy enc:<payload>: try the current key, then old ones
+            payload = encrypted[4:]
+            candidates = [c for c in (self._current, *self._previous.values()) if c is not None]
+        else:
+            payload = encrypted[len(key_id) + 6:]
+            candidate = self._current if key_id == self.current_id else self._previous.get(key_id)
+            candidates = [candidate] if candidate is not None else []
+
+        if not candidates:
+            logger.error(f"Cannot decrypt: key {key_id or 'ENCRYPTION_KEY'} not configured")
+            # Return empty to prevent using encrypted blob as token
+            return ''
+
+        try:
+            # Decode base64 payload: nonce + ciphertext + tag
+            data = base64.b64decode(payload)
+        except Exception as e:
+            logger.error(f"Decryption failed: {e}")
+            return ''
+
+        for aesgcm in candidates:
+            try:
+                return aesgcm.decrypt(data[:12], data[12:], None).decode('utf-8')
+            except Exception:
+                continue
+
+        logger.error("Decryption failed: no configured key matches")
+        return ''
+
+
+class _TTLCache:
+    """Bounded LRU cache with per-entry expiry."""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            value, expires = item
+            if expires < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: str):
+        if self.maxsize <= 0 or self.ttl <= 0:
+            return
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+_key_ring: Optional[KeyRing] = None
+_key_ring_lock = threading.Lock()
+_token_cache = _TTLCache(TOKEN_CACHE_SIZE, TOKEN_CACHE_TTL)
+
+
+def get_key_ring() -> KeyRing:
+    """Key ring from environment, built on first use."""
+    global _key_ring
+    if _key_ring is None:
+        with _key_ring_lock:
+            if _key_ring is None:
+                _key_ring = KeyRing.from_env()
+    return _key_ring
+
+
+def has_previous_keys() -> bool:
+    """Key rotation in progress: old keys are configured."""
+    return get_key_ring().has_previous
+
+
+def get_key_id(token: str) -> Optional[str]:
+    """Key id of an encrypted value (None for legacy enc: values and plaintext)."""
+    match = _KEY_ID_RE.match(token)
+    return match.group(1) if match else None
+
+
+def needs_reencryption(token: str) -> bool:
+    """Plaintext, legacy format or encrypted with a non-current key."""
+    return get_key_id(token) != ENCRYPTION_KEY_ID
+
+
+def current_key_prefix() -> str:
+    """Prefix of values encrypted with the current key."""
+    return f'enc:k{ENCRYPTION_KEY_ID}:'
+
+
 def encrypt_token(plaintext: str) -> str:
     """
     Encrypt a token using AES-256-GCM.
 
-    Returns: base64 encoded string: nonce (12 bytes) + ciphertext + tag (16 bytes)
-    If encryption key is not configured, returns plaintext unchanged.
+    Returns: enc:k<key_id>:base64(nonce (12 bytes) + ciphertext + tag (16 bytes))
+    Raises ValueError if encryption key is not configured.
     """
-    key = _get_key()
-    if not key:
-        raise ValueError("ENCRYPTION_KEY not configured - cannot store tokens securely")
-
-    try:
-        aesgcm = AESGCM(key)
-        nonce = secrets.token_bytes(12)  # 96-bit nonce for GCM
-        ciphertext = aesgcm.encrypt(nonce, plaintext.encode('utf-8'), None)
-        # Combine nonce + ciphertext and encode as base64
-        encrypted = base64.b64encode(nonce + ciphertext).decode('utf-8')
-        return f"enc:{encrypted}"  # Prefix to identify encrypted values
-    except ValueError:
-        raise
-    except Exception as e:
-        logger.error(f"Encryption failed: {e}")
-        raise ValueError(f"Token encryption failed: {e}")
+    return get_key_ring().encrypt(plaintext)
 
 
 def decrypt_token(encrypted: str) -> str:
@@ -60,30 +228,21 @@ def decrypt_token(encrypted: str) -> str:
     Decrypt a token encrypted with encrypt_token().
 
     If the value doesn't have 'enc:' prefix, returns it unchanged (legacy plaintext).
+    Legacy values without key id are tried with the current key, then old keys.
     """
     # Check if it's an encrypted value
     if not encrypted.startswith('enc:'):
         # Legacy plaintext token - return as-is
         return encrypted
 
-    key = _get_key()
-    if not key:
-        logger.error("Cannot decrypt: ENCRYPTION_KEY not configured")
-        # Return empty to prevent using encrypted blob as token
-        return ''
+    cached = _token_cache.get(encrypted)
+    if cached is not None:
+        return cached
 
-    try:
-        # Remove 'enc:' prefix and decode base64
-        data = base64.b64decode(encrypted[4:])
-        nonce = data[:12]
-        ciphertext = data[12:]
-
-        aesgcm = AESGCM(key)
-        plaintext = aesgcm.decrypt(nonce, ciphertext, None)
-        return plaintext.decode('utf-8')
-    except Exception as e:
-        logger.error(f"Decryption failed: {e}")
-        return ''
+    plaintext = get_key_ring().decrypt(encrypted)
+    if plaintext:
+        _token_cache.set(encrypted, plaintext)
+    return plaintext
 
 
 def generate_encryption_key() -> str:
@@ -0,0 +1,159 @@
+"""
+FSM storage aiogram в общей БД (таблица fsm_state).
+
+С MemoryStorage состояние диалогов (добавление магазина, выбор периода
+отчёта) живёт в памяти одного процесса: теряется при перезапуске и не
+видно другим экземплярам бота. SQLStorage хранит его в той же БД через
+engine бота, поэтому N экземпляров (polling или webhook) могут
+обслуживать одного пользователя по очереди.
+
+Одна строка на ключ (бот, чат, пользователь): state и data. data —
+JSON, зашифрованный KeyRing (в нём, например, расшифрованный токен WB
+между шагами генерации отчёта). Запись — upsert под конкретный диалект
+(INSERT ... ON CONFLICT DO UPDATE в PostgreSQL и SQLite).
+
+У каждой строки есть expires_at: каждая запись продлевает его на
+FSM_STATE_TTL, просроченная строка читается как пустая (и запись в неё
+начинает диалог с чистого листа), а фоновая задача cleanup_loop()
+периодически удаляет такие строки.
+
+Настройки (переменные окружения):
+    FSM_STORAGE              — sql | memory (sql)
+    FSM_STATE_TTL            — сколько секунд хранить неактивный диалог (172800)
+    FSM_CLEANUP_INTERVAL     — период очистки просроченных строк, сек (3600)
+"""
+
+import asyncio
+import json
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Mapping, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, KeyBuilder, StateType, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+from sqlalchemy import case, delete, select, and_
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from database.models import FSMState
+from services.crypto import get_key_ring, is_token_encrypted
+from services.logging import logger
+
+
+FSM_STORAGE = os.getenv('FSM_STORAGE') or 'sql'
+FSM_STATE_TTL = int(os.getenv('FSM_STATE_TTL') or str(2 * 24 * 3600))
+FSM_CLEANUP_INTERVAL = int(os.getenv('FSM_CLEANUP_INTERVAL') or '3600')
+
+
+def _utcnow() -> datetime:
+    # Колонки DateTime без часового пояса: храним UTC
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+class SQLStorage(BaseStorage):
+    """FSM storage на AsyncEngine бота."""
+
+    def __init__(self, engine: AsyncEngine, ttl: int = FSM_STATE_TTL, key_builder: Optional[KeyBuilder] = None):
+        self.engine = engine
+        self.ttl = timedelta(seconds=ttl)
+        # bot_id в ключе: несколько ботов могут делить одну БД
+        self.key_builder = key_builder or DefaultKeyBuilder(with_bot_id=True)
+        self._insert = postgresql.insert if engine.dialect.name == 'postgresql' else sqlite.insert
+        self._plaintext_warned = False
+
+    async def _upsert(self, key: StorageKey, **values):
+        now = _utcnow()
+        table = FSMState.__table__
+        row = {'key': self.key_builder.build(key), 'expires_at': now + self.ttl, **values}
+        query = self._insert(FSMState).values(**row)
+        set_ = {name: query.excluded[name] for name in (*values, 'expires_at', 'updated')}
+        # Остальные колонки просроченной строки сбрасываем: иначе продление
+        # вернуло бы данные старого диалога (с расшифрованным токеном)
+        for name in ('state', 'data'):
+            if name not in values:
+                set_[name] = case((table.c.expires_at <= now, None), else_=table.c[name])
+        query = query.on_conflict_do_update(index_elements=[FSMState.key], set_=set_)
+        async with self.engine.begin() as conn:
+            await conn.execute(query)
+            # Пустой диалог (state.clear()) не храним
+            await conn.execute(
+                delete(table).where(table.c.key == row['key'], table.c.state.is_(None), table.c.data.is_(None))
+            )
+
+    async def _get_row(self, key: StorageKey):
+        table = FSMState.__table__
+        query = select(table.c.state, table.c.data).where(
+            and_(table.c.key == self.key_builder.build(key), table.c.expires_at > _utcnow())
+        )
+        async with self.engine.connect() as conn:
+            return (await conn.execute(query)).first()
+
+    def _encode(self, data: Mapping[str, Any]) -> Optional[str]:
+        if not data:
+            return None
+        payload = json.dumps(data, ensure_ascii=False)
+        key_ring = get_key_ring()
+        if key_ring.configured:
+            return key_ring.encrypt(payload)
+        if not self._plaintext_warned:
+            logger.warning("ENCRYPTION_KEY не установлен: данные FSM хранятся в БД без шифрования")
+            self._plaintext_warned = True
+        return payload
+
+    @staticmethod
+    def _decode(value: Optional[str]) -> Dict[str, Any]:
+        if not value:
+            return {}
+        if is_token_encrypted(value):
+            value = get_key_ring().decrypt(value)
+            if not value:
+                # Ключ сменили без ENCRYPTION_PREVIOUS_KEYS — диалог начнётся заново
+                return {}
+        return json.loads(value)
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        await self._upsert(key, state=state.state if isinstance(state, State) else state)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        row = await self._get_row(key)
+        return row.state if row is not None else None
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        await self._upsert(key, data=self._encode(data))
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        row = await self._get_row(key)
+        return self._decode(row.data) if row is not None else {}
+
+    async def close(self) -> None:
+        # engine общий с ботом, его закрывает main
+        pass
+
+
+async def delete_expired_states(engine: AsyncEngine) -> int:
+    table = FSMState.__table__
+    async with engine.begin() as conn:
+        result = await conn.execute(delete(table).where(table.c.expires_at <= _utcnow()))
+    return result.rowcount or 0
+
+
+async def cleanup_loop(engine: AsyncEngine, interval: int = FSM_CLEANUP_INTERVAL):
+    """Фоновая очистка просроченных диалогов."""
+    while True:
+        try:
+            deleted = await delete_expired_states(engine)
+            if deleted:
+                logger.info(f"FSM: удалено просроченных состояний: {deleted}")
+        except Exception as e:
+            logger.error(f"FSM: ошибка очистки просроченных состояний: {e}")
+        await asyncio.sleep(interval)
+
+
+def create_fsm_storage(engine: AsyncEngine) -> BaseStorage:
+    """Storage по FSM_STORAGE: sql (по умолчанию) или memory."""
+    if FSM_STORAGE == 'memory':
+        return MemoryStorage()
+    if FSM_STORAGE != 'sql':
+        logger.warning(f"Неизвестный FSM_STORAGE={FSM_STORAGE!r}, использую sql")
+    return SQLStorage(engine)
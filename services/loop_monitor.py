@@ -0,0 +1,177 @@
+"""
+Мониторинг задержки event loop.
+
+Бот — один asyncio-процесс: pandas, запись Excel и работа с Telegram
+делят один event loop, и любой синхронный участок «замораживает» бота
+для всех пользователей. Монитор состоит из двух частей:
+
+    heartbeat — корутина в event loop, каждые interval секунд замеряет,
+                насколько позже запланированного её разбудили (лаг);
+    watchdog  — отдельный поток. Если heartbeat не отмечался дольше
+                threshold секунд, значит loop занят, и watchdog пишет в лог
+                стек потока event loop (sys._current_frames) — видно, какой
+                код заблокировал бота.
+
+Лаг попадает в гистограмму paganini_event_loop_lag_seconds, p50/p99 за
+последние window замеров — в gauge-и для /metrics. Включается и
+выключается на лету из админки (/loop_monitor on|off).
+
+Настройки (переменные окружения):
+    LOOP_MONITOR_ENABLED    — включить при старте (1)
+    LOOP_MONITOR_INTERVAL   — период heartbeat, сек (0.25)
+    LOOP_MONITOR_THRESHOLD  — блокировка дольше этого логируется со стеком, сек (0.5)
+    LOOP_MONITOR_WINDOW     — сколько последних замеров для p50/p99 (1200)
+"""
+
+import asyncio
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from typing import Optional
+
+from services.logging import logger
+from services.metrics import EVENT_LOOP_LAG_SECONDS, EVENT_LOOP_STALLS, gauge
+
+
+ENABLED = (os.getenv('LOOP_MONITOR_ENABLED') or '1').lower() in ('1', 'true', 'yes', 'on')
+INTERVAL = float(os.getenv('LOOP_MONITOR_INTERVAL') or '0.25')
+THRESHOLD = float(os.getenv('LOOP_MONITOR_THRESHOLD') or '0.5')
+WINDOW = int(os.getenv('LOOP_MONITOR_WINDOW') or '1200')
+
+# Сколько последних кадров стека писать в лог
+STACK_LIMIT = 30
+
+
+class LoopMonitor:
+    """Heartbeat в event loop + watchdog-поток, ловящий блокировки."""
+
+    def __init__(self, interval: float = INTERVAL, threshold: float = THRESHOLD, window: int = WINDOW):
+        self.interval = interval
+        self.threshold = threshold
+
+        self._lags: deque = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._loop_thread_id: Optional[int] = None
+        self._last_beat = 0.0
+        self._stalls = 0
+        self._max_stall = 0.0
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        """Запуск монитора. Вызывать из event loop."""
+        if self.running:
+            return
+
+        self._loop_thread_id = threading.get_ident()
+        self._last_beat = time.monotonic()
+        self._stop = threading.Event()
+        self._task = asyncio.get_running_loop().create_task(self._heartbeat())
+        self._thread = threading.Thread(target=self._watchdog, args=(self._stop,),
+                                        name='loop-watchdog', daemon=True)
+        self._thread.start()
+        logger.info("Мониторинг event loop включён (interval=%.2fs, threshold=%.2fs)",
+                    self.interval, self.threshold)
+
+    def stop(self):
+        """Остановка монитора (накопленная статистика сохраняется)."""
+        if not self.running:
+            return
+
+        self._stop.set()
+        self._task.cancel()
+        self._task = None
+        self._thread = None
+        logger.info("Мониторинг event loop выключен")
+
+    def set_enabled(self, enabled: bool):
+        if enabled:
+            self.start()
+        else:
+            self.stop()
+
+    async def _heartbeat(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, loop.time() - expected)
+            self._last_beat = time.monotonic()
+
+            EVENT_LOOP_LAG_SECONDS.observe(lag)
+            with self._lock:
+                self._lags.append(lag)
+                # Полная длительность блокировки известна только после неё
+                self._max_stall = max(self._max_stall, lag)
+
+    def _watchdog(self, stop: threading.Event):
+        reported_beat = None
+        while not stop.wait(self.interval):
+            beat = self._last_beat
+            blocked = time.monotonic() - beat - self.interval
+            # Об одной блокировке пишем один раз
+            if blocked < self.threshold or beat == reported_beat:
+                continue
+            reported_beat = beat
+
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is None:
+                continue
+            stack = ''.join(traceback.format_stack(frame, limit=STACK_LIMIT))
+            del frame
+
+            with self._lock:
+                self._stalls += 1
+            EVENT_LOOP_STALLS.inc()
+            logger.warning(
+                "Event loop заблокирован уже %.2f сек. Стек потока event loop:\n%s", blocked, stack
+            )
+
+    def percentile(self, q: float) -> float:
+        """Перцентиль лага (q от 0 до 100) за последние window замеров."""
+        with self._lock:
+            values = sorted(self._lags)
+        if not values:
+            return 0.0
+        index = min(len(values) - 1, max(0, round(q / 100 * (len(values) - 1))))
+        return values[index]
+
+    def snapshot(self) -> dict:
+        """Текущее состояние для админки."""
+        with self._lock:
+            samples = len(self._lags)
+            stalls = self._stalls
+            max_stall = self._max_stall
+        return {
+            'enabled': self.running,
+            'interval': self.interval,
+            'threshold': self.threshold,
+            'samples': samples,
+            'p50': self.percentile(50),
+            'p99': self.percentile(99),
+            'stalls': stalls,
+            'max_stall': max_stall,
+        }
+
+
+loop_monitor = LoopMonitor()
+
+
+EVENT_LOOP_LAG_P50 = gauge(
+    'paganini_event_loop_lag_p50_seconds',
+    'Median event loop lag over the recent window',
+    collect=lambda: {(): loop_monitor.percentile(50)},
+)
+EVENT_LOOP_LAG_P99 = gauge(
+    'paganini_event_loop_lag_p99_seconds',
+    '99th percentile of event loop lag over the recent window',
+    collect=lambda: {(): loop_monitor.percentile(99)},
+)
@@ -1,8 +1,11 @@
+from typing import Optional
+
 from sqlalchemy import select, update, delete
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from database.models import Store, User
 from services.crypto import encrypt_token, decrypt_token
+from services.user_cache import CachedStore, user_cache
 
 
 async def orm_add_store(session: AsyncSession, store_data: dict):
@@ -20,12 +23,31 @@ async def orm_add_store(session: AsyncSession, store_data: dict):
     query = update(User).where(User.tg_id == store_data['tg_id']).values(selected_store_id = store_id)
     await session.execute(query)
     await session.commit()
+    user_cache.invalidate(store_data['tg_id'])
+
 
+async def orm_get_user_stores(session: AsyncSession, tg_id: int) -> tuple[CachedStore, ...]:
+    """Магазины пользователя (снимки CachedStore, кэшируются по tg_id, см. services/user_cache.py)."""
+    cached = user_cache.get_stores(tg_id)
+    if cached is not None:
+        return cached
 
-async def orm_get_user_stores(session: AsyncSession, tg_id: int):
-    query = select(Store).where(Store.tg_id == tg_id)
+    epoch = user_cache.epoch
+    query = select(Store).where(Store.tg_id == tg_id).order_by(Store.id)
     result = await session.execute(query)
-    return result.scalars().all()
+    return user_cache.put_stores(tg_id, result.scalars().all(), epoch)
+
+
+async def orm_get_owned_store(session: AsyncSession, store_id: int, tg_id: int) -> Optional[CachedStore]:
+    """
+    Магазин, только если он принадлежит пользователю: проверка владельца и
+    чтение магазина одним запросом.
+
+    Ищется в списке магазинов пользователя: на экранах управления магазинами
+    список обычно уже в кэше, и в БД запрос не идёт.
+    """
+    stores = await orm_get_user_stores(session, tg_id)
+    return next((store for store in stores if store.id == store_id), None)
 
 
 async def orm_get_store(session: AsyncSession, id: int):
@@ -34,35 +56,31 @@ async def orm_get_store(session: AsyncSession, id: int):
     return result.scalar_one_or_none()
 
 
-async def orm_check_store_owner(session: AsyncSession, store_id: int, tg_id: int) -> bool:
-    """Check if the store belongs to the user"""
-    query = select(Store).where(Store.id == store_id, Store.tg_id == tg_id)
-    result = await session.execute(query)
-    return result.scalar_one_or_none() is not None
-
-
 async def orm_edit_store(session: AsyncSession, store_data: dict):
     # Encrypt token before storing
     encrypted_token = encrypt_token(store_data['token'])
 
     query = update(Store).where(Store.id == store_data['store_id']).values(name = store_data['name'], token = encrypted_token)
-    await session.execute(query)
+    result = await session.execute(query.returning(Store.tg_id))
     await session.commit()
+    user_cache.invalidate(*result.scalars().all())
 
 
 async def orm_edit_store_name(session: AsyncSession, store_id: int, name: str):
     """Update only the store name"""
     query = update(Store).where(Store.id == store_id).values(name=name)
-    await session.execute(query)
+    result = await session.execute(query.returning(Store.tg_id))
     await session.commit()
+    user_cache.invalidate(*result.scalars().all())
 
 
 async def orm_edit_store_token(session: AsyncSession, store_id: int, token: str):
     """Update only the store token"""
     encrypted_token = encrypt_token(token)
     query = update(Store).where(Store.id == store_id).values(token=encrypted_token)
-    await session.execute(query)
+    result = await session.execute(query.returning(Store.tg_id))
     await session.commit()
+    user_cache.invalidate(*result.scalars().all())
 
 
 async def orm_delete_store(session: AsyncSession, store_id: int, tg_id: int):
@@ -88,6 +106,7 @@ async def orm_delete_store(session: AsyncSession, store_id: int, tg_id: int):
         await session.execute(update_user_query)
 
     await session.commit()
+    user_cache.invalidate(tg_id)
 
 
 def get_decrypted_token(store: Store) -> str:
@@ -99,3 +118,4 @@ async def orm_set_store(session: AsyncSession, tg_id: int, store_id: int):
     query = update(User).where(User.tg_id == tg_id).values(selected_store_id = store_id)
     await session.execute(query)
     await session.commit()
+    user_cache.invalidate(tg_id)
@@ -0,0 +1,209 @@
+"""
+Кэш проверок членства в чатах (getChatMember).
+
+Подписка на канал (регистрация) и членство в клубе (ежемесячный бонус)
+проверяются через bot.get_chat_member — медленный запрос в лимитах
+Telegram. Результат кэшируется по (чат, пользователь):
+
+    - «состоит» — на MEMBERSHIP_POSITIVE_TTL секунд, «не состоит» — на
+      MEMBERSHIP_NEGATIVE_TTL: только что вступивший пользователь не ждёт
+      долго, а кнопку «Проверить подписку» можно вызывать с
+      recheck_negative=True;
+    - одновременные проверки одного пользователя (несколько нажатий
+      подряд) ждут один запрос к Telegram;
+    - ошибки не кэшируются: вызывающий решает, как их трактовать.
+
+Фоновая задача club_refresh_loop() (CLUB_REFRESH_INTERVAL > 0) раз в
+интервал заново проверяет участников клуба — пользователей, получавших
+клубный бонус за последние два месяца, и тех, кто уже есть в кэше как
+участник, — поэтому нажатие «Получить бонусы» обычно отвечает из кэша.
+
+Настройки (переменные окружения):
+    MEMBERSHIP_CACHE_SIZE     — сколько проверок держать (10000, 0 — выключен)
+    MEMBERSHIP_POSITIVE_TTL   — сколько секунд верить «состоит» (300)
+    MEMBERSHIP_NEGATIVE_TTL   — сколько секунд верить «не состоит» (15)
+    CLUB_REFRESH_INTERVAL     — период обновления статуса участников клуба, сек (0 — выключено)
+    CLUB_REFRESH_RATE         — проверок в секунду при обновлении (5)
+"""
+
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Dict, Hashable, Optional, Union
+
+from aiogram import Bot
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession
+
+from database.models import Payment
+from services.logging import logger
+from services.metrics import counter, gauge
+
+
+MEMBERSHIP_CACHE_SIZE = int(os.getenv('MEMBERSHIP_CACHE_SIZE') or '10000')
+MEMBERSHIP_POSITIVE_TTL = float(os.getenv('MEMBERSHIP_POSITIVE_TTL') or '300')
+MEMBERSHIP_NEGATIVE_TTL = float(os.getenv('MEMBERSHIP_NEGATIVE_TTL') or '15')
+CLUB_REFRESH_INTERVAL = float(os.getenv('CLUB_REFRESH_INTERVAL') or '0')
+CLUB_REFRESH_RATE = float(os.getenv('CLUB_REFRESH_RATE') or '5')
+
+MEMBER_STATUSES = ('member', 'administrator', 'creator')
+
+MEMBERSHIP_CHECKS = counter(
+    'paganini_membership_checks_total',
+    'Chat membership checks by cache result (hit, miss, coalesced)',
+    ['result'],
+)
+
+ChatId = Union[int, str]
+
+
+class MembershipCache:
+    """LRU-кэш результатов getChatMember с раздельным TTL для «да» и «нет»."""
+
+    def __init__(self, maxsize: int = MEMBERSHIP_CACHE_SIZE, positive_ttl: float = MEMBERSHIP_POSITIVE_TTL,
+                 negative_ttl: float = MEMBERSHIP_NEGATIVE_TTL):
+        self.maxsize = maxsize
+        self.positive_ttl = positive_ttl
+        self.negative_ttl = negative_ttl
+        # (chat_id, user_id) -> (состоит ли, когда истекает)
+        self._data: OrderedDict[Hashable, tuple[bool, float]] = OrderedDict()
+        # Запросы к Telegram в процессе: их ждут повторные проверки
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+
+    @property
+    def enabled(self) -> bool:
+        return self.maxsize > 0
+
+    async def is_member(self, bot: Bot, chat_id: ChatId, user_id: int, recheck_negative: bool = False) -> bool:
+        """
+        Состоит ли пользователь в чате.
+
+        Args:
+            recheck_negative: Не верить закэшированному «не состоит»
+                (пользователь нажал «Проверить подписку» после вступления)
+
+        Raises:
+            Ошибки get_chat_member (TelegramBadRequest и т.д.) — не кэшируются
+        """
+        key = (chat_id, user_id)
+        cached = self._get(key)
+        if cached is not None and (cached or not recheck_negative):
+            MEMBERSHIP_CHECKS.inc(result='hit')
+            return cached
+
+        task = self._inflight.get(key)
+        if task is not None:
+            MEMBERSHIP_CHECKS.inc(result='coalesced')
+        else:
+            MEMBERSHIP_CHECKS.inc(result='miss')
+            task = self._inflight[key] = asyncio.create_task(self._load(bot, chat_id, user_id))
+            task.add_done_callback(lambda t: self._loaded(key, t))
+        # shield: отмена одного ожидающего не отменяет общий запрос
+        return await asyncio.shield(task)
+
+    async def refresh(self, bot: Bot, chat_id: ChatId, user_id: int, positive_ttl: Optional[float] = None) -> bool:
+        """Проверить заново и положить результат в кэш («состоит» — на positive_ttl, если задан)."""
+        is_member = await self._load(bot, chat_id, user_id)
+        self._put((chat_id, user_id), is_member, positive_ttl if is_member else None)
+        return is_member
+
+    def invalidate(self, chat_id: ChatId, user_id: int):
+        self._data.pop((chat_id, user_id), None)
+
+    def members(self, chat_id: ChatId) -> list[int]:
+        """Пользователи, закэшированные как участники чата."""
+        return [key[1] for key, (is_member, _) in self._data.items() if key[0] == chat_id and is_member]
+
+    def clear(self):
+        self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    @staticmethod
+    async def _load(bot: Bot, chat_id: ChatId, user_id: int) -> bool:
+        member = await bot.get_chat_member(chat_id, user_id)
+        return member.status in MEMBER_STATUSES
+
+    def _loaded(self, key, task: asyncio.Task):
+        self._inflight.pop(key, None)
+        if task.cancelled():
+            return
+        if task.exception() is not None:
+            # Ошибку получили ожидающие; сам результат не кэшируем
+            return
+        self._put(key, task.result())
+
+    def _get(self, key) -> Optional[bool]:
+        item = self._data.get(key)
+        if item is None:
+            return None
+        if item[1] < time.monotonic():
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return item[0]
+
+    def _put(self, key, is_member: bool, ttl: Optional[float] = None):
+        if not self.enabled:
+            return
+        if ttl is None:
+            ttl = self.positive_ttl if is_member else self.negative_ttl
+        self._data.pop(key, None)
+        self._data[key] = (is_member, time.monotonic() + ttl)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+
+membership_cache = MembershipCache()
+
+MEMBERSHIP_CACHE_ENTRIES = gauge(
+    'paganini_membership_cache_entries',
+    'Chat membership checks currently held in the cache',
+    collect=lambda: {(): len(membership_cache)},
+)
+
+
+async def is_chat_member(bot: Bot, chat_id: ChatId, user_id: int, recheck_negative: bool = False) -> bool:
+    """Проверка членства через общий кэш (см. MembershipCache.is_member)."""
+    return await membership_cache.is_member(bot, chat_id, user_id, recheck_negative)
+
+
+async def orm_get_club_bonus_users(session: AsyncSession) -> list[int]:
+    """Пользователи, получавшие клубный бонус за последние два месяца."""
+    query = (
+        select(Payment.tg_id)
+        .where(Payment.source == 'Club', Payment.created >= datetime.now() - timedelta(days=62))
+    )
+    # Без DISTINCT: с ним SQLite обходит весь idx_payment_user_source_created ради порядка по tg_id
+    return list(set((await session.execute(query)).scalars().all()))
+
+
+async def club_refresh_loop(bot: Bot, engine: AsyncEngine, chat_id: int, interval: float = CLUB_REFRESH_INTERVAL,
+                            rate: float = CLUB_REFRESH_RATE):
+    """
+    Фоновое обновление статуса участников клуба.
+
+    «Состоит» кладётся в кэш на два интервала, поэтому между проходами
+    участник не выпадает из кэша; «не состоит» — на обычный короткий TTL.
+    """
+    while True:
+        started = time.monotonic()
+        try:
+            async with AsyncSession(engine) as session:
+                tg_ids = set(await orm_get_club_bonus_users(session))
+            tg_ids |= set(membership_cache.members(chat_id))
+            members = 0
+            for tg_id in tg_ids:
+                try:
+                    if await membership_cache.refresh(bot, chat_id, tg_id, positive_ttl=interval * 2):
+                        members += 1
+                except Exception as e:
+                    logger.warning(f"Клуб: не удалось проверить {tg_id}: {e}")
+                await asyncio.sleep(1 / rate)
+            logger.info(f"Клуб: статус обновлён для {len(tg_ids)} пользователей, участников {members}")
+        except Exception as e:
+            logger.error(f"Клуб: ошибка обновления статуса участников: {e}")
+        await asyncio.sleep(max(0.0, interval - (time.monotonic() - started)))
@@ -0,0 +1,310 @@
+"""
+Метрики бота в формате Prometheus (text exposition format 0.0.4).
+
+Минимальная реализация Counter / Gauge / Histogram без внешних
+зависимостей. Метрики потокобезопасны: часть запросов к WB выполняется
+в отдельных потоках. Отдаются эндпоинтом /metrics webhook-сервера.
+"""
+
+import math
+import threading
+from abc import ABC, abstractmethod
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Optional, Sequence, Tuple
+
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+STAGE_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 180, 300, 480)
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = '') -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+
+class _Metric(ABC):
+    kind = ''
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f'{self.name}: expected labels {self.labelnames}, got {tuple(labels)}')
+        return tuple(str(labels[n]) for n in self.labelnames)
+
+    def _header(self) -> list[str]:
+        return [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+
+    @abstractmethod
+    def render(self) -> list[str]:
+        """Строки метрики в text exposition format."""
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def render(self) -> list[str]:
+        lines = self._header()
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}')
+        return lines
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 collect: Optional[Callable[[], Dict[Tuple[str, ...], float]]] = None):
+        """
+        Args:
+            collect: Функция, возвращающая значения на момент запроса /metrics
+                     ({значения лейблов: значение}); используется вместо set()
+        """
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._collect = collect
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def get(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    @contextmanager
+    def track_inprogress(self, **labels):
+        """Увеличивает gauge на время выполнения блока."""
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+    def render(self) -> list[str]:
+        lines = self._header()
+        if self._collect is not None:
+            values = dict(self._collect())
+        else:
+            with self._lock:
+                values = dict(self._values)
+        for key, value in sorted(values.items()):
+            lines.append(f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}')
+        return lines
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        # key -> [counts по бакетам..., sum, count]
+        self._values: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            data = self._values.get(key)
+            if data is None:
+                data = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    data[i] += 1
+                    break
+            data[-2] += value
+            data[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Замер длительности блока в секундах."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def render(self) -> list[str]:
+        lines = self._header()
+        with self._lock:
+            items = sorted((key, list(data)) for key, data in self._values.items())
+        for key, data in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, data):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f'{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}')
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f'{self.name}_sum{labels} {_format_value(data[-2])}')
+            lines.append(f'{self.name}_count{labels} {data[-1]}')
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f'Metric {metric.name} already registered')
+            self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+def counter(name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+    return REGISTRY.register(Counter(name, documentation, labelnames))
+
+
+def gauge(name: str, documentation: str, labelnames: Sequence[str] = (), collect=None) -> Gauge:
+    return REGISTRY.register(Gauge(name, documentation, labelnames, collect))
+
+
+def histogram(name: str, documentation: str, labelnames: Sequence[str] = (),
+              buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+    return REGISTRY.register(Histogram(name, documentation, labelnames, buckets))
+
+
+def render_metrics() -> str:
+    """Все метрики в текстовом формате Prometheus."""
+    return REGISTRY.render()
+
+
+# ------------------ Метрики генерации отчётов ------------------
+
+REPORT_STAGE_SECONDS = histogram(
+    'paganini_report_stage_seconds',
+    'Duration of report generation stages',
+    ['stage'],
+    buckets=STAGE_BUCKETS,
+)
+REPORT_GENERATIONS = counter(
+    'paganini_report_generations_total',
+    'Finished report generations by result',
+    ['result'],
+)
+ACTIVE_GENERATIONS = gauge(
+    'paganini_active_generations',
+    'Report generations currently running',
+)
+QUEUE_DEPTH = gauge(
+    'paganini_queue_depth',
+    'Items waiting in internal queues',
+    ['queue'],
+)
+
+# ------------------ Метрики запросов к WB ------------------
+
+WB_REQUEST_SECONDS = histogram(
+    'paganini_wb_request_seconds',
+    'Latency of Wildberries API requests',
+    ['host'],
+)
+WB_REQUESTS = counter(
+    'paganini_wb_requests_total',
+    'Wildberries API requests by host and status',
+    ['host', 'status'],
+)
+WB_THROTTLED = counter(
+    'paganini_wb_429_total',
+    'Wildberries API 429 Too Many Requests responses',
+    ['host'],
+)
+
+# ------------------ БД ------------------
+
+UPDATE_DB_QUERIES = histogram(
+    'paganini_update_db_queries',
+    'Database queries per Telegram update (updates that opened a session)',
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 50),
+)
+UPDATE_DB_SECONDS = histogram(
+    'paganini_update_db_seconds',
+    'Time spent in the database per Telegram update',
+)
+UPDATES_BY_DB_USAGE = counter(
+    'paganini_updates_total',
+    'Telegram updates by whether they used a database session',
+    ['db'],
+)
+
+# ------------------ Апдейты Telegram ------------------
+
+UPDATE_QUEUE_WAIT_SECONDS = histogram(
+    'paganini_update_queue_wait_seconds',
+    'Time from receiving an update to the start of its handling '
+    '(waiting for the same user\'s earlier updates and for a free slot)',
+)
+ACTIVE_UPDATES = gauge(
+    'paganini_active_updates',
+    'Telegram updates being handled right now',
+)
+
+# ------------------ Event loop ------------------
+
+EVENT_LOOP_LAG_SECONDS = histogram(
+    'paganini_event_loop_lag_seconds',
+    'Delay between scheduled and actual wake-up of the loop monitor heartbeat',
+    buckets=LAG_BUCKETS,
+)
+
+EVENT_LOOP_STALLS = counter(
+    'paganini_event_loop_stalls_total',
+    'Event loop blocks longer than the loop monitor threshold',
+)
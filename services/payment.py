@@ -5,24 +5,75 @@ import os
 from aiogram import Bot
 from aiogram.exceptions import TelegramBadRequest
 
-from sqlalchemy import update, select, exists
+from sqlalchemy import update, select, exists, or_
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import sessionmaker
 
 from database.models import User, Payment
 from services.auth_service import orm_get_user
 from services.logging import logger
+from services.membership import is_chat_member
+from services.user_cache import user_cache
 from services import modulbank
 from keyboards.user_keyboards import get_main_kb
 
 
-async def orm_reduce_generations(session: AsyncSession, tg_id:int):
-    query = update(User).where(User.tg_id == tg_id).values(
-        generations_made=User.generations_made + 1,
-        generations_left=User.generations_left - 1
+# Роли, которым генерации доступны при нулевом балансе
+UNLIMITED_ROLES = ('admin', 'whitelist')
+
+
+async def orm_reserve_generation(session: AsyncSession, tg_id: int) -> bool:
+    """
+    Резерв генерации перед запуском отчёта.
+
+    Один условный UPDATE ... WHERE generations_left > 0 RETURNING: проверка
+    баланса и списание атомарны, поэтому два параллельных запуска не уведут
+    баланс в минус. Возвращает False, если генераций нет — работу с WB
+    в этом случае не начинаем.
+    """
+    query = (
+        update(User)
+        .where(User.tg_id == tg_id, or_(User.generations_left > 0, User.role.in_(UNLIMITED_ROLES)))
+        .values(generations_left=User.generations_left - 1)
+        .returning(User.generations_left)
     )
+    result = await session.execute(query)
+    reserved = result.scalar_one_or_none() is not None
+    await session.commit()
+    if reserved:
+        user_cache.invalidate(tg_id)
+    return reserved
+
+
+async def orm_commit_generation(session: AsyncSession, tg_id: int) -> int:
+    """
+    Подтвердить резерв после отправки отчёта.
+
+    Returns:
+        generations_made после увеличения (1 — это первый отчёт пользователя)
+    """
+    query = (
+        update(User)
+        .where(User.tg_id == tg_id)
+        .values(generations_made=User.generations_made + 1)
+        .returning(User.generations_made)
+    )
+    result = await session.execute(query)
+    generations_made = result.scalar_one()
+    await session.commit()
+    user_cache.invalidate(tg_id)
+    return generations_made
+
+
+async def orm_release_generation(session: AsyncSession, tg_id: int):
+    """Вернуть зарезервированную генерацию, если отчёт не получился."""
+    # Сессия могла остаться в упавшей транзакции
+    await session.rollback()
+    query = update(User).where(User.tg_id == tg_id).values(generations_left=User.generations_left + 1)
     await session.execute(query)
     await session.commit()
+    user_cache.invalidate(tg_id)
 
 
 async def orm_get_email(session: AsyncSession, tg_id: int):
@@ -34,6 +85,7 @@ async def orm_set_email(session: AsyncSession, tg_id: int, email: str):
     query = update(User).where(User.tg_id == tg_id).values(email=email)
     await session.execute(query)
     await session.commit()
+    user_cache.invalidate(tg_id)
 
 
 async def create_payment(tg_id: int, generations_num: int, amount: int, email: str):
@@ -86,7 +138,8 @@ async def process_modulbank_payment(payment_data: dict, bot: Bot, session_maker:
     """
     Обработка успешного платежа от webhook Модуль Банка.
 
-    Вызывается из webhook_server.py при получении уведомления.
+    Вызывается из очереди уведомлений (services/payment_inbox.py), в том
+    числе повторно: платёж с тем же transaction_id не начисляется дважды.
 
     ВАЖНО: Все операции выполняются в одной транзакции для атомарности.
     Порядок: сначала записываем платёж (для защиты от дубликатов),
@@ -147,8 +200,15 @@ async def process_modulbank_payment(payment_data: dict, bot: Bot, session_maker:
             logger.info(f"Начислен бонус {bonus}₽ рефереру {referrer} от платежа {tg_id}")
 
         # 4. Один commit для всей транзакции
-        await session.commit()
+        try:
+            await session.commit()
+        except IntegrityError:
+            # Параллельный webhook с тем же transaction_id успел раньше (уникальный индекс)
+            await session.rollback()
+            logger.warning(f"Платёж {transaction_id} уже обработан (параллельный webhook)")
+            return
 
+        user_cache.invalidate(tg_id, referrer)
         logger.info(f"Платёж {transaction_id} обработан: {generations_num} генераций для {tg_id}")
 
     # Уведомляем пользователя
@@ -183,6 +243,7 @@ async def orm_add_generations(session: AsyncSession, tg_id: int, generations_num
     query = update(User).where(User.tg_id == tg_id).values(generations_left=User.generations_left + generations_num)
     await session.execute(query)
     await session.commit()
+    user_cache.invalidate(tg_id)
 
 
 async def orm_add_payment(
@@ -231,8 +292,7 @@ async def check_user_in_club(tg_id: int, bot: Bot):
         return False
 
     try:
-        member = await bot.get_chat_member(int(club_chat_id), tg_id)
-        is_member = member.status in ("member", "administrator", "creator")
+        is_member = await is_chat_member(bot, int(club_chat_id), tg_id)
     except TelegramBadRequest:
         # если бот не может получить статус — считаем не членом
         is_member = False
@@ -0,0 +1,249 @@
+"""
+Очередь входящих уведомлений Модуль Банка (inbox).
+
+Webhook только проверяет подпись, сохраняет уведомление в таблицу
+payment_inbox и сразу отвечает 200: медленная БД или Telegram больше
+не задерживают ответ и не вызывают повторные webhook'и Модуль Банка.
+Платёж обрабатывает фоновый PaymentInbox.run():
+
+    - transaction_id уникален: повторная доставка того же уведомления
+      не создаёт вторую запись;
+    - уведомление берётся в работу условным UPDATE (аренда на
+      PAYMENT_INBOX_LEASE секунд), поэтому несколько экземпляров бота не
+      обработают его одновременно, а брошенное упавшим процессом
+      подхватится после истечения аренды;
+    - при ошибке обработка повторяется с экспоненциальной задержкой,
+      после PAYMENT_INBOX_MAX_ATTEMPTS попыток уведомление получает
+      статус failed (в логе — ошибка с transaction_id);
+    - сама обработка (process_modulbank_payment) идемпотентна: платёж с
+      тем же transaction_id второй раз не начисляется.
+
+Если сохранить уведомление не удалось (БД недоступна), webhook отвечает
+503 и Модуль Банк повторит доставку.
+
+Настройки (переменные окружения):
+    PAYMENT_INBOX_POLL_INTERVAL  — как часто проверять очередь без новых уведомлений, сек (5)
+    PAYMENT_INBOX_RETRY_DELAY    — задержка перед первым повтором, сек (5; дальше удваивается, до 10 минут)
+    PAYMENT_INBOX_MAX_ATTEMPTS   — попыток обработки до статуса failed (10)
+    PAYMENT_INBOX_LEASE          — на сколько секунд уведомление берётся в работу (300)
+"""
+
+import asyncio
+import json
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, Optional
+
+from sqlalchemy import select, update, func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import sessionmaker
+
+from database.models import PaymentNotification
+from services.logging import logger
+from services.metrics import QUEUE_DEPTH, counter
+from services.modulbank import parse_callback_data
+
+
+PAYMENT_INBOX_POLL_INTERVAL = float(os.getenv('PAYMENT_INBOX_POLL_INTERVAL') or '5')
+PAYMENT_INBOX_RETRY_DELAY = float(os.getenv('PAYMENT_INBOX_RETRY_DELAY') or '5')
+PAYMENT_INBOX_MAX_ATTEMPTS = int(os.getenv('PAYMENT_INBOX_MAX_ATTEMPTS') or '10')
+PAYMENT_INBOX_LEASE = int(os.getenv('PAYMENT_INBOX_LEASE') or '300')
+
+MAX_RETRY_DELAY = 600
+# Уведомлений за один проход воркера
+BATCH_SIZE = 50
+
+PAYMENT_INBOX = counter(
+    'paganini_payment_inbox_total',
+    'Modulbank notifications by inbox result (received, duplicate, processed, retry, failed)',
+    ['result'],
+)
+
+
+def _utcnow() -> datetime:
+    # Колонки DateTime без часового пояса: храним UTC
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def retry_delay(attempts: int) -> float:
+    """Задержка перед следующей попыткой после attempts неудачных."""
+    return min(PAYMENT_INBOX_RETRY_DELAY * 2 ** (attempts - 1), MAX_RETRY_DELAY)
+
+
+# ------------------ Запросы ------------------
+
+async def orm_add_payment_notification(session: AsyncSession, transaction_id: str, payload: dict) -> bool:
+    """Сохранить уведомление. False — уведомление с этим transaction_id уже есть."""
+    session.add(PaymentNotification(
+        transaction_id=transaction_id,
+        payload=json.dumps(payload, ensure_ascii=False),
+        status='pending',
+        next_attempt_at=_utcnow(),
+    ))
+    try:
+        await session.commit()
+    except IntegrityError:
+        await session.rollback()
+        return False
+    return True
+
+
+async def orm_get_due_notifications(session: AsyncSession, limit: int = BATCH_SIZE) -> list[int]:
+    """id уведомлений, которые пора обработать, от старых к новым."""
+    query = (
+        select(PaymentNotification.id)
+        .where(PaymentNotification.status == 'pending', PaymentNotification.next_attempt_at <= _utcnow())
+        .order_by(PaymentNotification.next_attempt_at)
+        .limit(limit)
+    )
+    return list((await session.execute(query)).scalars().all())
+
+
+async def orm_claim_notification(session: AsyncSession, notification_id: int,
+                                 lease: int = PAYMENT_INBOX_LEASE) -> Optional[tuple[dict, int]]:
+    """
+    Взять уведомление в работу.
+
+    Returns:
+        (поля уведомления, номер попытки) или None, если его уже взял
+        другой экземпляр или обработал
+    """
+    now = _utcnow()
+    n = PaymentNotification.__table__
+    query = (
+        update(n)
+        .where(n.c.id == notification_id, n.c.status == 'pending', n.c.next_attempt_at <= now)
+        .values(next_attempt_at=now + timedelta(seconds=lease), attempts=n.c.attempts + 1)
+        .returning(n.c.payload, n.c.attempts)
+    )
+    row = (await session.execute(query)).first()
+    await session.commit()
+    if row is None:
+        return None
+    return json.loads(row.payload), row.attempts
+
+
+async def orm_finish_notification(session: AsyncSession, notification_id: int):
+    query = (
+        update(PaymentNotification)
+        .where(PaymentNotification.id == notification_id)
+        .values(status='done', last_error=None)
+    )
+    await session.execute(query)
+    await session.commit()
+
+
+async def orm_fail_notification(session: AsyncSession, notification_id: int, error: str,
+                                retry_in: Optional[float]):
+    """Записать ошибку: повтор через retry_in секунд, None — больше не повторять."""
+    values = {'last_error': error}
+    if retry_in is None:
+        values['status'] = 'failed'
+    else:
+        values['next_attempt_at'] = _utcnow() + timedelta(seconds=retry_in)
+    query = update(PaymentNotification).where(PaymentNotification.id == notification_id).values(**values)
+    await session.execute(query)
+    await session.commit()
+
+
+async def orm_count_pending_notifications(session: AsyncSession) -> int:
+    query = select(func.count()).select_from(PaymentNotification).where(PaymentNotification.status == 'pending')
+    return await session.scalar(query)
+
+
+# ------------------ Обработка ------------------
+
+class PaymentInbox:
+    """Приём уведомлений в payment_inbox и фоновая обработка с повторами."""
+
+    def __init__(self, session_maker: sessionmaker, handler: Callable[[dict], Awaitable[None]],
+                 poll_interval: float = PAYMENT_INBOX_POLL_INTERVAL,
+                 max_attempts: int = PAYMENT_INBOX_MAX_ATTEMPTS):
+        """
+        Args:
+            session_maker: Фабрика сессий БД
+            handler: Обработка платежа, принимает результат parse_callback_data
+            poll_interval: Период проверки очереди без новых уведомлений, сек
+            max_attempts: Попыток обработки до статуса failed
+        """
+        self.session_maker = session_maker
+        self.handler = handler
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self._wakeup = asyncio.Event()
+
+    async def enqueue(self, notification: dict):
+        """
+        Сохранить уведомление (поля POST-запроса после проверки подписи).
+
+        Raises:
+            Ошибки БД — webhook отвечает 503, Модуль Банк повторит доставку
+        """
+        transaction_id = notification.get('transaction_id')
+        if not transaction_id:
+            logger.error(f"Уведомление Модуль Банка без transaction_id: {notification.get('custom_order_id')}")
+            return
+
+        async with self.session_maker() as session:
+            added = await orm_add_payment_notification(session, transaction_id, notification)
+        if not added:
+            PAYMENT_INBOX.inc(result='duplicate')
+            logger.info(f"Уведомление {transaction_id} уже в очереди")
+            return
+        PAYMENT_INBOX.inc(result='received')
+        self._wakeup.set()
+
+    async def run(self):
+        """Фоновая задача: обрабатывать уведомления, пока не отменят."""
+        while True:
+            try:
+                while await self.process_due():
+                    pass
+                async with self.session_maker() as session:
+                    QUEUE_DEPTH.set(await orm_count_pending_notifications(session), queue='payment_inbox')
+            except Exception as e:
+                logger.error(f"Очередь платежей: ошибка обработки: {e}")
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    async def process_due(self) -> int:
+        """Обработать уведомления, которые пора обрабатывать. Возвращает, сколько взято."""
+        async with self.session_maker() as session:
+            ids = await orm_get_due_notifications(session)
+
+        processed = 0
+        for notification_id in ids:
+            async with self.session_maker() as session:
+                claimed = await orm_claim_notification(session, notification_id)
+            if claimed is None:
+                continue
+            processed += 1
+            await self._process(notification_id, *claimed)
+        return processed
+
+    async def _process(self, notification_id: int, notification: dict, attempt: int):
+        payment_data = parse_callback_data(notification)
+        try:
+            await self.handler(payment_data)
+        except Exception as e:
+            error = f'{type(e).__name__}: {e}'
+            if attempt >= self.max_attempts:
+                PAYMENT_INBOX.inc(result='failed')
+                logger.error(f"Платёж {payment_data['transaction_id']} не обработан после {attempt} попыток: {error}")
+                retry_in = None
+            else:
+                PAYMENT_INBOX.inc(result='retry')
+                retry_in = retry_delay(attempt)
+                logger.warning(f"Платёж {payment_data['transaction_id']}: попытка {attempt} не удалась ({error}), "
+                               f"повтор через {retry_in:.0f} с")
+            async with self.session_maker() as session:
+                await orm_fail_notification(session, notification_id, error, retry_in)
+            return
+
+        async with self.session_maker() as session:
+            await orm_finish_notification(session, notification_id)
+        PAYMENT_INBOX.inc(result='processed')
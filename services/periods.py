@@ -0,0 +1,107 @@
+"""
+Периоды отчётов: недели и кварталы для клавиатур выбора периода.
+
+Отдельно от services/report_generator.py, чтобы клавиатуры не тянули
+pandas и openpyxl при старте бота.
+"""
+
+from datetime import date, timedelta
+from functools import wraps
+
+
+def daily_cache(maxsize: int = 64):
+    """
+    Кэш результата функции до смены даты: ключ — (date.today(), аргументы).
+
+    Списки недель и кварталов (и клавиатуры из них) меняются раз в день,
+    поэтому считаются один раз за день на набор аргументов. Возвращается
+    один и тот же объект — результат не должен изменяться вызывающим.
+    """
+    def decorator(func):
+        cache = {}
+        cached_day = None
+
+        @wraps(func)
+        def wrapper(*args):
+            nonlocal cached_day
+            today = date.today()
+            if today != cached_day:
+                cache.clear()
+                cached_day = today
+            try:
+                return cache[args]
+            except KeyError:
+                pass
+            if len(cache) >= maxsize:
+                # Аргументы приходят из callback_data — не даём кэшу расти
+                cache.clear()
+            value = cache[args] = func(*args)
+            return value
+
+        wrapper.cache_clear = cache.clear
+        return wrapper
+    return decorator
+
+
+@daily_cache()
+def get_weeks_range(count) -> tuple[str, ...]:
+    today = date.today()
+    previous_monday = today - timedelta(days=today.weekday()) - timedelta(days=7)
+    if today.weekday() == 0:
+        previous_monday -= timedelta(days=7)
+    weeks_range = []
+    for i in range(count):
+        week_start = previous_monday - timedelta(weeks=i)
+        week_end = week_start + timedelta(days=6)
+        weeks_range.append(f'{week_start.strftime("%d.%m.%Y")}-{week_end.strftime("%d.%m.%Y")}')
+
+    return tuple(weeks_range)
+
+
+@daily_cache()
+def get_quarters_range() -> tuple[tuple[str, str], ...]:
+    today = date.today()
+    current_year = today.year
+    current_quarter = (today.month - 1) // 3 + 1
+    quarters_month = {
+        0: 'янв-мар',
+        1: 'апр-июн',
+        2: 'июл-сен',
+        3: 'окт-дек'
+    }
+
+    quarters = []
+    for year in range(2025, current_year + 1):
+        quarters_num = current_quarter if year == current_year else 4
+        for quarter in range(quarters_num):
+            quarters.append((f'{year}_{quarter}', f'{quarters_month[quarter]} {year}'))
+
+    return tuple(quarters)
+
+
+@daily_cache()
+def get_quarters_weeks(year: int, quarter: int) -> tuple[str, ...]:
+    today = date.today()
+    start_month = quarter * 3 + 1
+    first_day = date(year, start_month, 1)
+    start_date = first_day + timedelta(days=7) - timedelta(days=first_day.weekday())
+
+    if start_month == 10:  # Q4
+        last_day = date(year, 12, 31)
+    else:
+        last_day = date(year, start_month + 3, 1) - timedelta(days=1)
+
+    if last_day < today:
+        end_date = last_day - timedelta(days=last_day.weekday())
+    else:
+        end_date = today - timedelta(days=today.weekday()) - timedelta(days=7)
+        if today.weekday() == 0:
+            end_date -= timedelta(days=7)
+    weeks_range = []
+    current_monday = start_date
+    while current_monday <= end_date:
+        current_sunday = current_monday + timedelta(days=6)
+        weeks_range.append(f'{current_monday.strftime("%d.%m.%Y")}-{current_sunday.strftime("%d.%m.%Y")}')
+        current_monday += timedelta(weeks=1)
+
+    return tuple(weeks_range)
@@ -0,0 +1,259 @@
+"""
+Профилирование генерации отчёта по запросу из админки.
+
+Админ помечает следующую генерацию пользователя (/profile_report <tg_id> [store_id]).
+Когда пользователь запускает отчёт, генерация идёт под:
+
+    sampling-профайлером — отдельный поток раз в PROFILE_SAMPLE_INTERVAL секунд
+                           снимает стеки всех потоков (sys._current_frames):
+                           event loop и потоков asyncio.to_thread;
+    tracemalloc          — сравнение снимков памяти до и после генерации.
+
+Результат — файл collapsed stacks (формат flamegraph.pl / speedscope)
+и топ мест аллокаций — отправляется админу документами.
+
+Настройки (переменные окружения):
+    PROFILE_SAMPLE_INTERVAL  — период снятия стеков, сек (0.005)
+    PROFILE_TOP_ALLOCATIONS  — сколько мест аллокаций выводить (30)
+    PROFILE_REQUEST_TTL      — сколько секунд ждать генерацию после запроса (86400)
+"""
+
+import asyncio
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from aiogram import Bot
+from aiogram.types import FSInputFile
+
+from services.logging import logger
+
+
+SAMPLE_INTERVAL = float(os.getenv('PROFILE_SAMPLE_INTERVAL') or '0.005')
+TOP_ALLOCATIONS = int(os.getenv('PROFILE_TOP_ALLOCATIONS') or '30')
+REQUEST_TTL = float(os.getenv('PROFILE_REQUEST_TTL') or '86400')
+
+# Глубина стека, сохраняемая tracemalloc
+TRACEMALLOC_FRAMES = 25
+
+# Функции ожидания: простаивающие потоки (кроме event loop) в профиль не пишем
+_IDLE_FUNCTIONS = {'wait', 'select', 'poll', 'epoll', 'accept', '_worker'}
+
+
+@dataclass
+class ProfileRequest:
+    admin_id: int
+    tg_id: int
+    store_id: Optional[int] = None
+    created: float = field(default_factory=time.monotonic)
+
+
+# tg_id -> запрос на профилирование следующей генерации
+_requests: Dict[int, ProfileRequest] = {}
+# Одновременно профилируется только одна генерация: tracemalloc глобален
+_active = threading.Lock()
+# Задачи отправки результатов (держим ссылки, чтобы задачи не собрал GC)
+_background: set = set()
+
+
+def request_profile(admin_id: int, tg_id: int, store_id: Optional[int] = None) -> ProfileRequest:
+    """Пометить следующую генерацию пользователя (и магазина) для профилирования."""
+    request = ProfileRequest(admin_id=admin_id, tg_id=tg_id, store_id=store_id)
+    _requests[tg_id] = request
+    return request
+
+
+def cancel_profile(tg_id: int) -> bool:
+    return _requests.pop(tg_id, None) is not None
+
+
+def get_pending_profiles() -> list[ProfileRequest]:
+    now = time.monotonic()
+    return [r for r in _requests.values() if now - r.created < REQUEST_TTL]
+
+
+def take_profile_request(tg_id: int, store_id: int) -> Optional[ProfileRequest]:
+    """Забрать запрос, если он относится к этой генерации."""
+    request = _requests.get(tg_id)
+    if request is None:
+        return None
+    if time.monotonic() - request.created >= REQUEST_TTL:
+        _requests.pop(tg_id, None)
+        return None
+    if request.store_id is not None and request.store_id != store_id:
+        return None
+    return _requests.pop(tg_id)
+
+
+class SamplingProfiler:
+    """Периодически снимает стеки всех потоков и считает одинаковые стеки."""
+
+    def __init__(self, interval: float = SAMPLE_INTERVAL):
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self._main_thread_id = threading.get_ident()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='profile-sampler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                if thread_id != self._main_thread_id and frame.f_code.co_name in _IDLE_FUNCTIONS:
+                    continue
+                self.stacks[self._collapse(names.get(thread_id, str(thread_id)), frame)] += 1
+            self.samples += 1
+
+    @staticmethod
+    def _collapse(thread_name: str, frame) -> str:
+        parts = []
+        while frame is not None:
+            code = frame.f_code
+            parts.append(f'{code.co_name} ({Path(code.co_filename).name}:{code.co_firstlineno})')
+            frame = frame.f_back
+        parts.append(thread_name)
+        return ';'.join(reversed(parts))
+
+    def write_collapsed(self, path: Path):
+        """Файл для flamegraph.pl / speedscope: 'кадр;кадр;кадр count' в строке."""
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f'{stack} {count}\n')
+
+
+def _format_allocations(before: tracemalloc.Snapshot, after: tracemalloc.Snapshot, peak: int, limit: int) -> str:
+    stats = after.compare_to(before, 'traceback')
+    lines = [
+        f'Пик памяти, отслеженной tracemalloc: {peak / 1024 / 1024:.1f} MiB',
+        f'Топ-{limit} мест аллокаций (прирост за генерацию):',
+        '',
+    ]
+    for index, stat in enumerate(stats[:limit], 1):
+        lines.append(
+            f'#{index}: {stat.size_diff / 1024:+.1f} KiB '
+            f'(итого {stat.size / 1024:.1f} KiB, блоков {stat.count_diff:+d})'
+        )
+        lines.extend(f'    {line}' for line in stat.traceback.format(limit=8))
+        lines.append('')
+    return '\n'.join(lines)
+
+
+async def _send_results(bot: Bot, request: ProfileRequest, files: Tuple[Path, ...], summary: str):
+    try:
+        await bot.send_message(chat_id=request.admin_id, text=summary)
+        for path in files:
+            await bot.send_document(chat_id=request.admin_id, document=FSInputFile(path))
+    except Exception as e:
+        logger.error(f"Не удалось отправить результаты профилирования админу {request.admin_id}: {e}")
+
+
+async def _save_results(bot: Bot, request: ProfileRequest, profiler: SamplingProfiler,
+                        snapshot_before: tracemalloc.Snapshot, snapshot_after: tracemalloc.Snapshot,
+                        peak: int, elapsed: float, status: str, store_id: int):
+    """Записать профиль и аллокации в файлы (в потоке) и отправить админу."""
+    tg_id = request.tg_id
+    folder = Path(os.getenv('DATA_ROOT')) / 'profiles'
+    stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    collapsed_path = folder / f'profile_{tg_id}_{store_id}_{stamp}.folded'
+    allocations_path = folder / f'allocations_{tg_id}_{store_id}_{stamp}.txt'
+
+    def write_files():
+        folder.mkdir(parents=True, exist_ok=True)
+        profiler.write_collapsed(collapsed_path)
+        allocations_path.write_text(
+            _format_allocations(snapshot_before, snapshot_after, peak, TOP_ALLOCATIONS), encoding='utf-8'
+        )
+
+    try:
+        await asyncio.to_thread(write_files)
+    except Exception as e:
+        logger.error(f"Не удалось сохранить результаты профилирования {tg_id}: {e}")
+        return
+
+    summary = (
+        f'Профиль генерации готов\n\n'
+        f'Пользователь: {tg_id}, магазин: {store_id}\n'
+        f'Результат: {status}\n'
+        f'Время: {elapsed:.1f} сек\n'
+        f'Сэмплов: {profiler.samples} (каждые {profiler.interval * 1000:.0f} мс)\n'
+        f'Пик памяти (tracemalloc): {peak / 1024 / 1024:.1f} MiB\n\n'
+        f'.folded — collapsed stacks для flamegraph.pl или speedscope.app'
+    )
+    await _send_results(bot, request, (collapsed_path, allocations_path), summary)
+
+
+@asynccontextmanager
+async def profiled_generation(bot: Bot, tg_id: int, store_id: int):
+    """
+    Выполняет блок под профайлером, если для этой генерации есть запрос.
+    Иначе ничего не делает.
+    """
+    request = take_profile_request(tg_id, store_id)
+    if request is None or not _active.acquire(blocking=False):
+        if request is not None:
+            # Уже профилируется другая генерация — оставляем запрос на следующую
+            _requests.setdefault(tg_id, request)
+        yield
+        return
+
+    logger.info(f"Профилирование генерации: tg_id={tg_id}, store_id={store_id}, admin={request.admin_id}")
+    was_tracing = tracemalloc.is_tracing()
+    if not was_tracing:
+        tracemalloc.start(TRACEMALLOC_FRAMES)
+    tracemalloc.reset_peak()
+    # Снимок кучи копирует все трассы — не на event loop
+    try:
+        snapshot_before = await asyncio.to_thread(tracemalloc.take_snapshot)
+    except BaseException:
+        if not was_tracing:
+            tracemalloc.stop()
+        _active.release()
+        raise
+    profiler = SamplingProfiler()
+    profiler.start()
+    started = time.perf_counter()
+    status = 'ok'
+
+    try:
+        yield
+    except BaseException as e:
+        status = type(e).__name__
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        profiler.stop()
+        try:
+            snapshot_after = await asyncio.to_thread(tracemalloc.take_snapshot)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            if not was_tracing:
+                tracemalloc.stop()
+            _active.release()
+
+        # Отчёт пользователю не ждёт записи файлов профиля и отправки админу
+        task = asyncio.create_task(_save_results(
+            bot, request, profiler, snapshot_before, snapshot_after, peak, elapsed, status, store_id
+        ))
+        _background.add(task)
+        task.add_done_callback(_background.discard)
@@ -1,9 +1,12 @@
 import os
+from typing import Optional
+
 from sqlalchemy import select, update, exists
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from database.models import Ref, User
 from services.payment import orm_add_payment
+from services.user_cache import user_cache
 
 
 async def generate_referral_link(user_id: int) -> str:
@@ -48,23 +51,33 @@ async def orm_add_bonus(session: AsyncSession, tg_id: int, amount: int):
     )
     await session.execute(query)
     await session.commit()
+    user_cache.invalidate(tg_id)
 
 
-async def orm_get_gens_for_bonus(session: AsyncSession, tg_id: int, amount: int, gens_num: int):
-    """Обмен бонусов на генерации."""
-    # Начисляем генерации пользователю
-    query_gens = update(User).where(User.tg_id == tg_id).values(
-        generations_left=User.generations_left + gens_num
-    )
-    await session.execute(query_gens)
+async def orm_get_gens_for_bonus(session: AsyncSession, tg_id: int, amount: int, gens_num: int) -> Optional[int]:
+    """
+    Обмен бонусов на генерации.
+
+    Один условный UPDATE ... WHERE bonus_left >= amount RETURNING: проверка
+    остатка и списание атомарны, поэтому повторное нажатие или второй
+    экземпляр бота не потратят одни бонусы дважды.
 
-    # Списываем бонусы
-    query_bonus = update(User).where(User.tg_id == tg_id).values(
-        bonus_left=User.bonus_left - amount
+    Returns:
+        Остаток бонусов после списания или None, если бонусов недостаточно
+    """
+    query = (
+        update(User)
+        .where(User.tg_id == tg_id, User.bonus_left >= amount)
+        .values(bonus_left=User.bonus_left - amount, generations_left=User.generations_left + gens_num)
+        .returning(User.bonus_left)
     )
-    await session.execute(query_bonus)
+    bonus_left = (await session.execute(query)).scalar_one_or_none()
+    if bonus_left is None:
+        await session.rollback()
+        return None
 
-    # Записываем платёж (с amount=0, source='bonus')
+    # Записываем платёж (с amount=0, source='bonus'); orm_add_payment делает commit
+    # для всей транзакции вместе со списанием
     await orm_add_payment(session, tg_id, 0, gens_num, 'bonus', yoo_id=None)
-
-    # Один commit для всей транзакции (orm_add_payment делает commit внутри)
+    user_cache.invalidate(tg_id)
+    return bonus_left
@@ -10,31 +10,14 @@ from pathlib import Path
 from datetime import date, timedelta, datetime
 from typing import Any, Dict, List
 from aiogram.types import Message
-from sqlalchemy.ext.asyncio import AsyncSession
 
-from database.models import Report
 from services.logging import logger
-
-
-# ------------------ Custom Exceptions ------------------
-class ReportError(Exception):
-    """Base exception for report generation errors"""
-    pass
-
-
-class InvalidTokenError(ReportError):
-    """Token is invalid or lacks permissions"""
-    pass
-
-
-class WBTimeoutError(ReportError):
-    """WB API timeout"""
-    pass
-
-
-class NoDataError(ReportError):
-    """No data found for the period"""
-    pass
+from services.metrics import REPORT_STAGE_SECONDS, REPORT_GENERATIONS, ACTIVE_GENERATIONS
+# Ошибки, адреса и запросы к WB живут в services/wb_api.py (без pandas);
+# реэкспорт — для существующих импортов из report_generator
+from services.wb_api import ReportError, InvalidTokenError, WBTimeoutError, NoDataError, WBUnavailableError, \
+    STATISTICS_API_URL, CONTENT_API_URL, ANALYTICS_API_URL, ADVERT_API_URL, close_http_clients, \
+    wb_request, wb_request_sync, ensure_wb_available  # noqa: F401
 
 
 # ------------------ Progress Stages ------------------
@@ -49,16 +32,14 @@ PROGRESS_STAGES = {
 }
 
 
-# ------------------ HTTP‑clients ------------------
-SYNC_CLIENT  = httpx.Client(timeout=120.0)
-ASYNC_CLIENT = httpx.AsyncClient(timeout=120.0)
-
-
-async def close_http_clients():
-    """Close HTTP clients on shutdown"""
-    SYNC_CLIENT.close()
-    await ASYNC_CLIENT.aclose()
-    logger.info("HTTP clients closed")
+# Результат генерации для метрики paganini_report_generations_total
+_GENERATION_RESULTS = {
+    InvalidTokenError: 'invalid_token',
+    WBTimeoutError: 'timeout',
+    NoDataError: 'no_data',
+    WBUnavailableError: 'wb_unavailable',
+    asyncio.CancelledError: 'cancelled',
+}
 
 
 async def run_with_progress(message: Message, title: str, coro, progress_state: dict, *args):
@@ -75,6 +56,19 @@ async def run_with_progress(message: Message, title: str, coro, progress_state:
         progress_state: Dict for sharing progress stage between coroutines
         *args: Arguments for the coroutine
     """
+    ACTIVE_GENERATIONS.inc()
+    try:
+        result = await _run_with_progress(message, title, coro, progress_state, *args)
+    except BaseException as e:
+        REPORT_GENERATIONS.inc(result=_GENERATION_RESULTS.get(type(e), 'error'))
+        raise
+    finally:
+        ACTIVE_GENERATIONS.dec()
+    REPORT_GENERATIONS.inc(result='ok')
+    return result
+
+
+async def _run_with_progress(message: Message, title: str, coro, progress_state: dict, *args):
     progress_state['stage'] = 'init'
     current_text = PROGRESS_STAGES.get('init', title)
     progress_message = await message.answer(current_text)
@@ -117,6 +111,8 @@ async def run_with_progress(message: Message, title: str, coro, progress_state:
     except httpx.HTTPStatusError as e:
         logger.error(f'Ошибка запроса: {e}')
         await progress_message.delete()
+        if e.response.status_code >= 500:
+            raise WBUnavailableError(f'HTTP error: {e.response.status_code}')
         raise InvalidTokenError(f'HTTP error: {e.response.status_code}')
     except (WBTimeoutError, InvalidTokenError, NoDataError):
         raise
@@ -125,78 +121,6 @@ async def run_with_progress(message: Message, title: str, coro, progress_state:
         raise e
 
 
-def get_weeks_range(count):
-    today = date.today()
-    previous_monday = today - timedelta(days=today.weekday()) - timedelta(days=7)
-    if today.weekday() == 0:
-        previous_monday -= timedelta(days=7)
-    weeks_range = []
-    for i in range(count):
-        week_start = previous_monday - timedelta(weeks=i)
-        week_end = week_start + timedelta(days=6)
-        weeks_range.append(f'{week_start.strftime("%d.%m.%Y")}-{week_end.strftime("%d.%m.%Y")}')
-
-    return weeks_range
-
-
-def get_quarters_range():
-    today = date.today()
-    current_year = today.year
-    current_quarter = (today.month - 1) // 3 + 1
-    quarters_month = {
-        0: 'янв-мар',
-        1: 'апр-июн',
-        2: 'июл-сен',
-        3: 'окт-дек'
-    }
-
-    quarters = []
-    for year in range(2025, current_year + 1):
-        quarters_num = current_quarter if year == current_year else 4
-        for quarter in range(quarters_num):
-            quarters.append([f'{year}_{quarter}', f'{quarters_month[quarter]} {year}'])
-
-    return quarters
-
-
-def get_quarters_weeks(year: int, quarter: int):
-    today = date.today()
-    start_month = quarter * 3 + 1
-    first_day = date(year, start_month, 1)
-    start_date = first_day + timedelta(days=7) - timedelta(days=first_day.weekday())
-
-    if start_month == 10:  # Q4
-        last_day = date(year, 12, 31)
-    else:
-        last_day = date(year, start_month + 3, 1) - timedelta(days=1)
-
-    if last_day < today:
-        end_date = last_day - timedelta(days=last_day.weekday())
-    else:
-        end_date = today - timedelta(days=today.weekday()) - timedelta(days=7)
-        if today.weekday() == 0:
-            end_date -= timedelta(days=7)
-    weeks_range = []
-    current_monday = start_date
-    while current_monday <= end_date:
-        current_sunday = current_monday + timedelta(days=6)
-        weeks_range.append(f'{current_monday.strftime("%d.%m.%Y")}-{current_sunday.strftime("%d.%m.%Y")}')
-        current_monday += timedelta(weeks=1)
-
-    return weeks_range
-
-
-async def orm_add_report(session: AsyncSession, tg_id: int, date_of_week: date, report_path: str, store_id: int):
-    obj = Report(
-        tg_id=tg_id,
-        date_of_week=date_of_week,
-        report_path=report_path,
-        store_id=store_id,
-    )
-    session.add(obj)
-    await session.commit()
-
-
 def get_dates_from_str(dates):
     """transform dates DD.MM.YYYY-DD.MM.YYYY to YYYY-MM-DD, YYYY-MM-DD"""
     dates = dates.split('-')
@@ -228,7 +152,7 @@ def create_empty_adv_report() -> pd.DataFrame:
 
 async def fetch_product_cards_mapping(token: str) -> Dict:
     logger.info("Загрузка маппинга карточек товара...")
-    url = "https://content-api.wildberries.ru/content/v2/get/cards/list"
+    url = f"{CONTENT_API_URL}/content/v2/get/cards/list"
     headers = {"Authorization": token, "Content-Type": "application/json"}
 
     LIMIT = 100          # не увеличиваем
@@ -246,7 +170,7 @@ async def fetch_product_cards_mapping(token: str) -> Dict:
 
     while True:
         for attempt in range(MAX_RETRIES):
-            resp = await ASYNC_CLIENT.post(url, headers=headers, json=payload)
+            resp = await wb_request("POST", url, headers=headers, json=payload)
 
             if resp.status_code == 429:
                 retry_after = resp.headers.get("X-Ratelimit-Retry")
@@ -293,12 +217,13 @@ async def fetch_product_cards_mapping(token: str) -> Dict:
 
 async def fetch_sales_records_async(date_from: str, date_to: str, token: str) -> list[dict]:
     logger.info("Начинаем загрузку отчёта по продажам с %s по %s", date_from, date_to)
-    url = "https://statistics-api.wildberries.ru/api/v5/supplier/reportDetailByPeriod"
+    url = f"{STATISTICS_API_URL}/api/v5/supplier/reportDetailByPeriod"
     headers = {"Authorization": token, "Content-Type": "application/json"}
     records, rrdid = [], 0
 
     while True:
-        resp = await ASYNC_CLIENT.get(
+        resp = await wb_request(
+            "GET",
             url,
             headers=headers,
             params={"dateFrom": date_from, "dateTo": date_to, "rrdid": rrdid, "limit": 100000}
@@ -442,10 +367,10 @@ async def transform_sales_records(df: pd.DataFrame) -> tuple[pd.DataFrame, pd.Da
 
 async def get_storage_report(date_from: str, date_to: str, token: str) -> pd.DataFrame:
     logger.info("Запрос отчёта по платному хранению... %s – %s", date_from, date_to)
-    base, headers = "https://seller-analytics-api.wildberries.ru/api/v1/paid_storage", {"Authorization":f"Bearer {token}"}
+    base, headers = f"{ANALYTICS_API_URL}/api/v1/paid_storage", {"Authorization":f"Bearer {token}"}
     # create
     for backoff in [5,10,20,40,80]:
-        resp = await ASYNC_CLIENT.get(base, headers=headers, params={"dateFrom": date_from, "dateTo": date_to})
+        resp = await wb_request("GET", base, headers=headers, params={"dateFrom": date_from, "dateTo": date_to})
         if resp.status_code != 429:
             resp.raise_for_status()
             break
@@ -456,7 +381,7 @@ async def get_storage_report(date_from: str, date_to: str, token: str) -> pd.Dat
     status_url = f"{base}/tasks/{task}/status"
     # poll
     while True:
-        st = await ASYNC_CLIENT.get(status_url, headers=headers)
+        st = await wb_request("GET", status_url, headers=headers)
         if st.status_code == 429:
             await asyncio.sleep(5)
             continue
@@ -467,7 +392,7 @@ async def get_storage_report(date_from: str, date_to: str, token: str) -> pd.Dat
     # download
     dl_url = f"{base}/tasks/{task}/download"
     for backoff in [5,10,20,40,80]:
-        dl = await ASYNC_CLIENT.get(dl_url, headers=headers)
+        dl = await wb_request("GET", dl_url, headers=headers)
         if dl.status_code != 429:
             dl.raise_for_status()
             data = dl.json()
@@ -503,11 +428,11 @@ async def get_storage_report(date_from: str, date_to: str, token: str) -> pd.Dat
 
 async def get_acceptance_report(date_from: str, date_to: str, token: str) -> pd.DataFrame:
     logger.info("Запрос отчёта по платной приёмке... %s – %s", date_from, date_to)
-    base, headers = "https://seller-analytics-api.wildberries.ru/api/v1/acceptance_report", {"Authorization":token}
+    base, headers = f"{ANALYTICS_API_URL}/api/v1/acceptance_report", {"Authorization":token}
     date_from, date_to = change_str_dates(date_from, date_to, -1)
     # create
     for backoff in [5,10,20,40,80]:
-        resp = await ASYNC_CLIENT.get(base, headers=headers, params={"dateFrom": date_from, "dateTo": date_to})
+        resp = await wb_request("GET", base, headers=headers, params={"dateFrom": date_from, "dateTo": date_to})
         if resp.status_code != 429:
             resp.raise_for_status()
             break
@@ -518,11 +443,11 @@ async def get_acceptance_report(date_from: str, date_to: str, token: str) -> pd.
     status_url = f"{base}/tasks/{task}/status"
     while True:
         await asyncio.sleep(5)
-        st = await ASYNC_CLIENT.get(status_url, headers=headers)
+        st = await wb_request("GET", status_url, headers=headers)
         st.raise_for_status()
         if st.json()["data"]["status"].lower()=="done":
             break
-    dl = await ASYNC_CLIENT.get(f"{base}/tasks/{task}/download", headers=headers)
+    dl = await wb_request("GET", f"{base}/tasks/{task}/download", headers=headers)
     dl.raise_for_status()
     data = dl.json()
     if not isinstance(data,list) or not data:
@@ -556,8 +481,9 @@ def get_ad_expenses_report(token: str, doc_number: str, period_end: str) -> pd.D
     headers = {"Authorization": token}
 
     # Запрос списка рекламных документов
-    upd_list = SYNC_CLIENT.get(
-        f"https://advert-api.wildberries.ru/adv/v1/upd?from={fr}&to={to}",
+    upd_list = wb_request_sync(
+        "GET",
+        f"{ADVERT_API_URL}/adv/v1/upd?from={fr}&to={to}",
         headers=headers
     )
     upd_list.raise_for_status()
@@ -582,8 +508,9 @@ def get_ad_expenses_report(token: str, doc_number: str, period_end: str) -> pd.D
         ])
 
     # Запрос детальной статистики
-    full = SYNC_CLIENT.post(
-        "https://advert-api.wildberries.ru/adv/v2/fullstats",
+    full = wb_request_sync(
+        "POST",
+        f"{ADVERT_API_URL}/adv/v2/fullstats",
         headers={**headers, "Content-Type": "application/json"},
         content=json.dumps(payload)
     )
@@ -630,51 +557,15 @@ def get_ad_expenses_report(token: str, doc_number: str, period_end: str) -> pd.D
     return df_adv
 
 
-# ------------------ Генерация отчёта ------------------
+# ------------------ Обработка данных ------------------
 
-async def generate_report_with_params(progress_state: dict, dates: str, doc_number: str, store_token: str, store_name: str, tg_id: int, store_id: int) -> str:
+def classify_deductions(df_raw: pd.DataFrame) -> tuple[pd.DataFrame, float]:
     """
-    Generate report with progress tracking.
+    Разбор удержаний из сырого отчёта продаж.
 
-    Args:
-        progress_state: Dict for updating progress stage (shared with run_with_progress)
-        dates: Period in format "DD.MM.YYYY-DD.MM.YYYY"
-        doc_number: WB document number(s)
-        store_token: WB API token
-        store_name: Store name for report header
-        tg_id: Telegram user ID
-        store_id: Store ID in database
+    Returns: (reviews_agg, total_other) - списания за отзывы по артикулам
+    и сумма прочих удержаний (делится поровну между артикулами)
     """
-    logger.info("Старт отчёта для %s: %s", store_name, dates)
-    start_date, end_date = get_dates_from_str(dates)
-
-    # Stage 1: Fetch sales data (the longest operation)
-    progress_state['stage'] = 'fetch_sales'
-    sales_task = fetch_sales_records_async(f"{start_date}T00:00:00", f"{end_date}T23:59:59", store_token)
-
-    # Stage 2: Fetch ads data
-    progress_state['stage'] = 'fetch_ads'
-    advert_task = asyncio.to_thread(get_ad_expenses_report, store_token, doc_number, end_date)
-
-    # Stage 3: Fetch product cards
-    progress_state['stage'] = 'fetch_cards'
-    cards_task = fetch_product_cards_mapping(store_token)
-
-    # Stage 4: Fetch storage report (paid_storage API - storage_fee не входит в reportDetailByPeriod)
-    progress_state['stage'] = 'fetch_storage'
-    storage_task = get_storage_report(start_date, end_date, store_token)
-
-    # Run all fetches in parallel
-    raw_records, adv_df, cards, storage_df = await asyncio.gather(
-        sales_task, advert_task, cards_task, storage_task
-    )
-
-    # Stage 5: Process data
-    progress_state['stage'] = 'process'
-    df_raw = pd.DataFrame(raw_records)
-    sales_df, _ = await transform_sales_records(df_raw)
-
-    # отзывы и прочее
     reviews_agg=pd.DataFrame(columns=["Артикул WB","Списание за отзывы"])
     total_other=0.0
     if "deduction" in df_raw.columns and "bonus_type_name" in df_raw.columns:
@@ -701,8 +592,26 @@ async def generate_report_with_params(progress_state: dict, dates: str, doc_numb
             "additional_payment"
         ].sum()
         total_other += total_additional_payment
-
-    # объединяем
+    return reviews_agg, total_other
+
+
+FINAL_COLUMNS = [
+    "Артикул WB","Артикул поставщика","Кол-во продаж","Общая выручка",
+    "К Перечислению","Логистика, шт","Логистика, руб","Штрафы","Доплаты",
+    "Возвраты","Хранение","ВБ.Продвижение","Подписка «Джем»",
+    "Приемка","Утилизация","Списание за отзывы","Прочие удержания","Баллы программы лояльности"
+]
+
+
+def merge_report_frames(
+    sales_df: pd.DataFrame,
+    storage_df: pd.DataFrame,
+    adv_df: pd.DataFrame,
+    reviews_agg: pd.DataFrame,
+    cards: Dict,
+    total_other: float,
+) -> pd.DataFrame:
+    """Объединение продаж, хранения, рекламы и удержаний в итоговую таблицу."""
     for df,col in [(sales_df,"Артикул WB"),(storage_df,"nmId"),(adv_df,"Артикул WB")]:
         df[col]=df[col].astype(str).str.upper()
 
@@ -741,13 +650,7 @@ async def generate_report_with_params(progress_state: dict, dates: str, doc_numb
         "cashback_amount":"Баллы программы лояльности"
     },inplace=True)
 
-    final_cols=[
-        "Артикул WB","Артикул поставщика","Кол-во продаж","Общая выручка",
-        "К Перечислению","Логистика, шт","Логистика, руб","Штрафы","Доплаты",
-        "Возвраты","Хранение","ВБ.Продвижение","Подписка «Джем»",
-        "Приемка","Утилизация","Списание за отзывы","Прочие удержания","Баллы программы лояльности"
-    ]
-    final_df=merged[final_cols]
+    final_df=merged[FINAL_COLUMNS].copy()
 
     # Добавляем столбец "На расчетный счет"
     final_df["На расчетный счет"] = (
@@ -765,16 +668,13 @@ async def generate_report_with_params(progress_state: dict, dates: str, doc_numb
         - final_df["Прочие удержания"]
         - final_df["Баллы программы лояльности"]
     )
+    return final_df
 
-    # Stage 5: Create Excel file
-    progress_state['stage'] = 'create_excel'
 
+def write_report_excel(final_df: pd.DataFrame, path: Path, store_name: str, start_date: str, end_date: str):
+    """Запись итоговой таблицы в Excel с шапкой, форматированием и строкой итогов."""
     yellow=PatternFill(fill_type="solid",start_color="FFFF00",end_color="FFFF00")
 
-    output_folder = Path(os.getenv('DATA_ROOT')) / 'reports' / str(tg_id) / str(store_id)
-    output_folder.mkdir(parents=True, exist_ok=True)
-    path = output_folder / f'report{start_date}.xlsx'
-
     with pd.ExcelWriter(path,engine="openpyxl") as writer:
         final_df.to_excel(writer,index=False,startrow=2)
         ws=writer.sheets["Sheet1"]
@@ -787,10 +687,78 @@ async def generate_report_with_params(progress_state: dict, dates: str, doc_numb
             ws.column_dimensions[col[0].column_letter].width=length+2
         summary=ws.max_row+1
         ws.cell(row=summary,column=1,value="Итого").font=Font(bold=True)
-        for idx in range(3,len(final_cols)+2):
+        for idx in range(3,len(FINAL_COLUMNS)+2):
             letter=get_column_letter(idx)
             c=ws.cell(row=summary,column=idx,value=f"=SUM({letter}4:{letter}{summary-1})")
             c.font=Font(color="FF0000"); c.fill=yellow
 
+
+# ------------------ Генерация отчёта ------------------
+
+async def _timed_stage(stage: str, awaitable):
+    """Await с записью длительности стадии в метрики."""
+    with REPORT_STAGE_SECONDS.time(stage=stage):
+        return await awaitable
+
+
+async def generate_report_with_params(progress_state: dict, dates: str, doc_number: str, store_token: str, store_name: str, tg_id: int, store_id: int) -> str:
+    """
+    Generate report with progress tracking.
+
+    Args:
+        progress_state: Dict for updating progress stage (shared with run_with_progress)
+        dates: Period in format "DD.MM.YYYY-DD.MM.YYYY"
+        doc_number: WB document number(s)
+        store_token: WB API token
+        store_name: Store name for report header
+        tg_id: Telegram user ID
+        store_id: Store ID in database
+    """
+    logger.info("Старт отчёта для %s: %s", store_name, dates)
+    start_date, end_date = get_dates_from_str(dates)
+
+    # Stage 1: Fetch sales data (the longest operation)
+    progress_state['stage'] = 'fetch_sales'
+    sales_task = _timed_stage('fetch_sales', fetch_sales_records_async(f"{start_date}T00:00:00", f"{end_date}T23:59:59", store_token))
+
+    # Stage 2: Fetch ads data
+    progress_state['stage'] = 'fetch_ads'
+    advert_task = _timed_stage('fetch_ads', asyncio.to_thread(get_ad_expenses_report, store_token, doc_number, end_date))
+
+    # Stage 3: Fetch product cards
+    progress_state['stage'] = 'fetch_cards'
+    cards_task = _timed_stage('fetch_cards', fetch_product_cards_mapping(store_token))
+
+    # Stage 4: Fetch storage report (paid_storage API - storage_fee не входит в reportDetailByPeriod)
+    progress_state['stage'] = 'fetch_storage'
+    storage_task = _timed_stage('fetch_storage', get_storage_report(start_date, end_date, store_token))
+
+    # Run all fetches in parallel
+    raw_records, adv_df, cards, storage_df = await asyncio.gather(
+        sales_task, advert_task, cards_task, storage_task
+    )
+
+    # Stage 5: Process data
+    progress_state['stage'] = 'process'
+    with REPORT_STAGE_SECONDS.time(stage='process'):
+        df_raw = pd.DataFrame(raw_records)
+        sales_df, _ = await transform_sales_records(df_raw)
+
+        # отзывы и прочее
+        reviews_agg, total_other = classify_deductions(df_raw)
+
+        # объединяем
+        final_df = merge_report_frames(sales_df, storage_df, adv_df, reviews_agg, cards, total_other)
+
+    # Stage 5: Create Excel file
+    progress_state['stage'] = 'create_excel'
+
+    output_folder = Path(os.getenv('DATA_ROOT')) / 'reports' / str(tg_id) / str(store_id)
+    output_folder.mkdir(parents=True, exist_ok=True)
+    path = output_folder / f'report{start_date}.xlsx'
+
+    with REPORT_STAGE_SECONDS.time(stage='create_excel'):
+        write_report_excel(final_df, path, store_name, start_date, end_date)
+
     logger.info(f'Итоговый отчёт сохранён в "{path}"')
-    return str(path)
\ No newline at end of file
+    return str(path)
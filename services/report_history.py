@@ -0,0 +1,80 @@
+"""
+История отчётов пользователя.
+
+Список отчётов магазина листается keyset-пагинацией: страница — это
+отчёты с (date_of_week, id) меньше курсора, от новых к старым. Запрос
+идёт по индексу idx_report_history (tg_id, store_id, date_of_week, id)
+и не зависит от номера страницы, в отличие от OFFSET.
+
+Повторная отправка не запускает генерацию: документ отправляется по
+сохранённому Telegram file_id, а если его нет — с диска (file_id после
+отправки запоминается).
+"""
+
+from datetime import date
+from typing import Optional
+
+from sqlalchemy import select, update, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database.models import Report
+
+
+# Отчётов на одной странице истории
+HISTORY_PAGE_SIZE = 8
+
+
+async def orm_get_report_history(
+    session: AsyncSession,
+    tg_id: int,
+    store_id: int,
+    before: Optional[tuple[date, int]] = None,
+    limit: int = HISTORY_PAGE_SIZE,
+) -> tuple[list[Report], bool]:
+    """
+    Страница истории отчётов магазина, от новых к старым.
+
+    Args:
+        before: Курсор (date_of_week, id) последнего отчёта предыдущей страницы
+
+    Returns:
+        (отчёты, есть ли ещё более старые)
+    """
+    query = (
+        select(Report)
+        .where(Report.tg_id == tg_id, Report.store_id == store_id)
+        .order_by(Report.date_of_week.desc(), Report.id.desc())
+        .limit(limit + 1)
+    )
+    if before is not None:
+        query = query.where(tuple_(Report.date_of_week, Report.id) < tuple_(*before))
+
+    result = await session.execute(query)
+    reports = list(result.scalars().all())
+    return reports[:limit], len(reports) > limit
+
+
+async def orm_get_user_report(session: AsyncSession, report_id: int, tg_id: int) -> Optional[Report]:
+    """Отчёт, только если он принадлежит пользователю."""
+    query = select(Report).where(Report.id == report_id, Report.tg_id == tg_id)
+    result = await session.execute(query)
+    return result.scalar_one_or_none()
+
+
+async def orm_set_report_file_id(session: AsyncSession, report_id: int, file_id: Optional[str]):
+    query = update(Report).where(Report.id == report_id).values(file_id=file_id)
+    await session.execute(query)
+    await session.commit()
+
+
+async def orm_add_report(session: AsyncSession, tg_id: int, date_of_week: date, report_path: str, store_id: int,
+                         file_id: Optional[str] = None):
+    obj = Report(
+        tg_id=tg_id,
+        date_of_week=date_of_week,
+        report_path=report_path,
+        store_id=store_id,
+        file_id=file_id,
+    )
+    session.add(obj)
+    await session.commit()
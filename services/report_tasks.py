@@ -0,0 +1,92 @@
+"""
+Генерация отчётов в фоновых задачах.
+
+Генерация идёт минутами (опрос платного хранения, повторы на 429), поэтому
+хендлер подтверждения только резервирует генерацию и запускает задачу, а
+апдейт завершается сразу: генерация не держит ни очередь апдейтов
+пользователя, ни общий слот обработки (UserSerialMiddleware,
+UpdateDispatcher), и бот отвечает пользователю, пока отчёт формируется.
+
+    - у пользователя одновременно выполняется одна генерация;
+    - всего выполняется не больше REPORT_CONCURRENCY генераций (slot()),
+      остальные ждут своей очереди внутри задачи;
+    - при остановке бота генерации отменяются (зарезервированные
+      генерации возвращаются в обработчике отмены).
+
+Настройки (переменные окружения):
+    REPORT_CONCURRENCY — сколько отчётов формируется одновременно (16)
+"""
+
+import asyncio
+import os
+from contextlib import asynccontextmanager
+from typing import Awaitable, Dict
+
+from services.logging import logger
+from services.metrics import QUEUE_DEPTH
+
+
+REPORT_CONCURRENCY = int(os.getenv('REPORT_CONCURRENCY') or '16')
+
+
+class ReportTasks:
+    """Фоновые генерации отчётов: одна на пользователя, не больше concurrency всего."""
+
+    def __init__(self, concurrency: int = REPORT_CONCURRENCY):
+        self.concurrency = concurrency
+        self._slots = asyncio.Semaphore(concurrency)
+        self._tasks: Dict[int, asyncio.Task] = {}
+        self._waiting = 0
+
+    def is_running(self, tg_id: int) -> bool:
+        return tg_id in self._tasks
+
+    @property
+    def full(self) -> bool:
+        """Все слоты заняты: новая генерация подождёт."""
+        return self._slots.locked()
+
+    def start(self, tg_id: int, coro: Awaitable) -> asyncio.Task:
+        """Запустить генерацию пользователя (вызывающий проверяет is_running)."""
+        task = asyncio.create_task(coro, name=f'report-{tg_id}')
+        self._tasks[tg_id] = task
+        task.add_done_callback(lambda t: self._done(tg_id, t))
+        return task
+
+    @asynccontextmanager
+    async def slot(self):
+        """
+        Слот генерации. Берётся внутри задачи, под её try/finally: отмена
+        во время ожидания слота тоже доходит до обработчика отмены.
+        """
+        self._set_waiting(self._waiting + 1)
+        try:
+            await self._slots.acquire()
+        finally:
+            self._set_waiting(self._waiting - 1)
+        try:
+            yield
+        finally:
+            self._slots.release()
+
+    async def stop(self):
+        """Отменить выполняющиеся генерации и дождаться их обработчиков отмены."""
+        tasks = list(self._tasks.values())
+        if tasks:
+            logger.warning(f"Остановка бота: отменяю генерации отчётов ({len(tasks)})")
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def _done(self, tg_id: int, task: asyncio.Task):
+        if self._tasks.get(tg_id) is task:
+            del self._tasks[tg_id]
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"Генерация отчёта для {tg_id} завершилась с ошибкой: {task.exception()}")
+
+    def _set_waiting(self, value: int):
+        self._waiting = value
+        QUEUE_DEPTH.set(value, queue='report_generations')
+
+
+report_tasks = ReportTasks()
@@ -0,0 +1,205 @@
+"""
+Ограничение частоты исходящих сообщений в Telegram.
+
+Request middleware сессии бота: все вызовы bot.send_message,
+message.answer, edit_text, answer_document и т.д. проходят через него,
+менять места вызова не нужно.
+
+    - глобальный лимит TG_GLOBAL_RATE сообщений/сек на бота и лимит
+      TG_CHAT_RATE сообщений/сек на чат (с запасом TG_CHAT_BURST);
+    - приоритеты: ответы пользователю (send*) идут раньше правок
+      сообщений (прогресс генерации — edit*), а массовые рассылки
+      (with send_priority(BULK)) — только когда других нет;
+    - на 429 (TelegramRetryAfter) чат (или весь бот, если ошибка не по
+      чату) ставится на паузу retry_after секунд и запрос повторяется до
+      TG_MAX_RETRIES раз.
+
+Лимитируются только методы, отправляющие или меняющие сообщения
+(Send*, Edit*, Copy*, Forward*). getUpdates, answerCallbackQuery,
+getChatMember и прочие идут без очереди.
+"""
+
+import asyncio
+import heapq
+import itertools
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Optional
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import TelegramMethod
+from aiogram.methods.base import Response, TelegramType
+
+from services.logging import logger
+from services.metrics import QUEUE_DEPTH, counter, histogram
+
+
+TG_GLOBAL_RATE = float(os.getenv('TG_GLOBAL_RATE') or '25')
+TG_CHAT_RATE = float(os.getenv('TG_CHAT_RATE') or '1')
+TG_CHAT_BURST = int(os.getenv('TG_CHAT_BURST') or '3')
+TG_MAX_RETRIES = int(os.getenv('TG_MAX_RETRIES') or '3')
+
+# Приоритеты: меньше — раньше
+HIGH = 0   # ответы и уведомления пользователю
+LOW = 1    # правки сообщений (прогресс генерации)
+BULK = 2   # рассылки
+
+_PRIORITY_NAMES = {HIGH: 'high', LOW: 'low', BULK: 'bulk'}
+_LIMITED_PREFIXES = ('Send', 'Edit', 'Copy', 'Forward')
+
+_send_priority: ContextVar[Optional[int]] = ContextVar('send_priority', default=None)
+
+
+@contextmanager
+def send_priority(priority: int):
+    """Приоритет всех отправок внутри блока (например, BULK для рассылки)."""
+    token = _send_priority.set(priority)
+    try:
+        yield
+    finally:
+        _send_priority.reset(token)
+
+
+TELEGRAM_SEND_WAIT_SECONDS = histogram(
+    'paganini_telegram_send_wait_seconds',
+    'Time an outgoing Telegram request waited for the rate limiter',
+    ['priority'],
+)
+TELEGRAM_RETRY_AFTER = counter(
+    'paganini_telegram_retry_after_total',
+    'Telegram 429 Too Many Requests responses by method',
+    ['method'],
+)
+
+
+class _Bucket:
+    """Token bucket: rate токенов в секунду, не больше burst."""
+
+    __slots__ = ('rate', 'burst', 'tokens', 'updated', 'paused_until')
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self) -> float:
+        """Через сколько секунд будет доступен токен (0 — сейчас)."""
+        now = time.monotonic()
+        self._refill(now)
+        if now < self.paused_until:
+            return self.paused_until - now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+    def pause(self, seconds: float):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 0
+
+
+class TelegramRateLimiter(BaseRequestMiddleware):
+    """Request middleware: bot.session.middleware(TelegramRateLimiter())."""
+
+    # Сколько чатов держать, прежде чем удалять давно неактивные
+    MAX_CHATS = 10_000
+
+    def __init__(self, global_rate: float = TG_GLOBAL_RATE, chat_rate: float = TG_CHAT_RATE,
+                 chat_burst: int = TG_CHAT_BURST, max_retries: int = TG_MAX_RETRIES):
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self._global = _Bucket(global_rate, global_rate)
+        self._chats: Dict[int, _Bucket] = {}
+        # Очередь к глобальному лимиту: (приоритет, номер, future)
+        self._waiters: list = []
+        self._seq = itertools.count()
+        self._pump: Optional[asyncio.Task] = None
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot,
+        method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        name = type(method).__name__
+        if not name.startswith(_LIMITED_PREFIXES):
+            return await make_request(bot, method)
+
+        priority = _send_priority.get()
+        if priority is None:
+            priority = LOW if name.startswith('Edit') or name == 'SendChatAction' else HIGH
+        chat_id = getattr(method, 'chat_id', None)
+
+        for attempt in range(self.max_retries + 1):
+            started = time.monotonic()
+            await self._acquire(chat_id, priority)
+            TELEGRAM_SEND_WAIT_SECONDS.observe(time.monotonic() - started, priority=_PRIORITY_NAMES[priority])
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                TELEGRAM_RETRY_AFTER.inc(method=name)
+                if attempt == self.max_retries:
+                    raise
+                logger.warning(f"Telegram 429 на {name} (чат {chat_id}): пауза {e.retry_after} с")
+                # Следующие запросы в этот чат (или все, если ошибка не по чату) ждут паузу
+                bucket = self._chat_bucket(chat_id) if chat_id is not None else self._global
+                bucket.pause(e.retry_after)
+
+    async def _acquire(self, chat_id, priority: int):
+        # Сначала лимит чата: ожидание своего чата не занимает место в общей очереди
+        if chat_id is not None:
+            bucket = self._chat_bucket(chat_id)
+            while (delay := bucket.delay()) > 0:
+                await asyncio.sleep(delay)
+            bucket.take()
+
+        if not self._waiters and self._global.delay() == 0:
+            self._global.take()
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), future))
+        QUEUE_DEPTH.set(len(self._waiters), queue='telegram_send')
+        if self._pump is None or self._pump.done():
+            self._pump = asyncio.create_task(self._run_pump())
+        await future
+
+    async def _run_pump(self):
+        """Выдаёт токены глобального лимита ожидающим в порядке приоритета."""
+        while self._waiters:
+            delay = self._global.delay()
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+            _, _, future = heapq.heappop(self._waiters)
+            QUEUE_DEPTH.set(len(self._waiters), queue='telegram_send')
+            if future.done():
+                # Запрос отменили, пока он ждал
+                continue
+            self._global.take()
+            future.set_result(None)
+
+    def _chat_bucket(self, chat_id) -> _Bucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= self.MAX_CHATS:
+                self._prune()
+            bucket = self._chats[chat_id] = _Bucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    def _prune(self):
+        """Удалить чаты, у которых лимит давно восстановился."""
+        now = time.monotonic()
+        idle = self.chat_burst / self.chat_rate
+        for chat_id in [c for c, b in self._chats.items() if now - b.updated > idle and now > b.paused_until]:
+            del self._chats[chat_id]
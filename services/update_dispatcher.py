@@ -0,0 +1,133 @@
+"""
+Обработка апдейтов Telegram в webhook-режиме.
+
+Webhook-обработчик только кладёт апдейт в очередь и сразу отвечает 200,
+а обрабатывают апдейты воркеры пула:
+
+    - у каждого пользователя свой почтовый ящик (mailbox): его апдейты
+      выполняются строго по одному и по порядку, поэтому переходы FSM
+      не гоняются друг с другом;
+    - апдейты разных пользователей выполняются параллельно, не больше
+      UPDATE_WORKERS одновременно;
+    - очередь ограничена UPDATE_QUEUE_SIZE: при переполнении submit()
+      возвращает False, webhook отвечает 503 и Telegram повторит доставку.
+
+Пользователь стоит в очереди «готовых» не больше одного раза: воркер
+берёт из его ящика один апдейт и, если там есть ещё, ставит
+пользователя в конец очереди — долгий апдейт одного пользователя не
+задерживает остальных.
+
+В webhook-режиме это единственный слой порядка и параллелизма:
+UserSerialMiddleware (polling) не регистрируется. Долгая работа
+(генерация отчёта) выполняется фоновой задачей и воркер не занимает.
+"""
+
+import asyncio
+import os
+import time
+from collections import deque
+from typing import Any, Deque, Dict
+
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+from aiogram.types.update import UpdateTypeLookupError
+
+from services.logging import logger
+from services.metrics import ACTIVE_UPDATES, QUEUE_DEPTH, UPDATE_QUEUE_WAIT_SECONDS
+
+
+UPDATE_WORKERS = int(os.getenv('UPDATE_WORKERS') or '32')
+UPDATE_QUEUE_SIZE = int(os.getenv('UPDATE_QUEUE_SIZE') or '1000')
+
+
+def update_key(update: Update) -> Any:
+    """Ключ почтового ящика: пользователь, иначе чат, иначе сам апдейт."""
+    try:
+        event = update.event
+    except UpdateTypeLookupError:
+        # Тип апдейта, которого aiogram не знает: иначе webhook ответит 500,
+        # и Telegram будет повторять доставку бесконечно
+        return f'update:{update.update_id}'
+    user = getattr(event, 'from_user', None)
+    if user is not None:
+        return user.id
+    chat = getattr(event, 'chat', None)
+    if chat is not None:
+        return f'chat:{chat.id}'
+    return f'update:{update.update_id}'
+
+
+class UpdateDispatcher:
+    """Очередь апдейтов с почтовыми ящиками по пользователям и пулом воркеров."""
+
+    def __init__(self, dp: Dispatcher, bot: Bot, workers: int = UPDATE_WORKERS,
+                 queue_size: int = UPDATE_QUEUE_SIZE):
+        self.dp = dp
+        self.bot = bot
+        self.workers = workers
+        self.queue_size = queue_size
+        # key -> апдейты пользователя с временем приёма
+        self._mailboxes: Dict[Any, Deque[tuple[Update, float]]] = {}
+        self._ready: asyncio.Queue = asyncio.Queue()
+        self._pending = 0
+        self._tasks: list[asyncio.Task] = []
+
+    @property
+    def pending(self) -> int:
+        """Апдейты, принятые и ещё не обработанные."""
+        return self._pending
+
+    def start(self):
+        self._tasks = [asyncio.create_task(self._worker(), name=f'update-worker-{i}') for i in range(self.workers)]
+        logger.info(f"Обработка апдейтов: {self.workers} воркеров, очередь до {self.queue_size}")
+
+    async def stop(self, timeout: float = 10):
+        """Дождаться обработки принятых апдейтов (не дольше timeout) и остановить воркеры."""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while self._pending and loop.time() < deadline:
+            await asyncio.sleep(0.1)
+        if self._pending:
+            logger.warning(f"Обработка апдейтов остановлена, не обработано: {self._pending}")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def submit(self, update: Update) -> bool:
+        """Принять апдейт. False — очередь заполнена."""
+        if self._pending >= self.queue_size:
+            return False
+
+        key = update_key(update)
+        mailbox = self._mailboxes.get(key)
+        if mailbox is None:
+            # Ящика нет — пользователь не в очереди и не обрабатывается
+            mailbox = self._mailboxes[key] = deque()
+            self._ready.put_nowait(key)
+        mailbox.append((update, time.monotonic()))
+        self._set_pending(self._pending + 1)
+        return True
+
+    def _set_pending(self, value: int):
+        self._pending = value
+        QUEUE_DEPTH.set(value, queue='telegram_updates')
+
+    async def _worker(self):
+        while True:
+            key = await self._ready.get()
+            mailbox = self._mailboxes[key]
+            update, received_at = mailbox.popleft()
+            UPDATE_QUEUE_WAIT_SECONDS.observe(time.monotonic() - received_at)
+            try:
+                with ACTIVE_UPDATES.track_inprogress():
+                    await self.dp.feed_update(self.bot, update)
+            except Exception as e:
+                logger.error(f"Ошибка обработки апдейта {update.update_id}: {e}", exc_info=True)
+            finally:
+                self._set_pending(self._pending - 1)
+                if mailbox:
+                    self._ready.put_nowait(key)
+                else:
+                    del self._mailboxes[key]
+
@@ -0,0 +1,297 @@
+"""
+Кэш пользователей в памяти процесса (orm_get_user, orm_get_user_stores).
+
+orm_get_user вызывается почти на каждое нажатие кнопки, поэтому пользователь
+вместе с выбранным магазином кэшируется по tg_id. Там же по tg_id лежит
+список магазинов пользователя: экран управления магазинами и проверки
+владельца в колбэках магазинов (orm_get_owned_store) обходятся без БД.
+В кэше лежат неизменяемые снимки (CachedUser/CachedStore) с теми же
+атрибутами, что и у моделей: ORM-объект привязан к сессии одного апдейта
+и не должен переживать её.
+
+Инвалидация — write-through: orm_* функции, меняющие пользователя или
+его магазины, после commit вызывают user_cache.invalidate(tg_id) — она
+сбрасывает и пользователя, и его список магазинов. Снимок, прочитанный
+из БД до инвалидации, в кэш уже не попадёт (счётчик инвалидаций, см.
+UserCache.epoch).
+
+Несколько экземпляров бота: USER_CACHE_INVALIDATION=pg_notify рассылает
+инвалидации через PostgreSQL NOTIFY/LISTEN, каждый процесс слушает канал
+USER_CACHE_CHANNEL. Без него при нескольких экземплярах стоит держать
+USER_CACHE_TTL коротким или отключить кэш (USER_CACHE_SIZE=0).
+
+Настройки (переменные окружения):
+    USER_CACHE_SIZE          — сколько пользователей (и списков магазинов) держать (2048, 0 — выключен)
+    USER_CACHE_TTL           — время жизни записи в секундах (60)
+    USER_CACHE_INVALIDATION  — local | pg_notify (local)
+    USER_CACHE_CHANNEL       — канал NOTIFY (paganini_user_cache)
+"""
+
+import asyncio
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass, fields
+from typing import Iterable, Optional
+
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from services.logging import logger
+from services.metrics import counter, gauge
+
+
+USER_CACHE_SIZE = int(os.getenv('USER_CACHE_SIZE') or '2048')
+USER_CACHE_TTL = float(os.getenv('USER_CACHE_TTL') or '60')
+USER_CACHE_INVALIDATION = os.getenv('USER_CACHE_INVALIDATION') or 'local'
+USER_CACHE_CHANNEL = os.getenv('USER_CACHE_CHANNEL') or 'paganini_user_cache'
+
+
+@dataclass(frozen=True)
+class CachedStore:
+    """Снимок Store (токен остаётся зашифрованным, как в БД)."""
+    id: int
+    tg_id: int
+    name: str
+    token: str
+
+    @classmethod
+    def from_orm(cls, store) -> 'CachedStore':
+        return cls(id=store.id, tg_id=store.tg_id, name=store.name, token=store.token)
+
+
+@dataclass(frozen=True)
+class CachedUser:
+    """Снимок User вместе с выбранным магазином."""
+    id: int
+    tg_id: int
+    phone: int
+    email: Optional[str]
+    first_name: str
+    user_name: Optional[str]
+    role: str
+    generations_made: int
+    generations_left: int
+    bonus_total: int
+    bonus_left: int
+    selected_store_id: Optional[int]
+    selected_store: Optional[CachedStore]
+
+    @classmethod
+    def from_orm(cls, user) -> 'CachedUser':
+        store = user.selected_store
+        values = {f.name: getattr(user, f.name) for f in fields(cls) if f.name != 'selected_store'}
+        values['selected_store'] = CachedStore.from_orm(store) if store is not None else None
+        return cls(**values)
+
+
+USER_CACHE_REQUESTS = counter(
+    'paganini_user_cache_requests_total',
+    'orm_get_user lookups by cache result',
+    ['result'],
+)
+STORE_CACHE_REQUESTS = counter(
+    'paganini_store_cache_requests_total',
+    'orm_get_user_stores lookups by cache result',
+    ['result'],
+)
+
+
+class UserCache:
+    """LRU-кэш CachedUser и списков магазинов по tg_id с временем жизни записи."""
+
+    def __init__(self, maxsize: int = USER_CACHE_SIZE, ttl: float = USER_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict[int, tuple[CachedUser, float]] = OrderedDict()
+        self._store_lists: OrderedDict[int, tuple[tuple[CachedStore, ...], float]] = OrderedDict()
+        self._epoch = 0
+        self._lock = threading.Lock()
+        self._publisher: Optional['PgInvalidation'] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.maxsize > 0 and self.ttl > 0
+
+    @property
+    def epoch(self) -> int:
+        """Номер последней инвалидации: берётся до чтения из БД и передаётся в put()."""
+        return self._epoch
+
+    def get(self, tg_id: int) -> Optional[CachedUser]:
+        if not self.enabled:
+            return None
+        with self._lock:
+            item = self._data.get(tg_id)
+            if item is not None and item[1] < time.monotonic():
+                del self._data[tg_id]
+                item = None
+            if item is not None:
+                self._data.move_to_end(tg_id)
+        USER_CACHE_REQUESTS.inc(result='hit' if item is not None else 'miss')
+        return item[0] if item is not None else None
+
+    def put(self, user, epoch: int) -> CachedUser:
+        """
+        Положить снимок ORM-пользователя в кэш.
+
+        Если после чтения (epoch) была хоть одна инвалидация, снимок может
+        быть устаревшим — он возвращается, но не кэшируется.
+        """
+        cached = CachedUser.from_orm(user)
+        if not self.enabled:
+            return cached
+        with self._lock:
+            if epoch != self._epoch:
+                return cached
+            self._data.pop(cached.tg_id, None)
+            self._data[cached.tg_id] = (cached, time.monotonic() + self.ttl)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+        return cached
+
+    def get_stores(self, tg_id: int) -> Optional[tuple[CachedStore, ...]]:
+        if not self.enabled:
+            return None
+        with self._lock:
+            item = self._store_lists.get(tg_id)
+            if item is not None and item[1] < time.monotonic():
+                del self._store_lists[tg_id]
+                item = None
+            if item is not None:
+                self._store_lists.move_to_end(tg_id)
+        STORE_CACHE_REQUESTS.inc(result='hit' if item is not None else 'miss')
+        return item[0] if item is not None else None
+
+    def put_stores(self, tg_id: int, stores, epoch: int) -> tuple[CachedStore, ...]:
+        """Положить снимок списка магазинов пользователя (те же правила epoch, что у put)."""
+        cached = tuple(CachedStore.from_orm(store) for store in stores)
+        if not self.enabled:
+            return cached
+        with self._lock:
+            if epoch != self._epoch:
+                return cached
+            self._store_lists.pop(tg_id, None)
+            self._store_lists[tg_id] = (cached, time.monotonic() + self.ttl)
+            while len(self._store_lists) > self.maxsize:
+                self._store_lists.popitem(last=False)
+        return cached
+
+    def _drop(self, tg_id: int):
+        self._data.pop(tg_id, None)
+        self._store_lists.pop(tg_id, None)
+
+    def invalidate_local(self, tg_ids: Iterable[int]):
+        with self._lock:
+            self._epoch += 1
+            for tg_id in tg_ids:
+                self._drop(tg_id)
+
+    def invalidate(self, *tg_ids: int):
+        """Сбросить пользователей здесь и (pg_notify) в остальных процессах."""
+        tg_ids = [tg_id for tg_id in tg_ids if tg_id is not None]
+        if not tg_ids:
+            return
+        self.invalidate_local(tg_ids)
+        if self._publisher is not None:
+            self._publisher.publish(tg_ids)
+
+    def clear(self):
+        with self._lock:
+            self._epoch += 1
+            self._data.clear()
+            self._store_lists.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+user_cache = UserCache()
+
+USER_CACHE_ENTRIES = gauge(
+    'paganini_user_cache_entries',
+    'Users currently held in the in-process cache',
+    collect=lambda: {(): len(user_cache)},
+)
+
+
+class PgInvalidation:
+    """
+    Инвалидации между процессами через PostgreSQL NOTIFY/LISTEN.
+
+    Держит одно отдельное соединение asyncpg: на нём слушает канал и через
+    него же (по очереди, из одной задачи) отправляет pg_notify. Сообщение —
+    "<id процесса>:<tg_id>,<tg_id>"; свои сообщения процесс пропускает.
+    """
+
+    def __init__(self, cache: UserCache, channel: str = USER_CACHE_CHANNEL):
+        self.cache = cache
+        self.channel = channel
+        self.instance_id = uuid.uuid4().hex[:12]
+        self._queue: asyncio.Queue[list[int]] = asyncio.Queue()
+        self._conn = None
+        self._driver = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self, engine: AsyncEngine):
+        self._conn = await engine.connect()
+        raw = await self._conn.get_raw_connection()
+        self._driver = raw.driver_connection
+        await self._driver.add_listener(self.channel, self._on_notify)
+        self._task = asyncio.create_task(self._publish_loop())
+        self.cache._publisher = self
+        logger.info(f"Кэш пользователей: инвалидация через NOTIFY {self.channel}")
+
+    async def stop(self):
+        self.cache._publisher = None
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        if self._driver is not None:
+            try:
+                await self._driver.remove_listener(self.channel, self._on_notify)
+            except Exception:
+                pass
+        if self._conn is not None:
+            await self._conn.close()
+
+    def publish(self, tg_ids: list[int]):
+        self._queue.put_nowait(tg_ids)
+
+    async def _publish_loop(self):
+        while True:
+            tg_ids = await self._queue.get()
+            # Всё, что накопилось, — одним сообщением (лимит payload 8000 байт)
+            while not self._queue.empty() and len(tg_ids) < 500:
+                tg_ids.extend(self._queue.get_nowait())
+            payload = f"{self.instance_id}:{','.join(map(str, tg_ids))}"
+            try:
+                await self._driver.execute('SELECT pg_notify($1, $2)', self.channel, payload)
+            except Exception as e:
+                # Не дошло до других процессов: там запись доживёт до TTL
+                logger.error(f"Кэш пользователей: не удалось отправить NOTIFY: {e}")
+
+    def _on_notify(self, connection, pid, channel, payload: str):
+        instance_id, _, ids = payload.partition(':')
+        if instance_id == self.instance_id:
+            return
+        try:
+            self.cache.invalidate_local(int(tg_id) for tg_id in ids.split(',') if tg_id)
+        except ValueError:
+            logger.warning(f"Кэш пользователей: некорректный NOTIFY {payload!r}")
+
+
+async def start_cache_invalidation(engine: AsyncEngine) -> Optional[PgInvalidation]:
+    """Включить межпроцессную инвалидацию, если она настроена."""
+    if USER_CACHE_INVALIDATION != 'pg_notify' or not user_cache.enabled:
+        return None
+    if engine.dialect.name != 'postgresql':
+        logger.warning("USER_CACHE_INVALIDATION=pg_notify работает только с PostgreSQL — отключено")
+        return None
+    channel = PgInvalidation(user_cache)
+    await channel.start(engine)
+    return channel
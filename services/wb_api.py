@@ -0,0 +1,168 @@
+"""
+Запросы к WB API: адреса, HTTP-клиенты, circuit breaker и ошибки генерации.
+
+Модуль не зависит от pandas: его импортируют хендлеры (ошибки,
+ensure_wb_available) и main (close_http_clients), а тяжёлый
+services/report_generator.py загружается только при первой генерации.
+"""
+
+import os
+import threading
+import time
+from typing import Optional
+
+import httpx
+
+from services.circuit_breaker import CircuitOpenError, get_breaker
+from services.logging import logger
+from services.metrics import WB_REQUEST_SECONDS, WB_REQUESTS, WB_THROTTLED
+
+
+# ------------------ Custom Exceptions ------------------
+class ReportError(Exception):
+    """Base exception for report generation errors"""
+    pass
+
+
+class InvalidTokenError(ReportError):
+    """Token is invalid or lacks permissions"""
+    pass
+
+
+class WBTimeoutError(ReportError):
+    """WB API timeout"""
+    pass
+
+
+class NoDataError(ReportError):
+    """No data found for the period"""
+    pass
+
+
+class WBUnavailableError(ReportError):
+    """WB API is down (circuit breaker is open)"""
+
+    def __init__(self, message: str, retry_in: float = 0.0):
+        super().__init__(message)
+        self.retry_in = retry_in
+
+
+# ------------------ WB API base URLs ------------------
+# Переопределяются через окружение, чтобы гонять пайплайн против локального
+# стенда (benchmarks/wb_stub_server.py). WB_API_BASE_URL задаёт все сразу.
+_WB_API_BASE_URL = os.getenv('WB_API_BASE_URL', '').rstrip('/')
+STATISTICS_API_URL = (os.getenv('WB_STATISTICS_API_URL') or _WB_API_BASE_URL or "https://statistics-api.wildberries.ru").rstrip('/')
+CONTENT_API_URL = (os.getenv('WB_CONTENT_API_URL') or _WB_API_BASE_URL or "https://content-api.wildberries.ru").rstrip('/')
+ANALYTICS_API_URL = (os.getenv('WB_ANALYTICS_API_URL') or _WB_API_BASE_URL or "https://seller-analytics-api.wildberries.ru").rstrip('/')
+ADVERT_API_URL = (os.getenv('WB_ADVERT_API_URL') or _WB_API_BASE_URL or "https://advert-api.wildberries.ru").rstrip('/')
+
+
+# ------------------ HTTP‑clients ------------------
+# Создаются при первом запросе к WB: старт бота не ждёт SSL-контексты,
+# а процессы без генераций отчётов их не создают вовсе
+_sync_client: Optional[httpx.Client] = None
+_async_client: Optional[httpx.AsyncClient] = None
+_sync_client_lock = threading.Lock()
+
+
+def get_sync_client() -> httpx.Client:
+    global _sync_client
+    if _sync_client is None:
+        # Sync-клиент используется из потоков
+        with _sync_client_lock:
+            if _sync_client is None:
+                _sync_client = httpx.Client(timeout=120.0)
+    return _sync_client
+
+
+def get_async_client() -> httpx.AsyncClient:
+    global _async_client
+    if _async_client is None:
+        _async_client = httpx.AsyncClient(timeout=120.0)
+    return _async_client
+
+
+async def close_http_clients():
+    """Close HTTP clients on shutdown"""
+    global _sync_client, _async_client
+    if _sync_client is not None:
+        _sync_client.close()
+        _sync_client = None
+    if _async_client is not None:
+        await _async_client.aclose()
+        _async_client = None
+    logger.info("HTTP clients closed")
+
+
+# ------------------ WB requests (circuit breaker) ------------------
+def _breaker_before_request(url: str):
+    breaker = get_breaker(url)
+    try:
+        breaker.before_request()
+    except CircuitOpenError as e:
+        raise WBUnavailableError(f'{e.host} is unavailable', retry_in=e.retry_in) from e
+    return breaker
+
+
+def _breaker_record_response(breaker, resp: httpx.Response, started: float):
+    elapsed = time.monotonic() - started
+    WB_REQUEST_SECONDS.observe(elapsed, host=breaker.host)
+    WB_REQUESTS.inc(host=breaker.host, status=str(resp.status_code))
+    if resp.status_code == 429:
+        WB_THROTTLED.inc(host=breaker.host)
+
+    if resp.status_code >= 500:
+        breaker.record_failure(f'HTTP {resp.status_code}')
+    else:
+        # 429 и 4xx — хост жив, это не повод размыкать breaker
+        breaker.record_success(elapsed)
+
+
+def _breaker_record_error(breaker, error: Exception, started: float):
+    WB_REQUEST_SECONDS.observe(time.monotonic() - started, host=breaker.host)
+    WB_REQUESTS.inc(host=breaker.host, status='error')
+    breaker.record_failure(type(error).__name__)
+
+
+async def wb_request(method: str, url: str, **kwargs) -> httpx.Response:
+    """Async запрос к WB API через circuit breaker хоста."""
+    breaker = _breaker_before_request(url)
+    started = time.monotonic()
+    try:
+        resp = await get_async_client().request(method, url, **kwargs)
+    except httpx.TransportError as e:
+        _breaker_record_error(breaker, e, started)
+        raise
+    except BaseException:
+        breaker.release_probe()
+        raise
+    _breaker_record_response(breaker, resp, started)
+    return resp
+
+
+def wb_request_sync(method: str, url: str, **kwargs) -> httpx.Response:
+    """Sync запрос к WB API через circuit breaker хоста (для кода в потоках)."""
+    breaker = _breaker_before_request(url)
+    started = time.monotonic()
+    try:
+        resp = get_sync_client().request(method, url, **kwargs)
+    except httpx.TransportError as e:
+        _breaker_record_error(breaker, e, started)
+        raise
+    except BaseException:
+        breaker.release_probe()
+        raise
+    _breaker_record_response(breaker, resp, started)
+    return resp
+
+
+def ensure_wb_available():
+    """
+    Быстрая проверка перед стартом генерации.
+
+    Raises:
+        WBUnavailableError: statistics-api недоступно (breaker разомкнут)
+    """
+    breaker = get_breaker(STATISTICS_API_URL)
+    if breaker.is_open():
+        raise WBUnavailableError(f'{breaker.host} is unavailable', retry_in=breaker.retry_in())
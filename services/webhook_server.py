@@ -1,35 +1,94 @@
 """
 Webhook сервер для приёма уведомлений от Модуль Банка.
 
-Запускается параллельно с Telegram ботом.
+Запускается параллельно с Telegram ботом. В webhook-режиме бота
+(TELEGRAM_WEBHOOK_URL) на этом же сервере принимаются апдейты Telegram.
+
+Уведомления об оплате только сохраняются (services/payment_inbox.py),
+платёж обрабатывается в фоне — ответ Модуль Банку не ждёт БД и Telegram.
 """
 
+import hmac
 import os
 import logging
 from typing import Optional, Callable, Awaitable
 
 from aiohttp import web
+from aiogram.types import Update
 
 from services.modulbank import verify_signature, parse_callback_data, get_secret_key
 from services.logging import logger
+from services.metrics import render_metrics
+from services.update_dispatcher import UpdateDispatcher
 
 
-# Callback для обработки успешных платежей
+# Callback для сохранения успешных платежей в очередь
 # Будет установлен из main.py
 _payment_callback: Optional[Callable[[dict], Awaitable[None]]] = None
 
 
 def set_payment_callback(callback: Callable[[dict], Awaitable[None]]):
     """
-    Установка callback-функции для обработки успешных платежей.
+    Установка callback-функции для приёма успешных платежей.
 
     Args:
-        callback: Async функция, принимающая данные платежа
+        callback: Async функция, принимающая поля уведомления (после проверки
+            подписи). Должна быстро сохранить уведомление; ошибка — ответ 503
     """
     global _payment_callback
     _payment_callback = callback
 
 
+# Путь, на который Telegram присылает апдейты
+TELEGRAM_WEBHOOK_PATH = os.getenv('TELEGRAM_WEBHOOK_PATH') or '/webhook/telegram'
+
+# Очередь апдейтов Telegram и secret_token, переданный в setWebhook.
+# Устанавливаются из main.py только в webhook-режиме
+_telegram_dispatcher: Optional[UpdateDispatcher] = None
+_telegram_secret: str = ''
+
+
+def set_telegram_dispatcher(dispatcher: Optional[UpdateDispatcher], secret_token: str = ''):
+    """
+    Включение приёма апдейтов Telegram.
+
+    Args:
+        dispatcher: Очередь с воркерами, в которую кладутся апдейты (None — выключить)
+        secret_token: Значение заголовка X-Telegram-Bot-Api-Secret-Token
+    """
+    global _telegram_dispatcher, _telegram_secret
+    _telegram_dispatcher = dispatcher
+    _telegram_secret = secret_token
+
+
+async def telegram_webhook(request: web.Request) -> web.Response:
+    """
+    Приём апдейта от Telegram.
+
+    Апдейт только ставится в очередь, ответ уходит сразу. Если очередь
+    заполнена — 503, Telegram повторит доставку позже.
+    """
+    if _telegram_dispatcher is None:
+        return web.Response(status=404)
+
+    received = request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+    if not hmac.compare_digest(received.encode(), _telegram_secret.encode()):
+        logger.warning(f"Telegram webhook: неверный secret token от {request.remote}")
+        return web.Response(status=401, text="Unauthorized")
+
+    try:
+        update = Update.model_validate(await request.json(), context={"bot": _telegram_dispatcher.bot})
+    except Exception as e:
+        logger.warning(f"Telegram webhook: некорректный апдейт: {e}")
+        return web.Response(status=400, text="Bad update")
+
+    if not _telegram_dispatcher.submit(update):
+        logger.warning(f"Telegram webhook: очередь заполнена, апдейт {update.update_id} отклонён")
+        return web.Response(status=503, text="Queue is full")
+
+    return web.Response(status=200)
+
+
 async def modulbank_webhook(request: web.Request) -> web.Response:
     """
     Обработчик webhook от Модуль Банка.
@@ -37,7 +96,9 @@ async def modulbank_webhook(request: web.Request) -> web.Response:
     Документация: https://sup.modulbank.ru/transaction_notifications
 
     Модуль Банк отправляет POST запрос с данными о платеже.
-    Нужно ответить 200 OK, иначе будет 14 повторных попыток.
+    Нужно ответить 200 OK, иначе будет 14 повторных попыток: 200
+    отвечаем, как только уведомление сохранено в очередь; если сохранить
+    не удалось — 503, чтобы Модуль Банк повторил доставку.
     """
     try:
         # Парсим данные из запроса
@@ -59,9 +120,13 @@ async def modulbank_webhook(request: web.Request) -> web.Response:
         if payment_data["is_success"]:
             logger.info(f"Успешный платёж: {payment_data['transaction_id']}, сумма: {payment_data['amount']}")
 
-            # Вызываем callback для обработки платежа
+            # Сохраняем уведомление, платёж обработается в фоне
             if _payment_callback:
-                await _payment_callback(payment_data)
+                try:
+                    await _payment_callback(data_dict)
+                except Exception as e:
+                    logger.error(f"Не удалось сохранить платёж {payment_data['transaction_id']}: {e}")
+                    return web.Response(status=503, text="Try again later")
             else:
                 logger.warning("Payment callback не установлен!")
         else:
@@ -80,11 +145,30 @@ async def health_check(request: web.Request) -> web.Response:
     return web.Response(status=200, text="OK")
 
 
+async def metrics_endpoint(request: web.Request) -> web.Response:
+    """
+    Метрики в формате Prometheus.
+
+    Если задан METRICS_TOKEN, требуется заголовок Authorization: Bearer <token>.
+    """
+    token = os.getenv("METRICS_TOKEN")
+    if token and request.headers.get("Authorization") != f"Bearer {token}":
+        return web.Response(status=401, text="Unauthorized")
+
+    return web.Response(
+        status=200,
+        body=render_metrics().encode("utf-8"),
+        headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"},
+    )
+
+
 def create_webhook_app() -> web.Application:
     """Создание aiohttp приложения для webhook."""
     app = web.Application()
     app.router.add_post('/webhook/modulbank', modulbank_webhook)
+    app.router.add_post(TELEGRAM_WEBHOOK_PATH, telegram_webhook)
     app.router.add_get('/health', health_check)
+    app.router.add_get('/metrics', metrics_endpoint)
     return app
 
 